@@ -1,12 +1,27 @@
 # app.py — Outf!ts (full, with Clear fix & bottom compact toggle)
+# 表示層のみ。データ操作・画像解析・採点などは outfits パッケージ（Streamlit 非依存）にある。
+# 起動は streamlit run serve.py（画像配信ルートを足した st.App。app.py 単体だと画像が出ない）
 import streamlit as st
-import pandas as pd, numpy as np
-from PIL import Image
-import sqlite3, os, io, requests, colorsys, calendar, json, re, html as ihtml
-from urllib.parse import urljoin, quote_plus
+import pandas as pd
+import os, calendar, json, re, html as ihtml
+import time, uuid, atexit, tempfile, shutil, threading
 from datetime import datetime
-from collections import defaultdict
-from math import sqrt
+from outfits import storage, backup, analytics, linking, reanalysis, sync
+from outfits.storage import (user_db_path, init_db, content_hash, insert_outfit,
+                             fetch_outfits_on, load_profile, save_profile, add_item, list_items, update_item,
+                             delete_item, load_item_imgs, save_coord, rate_coord, save_coords_batch, list_planned, confirm_coord,
+                             get_usage_stats, img_hashes, save_feedback, list_feedback, load_feedback_img, item_palettes)
+from outfits.colors import JP_COLOR, nearest_css_name, hex_luma
+from outfits.imaging import ANALYSIS_VERSION, decode_small, main_color_from_region, classify_top_or_bottom, region_hist, extract_palette, contact_sheet, SHEET_PAGE
+from outfits.media import media_url, media_gc, media_gc_after
+from outfits.ingest import fetch_from_page, guess_category_from_text, guess_material_from_text, guess_season_from_text
+from outfits.scoring import evaluate_outfit, load_pref_model, update_pref_model, pref_examples
+from outfits.recommend import generate_outfit, plan_outfits, shop_suggestions, CAT_JP
+from outfits.linking import (ensure_item_features, backfill_item_features, item_index_signature, match_items,
+                             LINK_AUTO_DIST, LINK_FEATURES_PER_RUN)
+from outfits.analytics import analytics_signature, FAMILY_COLORS
+from outfits.feedback import FeedbackOutbox
+from outfits.assets import AssetStore
 
 st.set_page_config(page_title="Outf!ts", layout="centered")
 
@@ -37,6 +52,7 @@ button[kind="primary"]{ background: var(--accent) !important; border:0 !importan
 .compact .swatch{width:18px;height:18px}
 .compact .pill{font-size:11px;padding:2px 6px}
 .compact .cap{font-size:11px}
+.media{width:100%;border-radius:8px;display:block}
 </style>
 """, unsafe_allow_html=True)
 
@@ -52,570 +68,204 @@ if ('serviceWorker' in navigator) {
 </script>
 """, unsafe_allow_html=True)
 
-# ---------- DB ----------
-DB_PATH = "data/app.db"
-def init_db():
-    os.makedirs("data", exist_ok=True)
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS outfits(
-          id INTEGER PRIMARY KEY AUTOINCREMENT,
-          d TEXT, season TEXT, top_sil TEXT, bottom_sil TEXT,
-          top_color TEXT, bottom_color TEXT, colors TEXT, img BLOB, notes TEXT
-        )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS profile(
-          id INTEGER PRIMARY KEY CHECK(id=1),
-          season TEXT, undertone TEXT, home_lat REAL, home_lon REAL, city TEXT,
-          body_shape TEXT, height_cm REAL
-        )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS items(
-          id INTEGER PRIMARY KEY AUTOINCREMENT,
-          name TEXT, category TEXT, color_hex TEXT, season_pref TEXT,
-          material TEXT, img BLOB, notes TEXT
-        )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS coords(
-          id INTEGER PRIMARY KEY AUTOINCREMENT,
-          created_at TEXT,
-          top_id INTEGER, bottom_id INTEGER, shoes_id INTEGER, bag_id INTEGER,
-          ctx TEXT, score REAL, rating INTEGER
-        )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS feedback(
-          id INTEGER PRIMARY KEY AUTOINCREMENT,
-          created_at TEXT,
-          kind TEXT, subject TEXT, body TEXT, contact TEXT,
-          img BLOB, meta TEXT
-        )""")
-        try: c.execute("ALTER TABLE profile ADD COLUMN body_shape TEXT")
-        except: pass
-        try: c.execute("ALTER TABLE profile ADD COLUMN height_cm REAL")
-        except: pass
-        conn.commit()
-
-def json_dumps(x): return json.dumps(x, ensure_ascii=False)
-
-def insert_outfit(d, season, top_sil, bottom_sil, top_color, bottom_color, colors_list, img_bytes, notes):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""INSERT INTO outfits(d,season,top_sil,bottom_sil,top_color,bottom_color,colors,img,notes)
-                     VALUES(?,?,?,?,?,?,?,?,?)""",
-                  (d, season, top_sil, bottom_sil, top_color, bottom_color, json_dumps(colors_list), img_bytes, notes))
-        conn.commit()
-
-def fetch_outfits_on(day_str):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        return c.execute("""SELECT id,d,season,top_sil,bottom_sil,top_color,bottom_color,colors,img,notes
-                            FROM outfits WHERE d=? ORDER BY id DESC""", (day_str,)).fetchall()
-
-def load_profile():
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        row = c.execute("SELECT season,undertone,home_lat,home_lon,city,body_shape,height_cm FROM profile WHERE id=1").fetchone()
-    return {"season":row[0],"undertone":row[1],"home_lat":row[2],"home_lon":row[3],
-            "city":row[4],"body_shape":row[5],"height_cm":row[6]} if row else \
-           {"season":None,"undertone":None,"home_lat":None,"home_lon":None,"city":None,"body_shape":None,"height_cm":None}
-
-def save_profile(**kwargs):
-    cur = load_profile()
-    cur.update({k:v for k,v in kwargs.items() if v is not None})
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""INSERT OR REPLACE INTO profile(id,season,undertone,home_lat,home_lon,city,body_shape,height_cm)
-                     VALUES(1,?,?,?,?,?,?,?)""",
-                  (cur["season"], cur["undertone"], cur["home_lat"], cur["home_lon"],
-                   cur["city"], cur["body_shape"], cur["height_cm"]))
-        conn.commit()
-
-def add_item(name, category, color_hex, season_pref, material, img_bytes, notes):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""INSERT INTO items(name,category,color_hex,season_pref,material,img,notes)
-                     VALUES(?,?,?,?,?,?,?)""", (name,category,color_hex,season_pref,material,img_bytes,notes))
-        conn.commit()
-
-def list_items(category=None):
-    q = "SELECT id,name,category,color_hex,season_pref,material,img,notes FROM items"
-    params=[]
-    if category and category!="すべて":
-        q += " WHERE category=?"; params=[category]
-    q += " ORDER BY id DESC"
-    with sqlite3.connect(DB_PATH) as conn:
-        return conn.cursor().execute(q, params).fetchall()
-
-def get_item(iid:int):
-    with sqlite3.connect(DB_PATH) as conn:
-        return conn.cursor().execute(
-            "SELECT id,name,category,color_hex,season_pref,material,img,notes FROM items WHERE id=?",(iid,)
-        ).fetchone()
-
-def update_item(iid:int, name, category, color_hex, season_pref, material, img_bytes_or_none, notes):
-    cur = get_item(iid)
-    if not cur: return
-    new_img = img_bytes_or_none if img_bytes_or_none is not None else cur[6]
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""UPDATE items SET name=?,category=?,color_hex=?,season_pref=?,material=?,img=?,notes=? WHERE id=?""",
-                  (name,category,color_hex,season_pref,material,new_img,notes,iid))
-        conn.commit()
-
-def delete_item(iid:int):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("DELETE FROM items WHERE id=?", (iid,))
-        for col in ["top_id","bottom_id","shoes_id","bag_id"]:
-            c.execute(f"UPDATE coords SET {col}=NULL WHERE {col}=?", (iid,))
-        conn.commit()
-
-def save_coord(top_id, bottom_id, shoes_id, bag_id, ctx:dict, ai_score:float):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""INSERT INTO coords(created_at,top_id,bottom_id,shoes_id,bag_id,ctx,score,rating)
-                     VALUES(?,?,?,?,?,?,?,?)""",
-                  (datetime.utcnow().isoformat(), top_id, bottom_id, shoes_id, bag_id, json_dumps(ctx), float(ai_score), int(round(ai_score))))
-        conn.commit()
-
-def get_usage_stats():
-    with sqlite3.connect(DB_PATH) as conn:
-        rows = conn.cursor().execute("SELECT created_at, top_id, bottom_id, shoes_id, bag_id FROM coords").fetchall()
-    use_count = defaultdict(int); last_used = {}
-    for created_at, t, b, s, g in rows:
-        for iid in [t,b,s,g]:
-            if iid is None: continue
-            use_count[iid] += 1
-            if (iid not in last_used) or (created_at > last_used[iid]): last_used[iid] = created_at
-    return use_count, last_used
-
-# ----- お問い合わせ -----
-def save_feedback(kind, subject, body, contact, img_bytes, meta:dict):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""INSERT INTO feedback(created_at,kind,subject,body,contact,img,meta)
-                     VALUES(?,?,?,?,?,?,?)""",
-                  (datetime.utcnow().isoformat(), kind, subject, body, contact, img_bytes,
-                   json.dumps(meta, ensure_ascii=False)))
-        conn.commit()
-
-def list_feedback(limit=30):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        return c.execute("""SELECT id,created_at,kind,subject,body,contact,img,meta
-                            FROM feedback ORDER BY id DESC LIMIT ?""", (int(limit),)).fetchall()
-
-def send_github_issue(repo:str, token:str, title:str, body:str):
+# ---------- ユーザー識別（DB シャードの選択） ----------
+def current_user_key() -> str:
+    """Streamlit 認証のメール、なければ URL の ?u= セッショントークンでユーザーを識別"""
     try:
-        headers={"Authorization": f"token {token}", "Accept":"application/vnd.github+json"}
-        url=f"https://api.github.com/repos/{repo}/issues"
-        r=requests.post(url, headers=headers, json={"title": title, "body": body}, timeout=10)
-        if r.status_code==201:
-            return True, r.json().get("html_url")
-        return False, f"HTTP {r.status_code}"
-    except Exception as e:
-        return False, str(e)
+        u = getattr(st, "user", None) or getattr(st, "experimental_user", None)
+        if u is not None and u.get("is_logged_in", True) and u.get("email"):
+            return "user:" + u.get("email").lower()
+    except: pass
+    tok = st.session_state.get("user_token") or st.query_params.get("u")
+    if not tok or not re.fullmatch(r"[0-9a-f]{32}", tok):
+        tok = uuid.uuid4().hex
+    st.session_state["user_token"] = tok
+    if st.query_params.get("u") != tok: st.query_params["u"] = tok
+    return "tok:" + tok
+
+# ---------- お問い合わせの GitHub 送信（プロセスで 1 つの outbox） ----------
+@st.cache_resource
+def feedback_outbox(repo, token):
+    ob = FeedbackOutbox(repo, token)
+    atexit.register(ob.close)
+    return ob
+
+def github_secrets():
+    try:
+        if "GH_REPO" in st.secrets and "GH_TOKEN" in st.secrets: return st.secrets["GH_REPO"], st.secrets["GH_TOKEN"]
+    except Exception: pass
+    return None
+
+# ---------- リモートとの同期（設定されていれば。プロセスで 1 つのバックグラウンドスレッド） ----------
+@st.cache_resource
+def sync_service(url, key):
+    svc = sync.SyncService(sync.RestRemote(url, key))
+    atexit.register(svc.close)
+    return svc
+
+def sync_secrets():
+    try:
+        if "SYNC_URL" in st.secrets and "SYNC_KEY" in st.secrets: return st.secrets["SYNC_URL"], st.secrets["SYNC_KEY"]
+    except Exception: pass
+    return (sync.SYNC_URL, sync.SYNC_KEY) if sync.SYNC_URL else None
+
+# ---------- セッションの一時データ（画像本体はアセットストア、state にはハンドルだけ） ----------
+@st.cache_resource
+def asset_store():
+    store = AssetStore()
+    atexit.register(store.close)
+    return store
+
+def _session_id():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        return get_script_run_ctx().session_id
+    except Exception:
+        return "local"
+
+def stash(key, data):
+    """data を退避して st.session_state[key] にハンドルを置く（None なら消す）"""
+    old = st.session_state.pop(key, None)
+    if old: asset_store().release(_session_id(), old)
+    if data: st.session_state[key] = asset_store().put(_session_id(), data)
+
+def unstash(key):
+    data = asset_store().get(_session_id(), st.session_state.get(key))
+    if data is None: st.session_state.pop(key, None)   # 上限超過で手放された
+    return data
 
 # ---------- セッション保持アップローダ（クリアで画像も消す） ----------
 def persistent_uploader(label: str, key: str, types=("jpg","jpeg","png","webp")):
-    up = st.file_uploader(label, type=list(types), key=f"{key}_uploader")
-    if up is not None:
-        st.session_state[f"{key}_bytes"] = up.read()
+    gen = st.session_state.get(f"{key}_gen", 0)
+    up = st.file_uploader(label, type=list(types), key=f"{key}_uploader_{gen}")
+    # {key}_inject: 負荷試験（outfits.loadtest）からの投入口。AppTest はファイルアップロードを操作できない
+    data = up.getvalue() if up is not None else st.session_state.pop(f"{key}_inject", None)
+    if data is not None:
+        # 退避したらアップローダを作り直し、Streamlit 側が持つアップロードの複製を手放す
+        stash(f"{key}_asset", data)
+        st.session_state[f"{key}_gen"] = gen + 1
+        st.rerun()
 
     cols = st.columns([4,1])
     with cols[1]:
         if st.button("クリア", key=f"{key}_clear", help="選択中の画像をクリア"):
-            st.session_state.pop(f"{key}_bytes", None)      # 画像データを消す
-            st.session_state.pop(f"{key}_uploader", None)   # アップローダ内部状態も消す
+            stash(f"{key}_asset", None)                     # 画像データを消す
             st.rerun()                                      # 即再描画
-    return st.session_state.get(f"{key}_bytes")
-
-# ---------- Color utils ----------
-CSS_COLORS = {
- "Black":"#000000","White":"#ffffff","Gray":"#808080","Silver":"#c0c0c0","DimGray":"#696969",
- "Navy":"#000080","MidnightBlue":"#191970","RoyalBlue":"#4169e1","Blue":"#0000ff","DodgerBlue":"#1e90ff",
- "LightBlue":"#add8e6","Teal":"#008080","Aqua":"#00ffff","Turquoise":"#40e0d0",
- "Green":"#008000","Lime":"#00ff00","Olive":"#808000","ForestGreen":"#228b22","SeaGreen":"#2e8e57",
- "Yellow":"#ffff00","Gold":"#ffd700","Khaki":"#f0e68c","Beige":"#f5f5dc","Tan":"#d2b48c",
- "Orange":"#ffa500","Coral":"#ff7f50","Tomato":"#ff6347","Red":"#ff0000","Maroon":"#800000",
- "Pink":"#ffc0cb","HotPink":"#ff69b4","Magenta":"#ff00ff","Purple":"#800080","Indigo":"#4b0082",
- "Lavender":"#e6e6fa","Plum":"#dda0dd","Brown":"#a52a2a","Chocolate":"#d2691e","SaddleBrown":"#8b4513"
-}
-JP_COLOR = {"Black":"ブラック","White":"ホワイト","Gray":"グレー","Silver":"シルバー","DimGray":"ダークグレー",
-"Navy":"ネイビー","MidnightBlue":"ミッドナイトブルー","RoyalBlue":"ロイヤルブルー","Blue":"ブルー","DodgerBlue":"ドッジャーブルー",
-"LightBlue":"ライトブルー","Teal":"ティール","Aqua":"アクア","Turquoise":"ターコイズ",
-"Green":"グリーン","Lime":"ライム","Olive":"オリーブ","ForestGreen":"フォレストグリーン","SeaGreen":"シーグリーン",
-"Yellow":"イエロー","Gold":"ゴールド","Khaki":"カーキ","Beige":"ベージュ","Tan":"タン",
-"Orange":"オレンジ","Coral":"コーラル","Tomato":"トマト","Red":"レッド","Maroon":"マルーン",
-"Pink":"ピンク","HotPink":"ホットピンク","Magenta":"マゼンタ","Purple":"パープル","Indigo":"インディゴ",
-"Lavender":"ラベンダー","Plum":"プラム","Brown":"ブラウン","Chocolate":"チョコレート","SaddleBrown":"サドルブラウン"}
-
-def hex_to_rgb(h): h=h.lstrip("#"); return tuple(int(h[i:i+2],16) for i in (0,2,4))
-def rgb_to_hex(rgb): return "#{:02x}{:02x}{:02x}".format(*rgb)
-def hex_luma(h): r,g,b=hex_to_rgb(h); return 0.2126*r+0.7152*g+0.0722*b
-
-def nearest_css_name(hexstr):
-    r,g,b = hex_to_rgb(hexstr); best=None; bd=10**9
-    for name,hx in CSS_COLORS.items():
-        rr,gg,bb = hex_to_rgb(hx); d=(r-rr)**2+(g-gg)**2+(b-bb)**2
-        if d<bd: bd, best=d, name
-    return best
-
-def hex_family(hx):
-    r,g,b=[v/255 for v in hex_to_rgb(hx)]
-    h,s,v=colorsys.rgb_to_hsv(r,g,b); hue=h*360
-    if v<0.15: return "black"
-    if s<0.15 and v>0.9: return "white"
-    if s<0.20: return "gray"
-    if 0<=hue<15: return "red"
-    if 15<=hue<45: return "orange"
-    if 45<=hue<65: return "yellow"
-    if 65<=hue<170: return "green"
-    if 170<=hue<200: return "cyan"
-    if 200<=hue<255: return "blue"
-    if 255<=hue<290: return "purple"
-    if 290<=hue<330: return "magenta"
-    return "red"
-
-def adjust_harmony(hx, mode="complement", delta=30):
-    r,g,b=[v/255 for v in hex_to_rgb(hx)]
-    h,s,v=colorsys.rgb_to_hsv(r,g,b)
-    def wrap(deg): return ((h*360+deg)%360)/360
-    hs = [wrap(180)] if mode=="complement" else ([wrap(+delta),wrap(-delta)] if mode=="analogous" else [wrap(+120),wrap(-120)])
-    outs=[]
-    for hh in hs:
-        rr,gg,bb=colorsys.hsv_to_rgb(hh,s,v); outs.append(rgb_to_hex((int(rr*255),int(gg*255),int(bb*255))))
-    return outs
-
-# ---------- HSVなど補助 ----------
-def _hsv_from_rgb(arrf):
-    r,g,b = arrf[...,0],arrf[...,1],arrf[...,2]
-    mx = np.max(arrf,axis=2); mn = np.min(arrf,axis=2); diff = mx-mn
-    h = np.zeros_like(mx)
-    mask = diff!=0
-    r2 = ((mx==r) & mask); g2 = ((mx==g) & mask); b2 = ((mx==b) & mask)
-    h[r2] = (60*((g-b)/diff)%360)[r2]
-    h[g2] = (60*((b-r)/diff)+120)[g2]
-    h[b2] = (60*((r-g)/diff)+240)[b2]
-    s = np.where(mx==0, 0, diff/mx); v = mx
-    return h, s, v
-
-def _clothing_mask(arrf):
-    cmax = np.max(arrf, axis=2); cmin = np.min(arrf, axis=2)
-    sat  = (cmax - cmin); val = cmax
-    return ((sat > 0.12) | (val < 0.75)) & (val < 0.98)
-
-def _skin_score(arrf):
-    H,S,V = _hsv_from_rgb(arrf)
-    mask = ((H<=50) | (H>=330)) & (S>=0.15) & (S<=0.68) & (V>=0.20) & (V<=0.95)
-    return float(mask.mean())
-
-# ---- 前景マスク（彩度/暗度×サリエンシー×中心重み）と重み付中央値 ----
-def _weighted_quantile(values, weights, q=0.5):
-    if len(values) == 0: return 0.0
-    sorter = np.argsort(values)
-    v = values[sorter]; w = weights[sorter]
-    cw = np.cumsum(w); cutoff = q * cw[-1]
-    idx = np.searchsorted(cw, cutoff)
-    return float(v[min(idx, len(v)-1)])
-
-def _foreground_mask(arrf):
-    cloth = _clothing_mask(arrf)
-    mean = arrf.reshape(-1,3).mean(axis=0)
-    sal = np.sqrt(((arrf-mean)**2).sum(axis=2))
-    if sal.max()>1e-6: sal = sal/sal.max()
-    h, w = arrf.shape[:2]
-    yy, xx = np.mgrid[0:h, 0:w]
-    cx, cy = w/2, h/2
-    sigma = max(h, w) / 3.5
-    center = np.exp(-(((xx-cx)**2 + (yy-cy)**2)/(2*sigma*sigma)))
-    H,S,V = _hsv_from_rgb(arrf)
-    dark_neutral = (S < 0.25) & (V < 0.35)
-    m = (cloth & (sal > 0.15)) | (cloth & (center > 0.30)) | dark_neutral
-    weights = np.clip(0.6*sal + 0.4*center, 0.0, 1.0)
-    return m, weights
-
-# ---- 主色抽出（領域別・精密版 / 黒や白の中立色スナップ） ----
-def main_color_from_region(img: Image.Image, region: str) -> str:
-    w, h = img.size
-    crop = img.crop((0, 0, w, h//2)) if region == "upper" else img.crop((0, h//2, w, h))
-    small = crop.copy(); small.thumbnail((256, 256))
-    arr = np.asarray(small).astype(np.float32) / 255.0
-
-    mask, wts = _foreground_mask(arr)
-    if mask.sum() < 50:
-        arr = np.asarray(small).astype(np.float32) / 255.0
-        mask = np.ones(arr.shape[:2], bool)
-        wts = np.ones(arr.shape[:2], np.float32)
-
-    sel = arr[mask]; wsel = wts[mask]
-    if len(sel) == 0:
-        sel = arr.reshape(-1,3); wsel = np.ones(len(sel), np.float32)
-
-    R = _weighted_quantile(sel[:,0], wsel, 0.5)
-    G = _weighted_quantile(sel[:,1], wsel, 0.5)
-    B = _weighted_quantile(sel[:,2], wsel, 0.5)
-    r,g,b = float(R), float(G), float(B)
-
-    h_, s_, v_ = colorsys.rgb_to_hsv(r, g, b)
-    if s_ < 0.10:
-        if v_ < 0.18: r=g=b=0.07
-        elif v_ < 0.35: r=g=b=0.16
-        elif v_ > 0.92: r=g=b=0.97
-        else: r=g=b=v_
-
-    return rgb_to_hex((int(r*255), int(g*255), int(b*255)))
-
-# --- 上/下判定（重心×面積×靴エッジ×デニム×肌色帯） ---
-def classify_top_or_bottom(img: Image.Image) -> str:
-    arr = np.asarray(img.resize((224, 224))).astype(np.float32)/255.0
-    H,S,V = _hsv_from_rgb(arr)
-    mask, salw = _foreground_mask(arr)
-
-    row_w = (mask*salw).mean(axis=1)
-    if row_w.sum() == 0: return "トップス"
-    centroid = float(np.average(np.arange(row_w.size), weights=row_w) / row_w.size)
-    vote_top = 0; vote_bot = 0
-    if centroid > 0.56: vote_bot += 2
-    elif centroid < 0.46: vote_top += 2
-
-    mid = arr.shape[0]//2
-    up_m, lo_m = mask[:mid,:].mean(), mask[mid:,:].mean()
-    if lo_m >= up_m*1.10: vote_bot += 1
-    elif up_m >= lo_m*1.05: vote_top += 1
-
-    edge = np.abs(np.diff(arr, axis=1, prepend=arr[:,:1,:])).mean(axis=2)
-    edge_row = edge.mean(axis=1)
-    peak = np.argmax(edge_row)/edge_row.size
-    if 0.55 <= peak <= 0.95: vote_bot += 1
-    if 0.15 <= peak <= 0.45: vote_top += 1
-
-    bh = int(0.18*edge.shape[0])
-    bottom = arr[-bh:,:,:]
-    ebot = edge[-bh:,:]
-    contrast = (np.max(bottom, axis=2) - np.min(bottom, axis=2))
-    shoe_score = float(((contrast > 0.35) & (ebot > 0.10)).mean())
-    if shoe_score > 0.07: vote_bot += 2
-
-    lowerH, lowerS, lowerV = H[mid:,:], S[mid:,:], V[mid:,:]
-    denim_like = (((lowerH >= 195) & (lowerH <= 260)) | (lowerS < 0.20)) & (lowerV < 0.55)
-    if float(denim_like.mean()) > 0.08: vote_bot += 1
-
-    up_band = arr[:int(0.28*arr.shape[0]),:,:]
-    if _skin_score(up_band) > 0.03: vote_top += 1
-
-    return "ボトムス" if vote_bot >= vote_top else "トップス"
-
-# ---------- URL取込 ----------
-UA = {"User-Agent":"Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1","Accept-Language":"ja,en;q=0.8"}
-def _decode_best(r):
-    b = r.content; cands=[]
-    if getattr(r, "encoding", None): cands.append(r.encoding)
-    if getattr(r, "apparent_encoding", None): cands.append(r.apparent_encoding)
-    cands += ["utf-8","cp932","shift_jis","euc-jp"]
-    for enc in cands:
-        try:
-            s = b.decode(enc)
-            if "Ã" in s or "Â" in s:
-                try:
-                    s2 = s.encode("latin-1","ignore").decode("utf-8","ignore")
-                    if len(s2.replace("�","")) > len(s.replace("�","")): s = s2
-                except: pass
-            return s
-        except: continue
-    return b.decode("utf-8", errors="ignore")
-def _meta(content, name):
-    m=re.search(rf'<meta[^>]+(?:property|name)=["\']{re.escape(name)}["\'][^>]+content=["\']([^"\']+)["\']', content, re.I)
-    return ihtml.unescape(m.group(1)) if m else None
-def _jsonld_image(content):
-    for m in re.finditer(r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', content, re.I|re.S):
-        try:
-            data=json.loads(m.group(1))
-            if isinstance(data, list):
-                for d in data:
-                    if isinstance(d, dict) and d.get("image"):
-                        img=d["image"]; return img[0] if isinstance(img, list) else img
-            elif isinstance(data, dict) and data.get("image"):
-                img=data["image"]; return img[0] if isinstance(img, list) else img
-        except: pass
-    return None
-def fetch_from_page(url:str):
+    return unstash(f"{key}_asset")
+
+# ---------- 保存の完了通知（書き込みキューの Future を次の描画で確認） ----------
+def track_write(fut, ok_msg="保存しました"):
+    st.session_state.setdefault("pending_writes", []).append((fut, ok_msg))
+
+def report_writes():
+    keep = []
+    for fut, msg in st.session_state.get("pending_writes", []):
+        if not fut.done(): keep.append((fut, msg)); continue
+        err = fut.exception()
+        if err is None: st.toast(msg, icon="✅")
+        else: st.toast(f"保存に失敗しました: {err}", icon="⚠️")
+    st.session_state["pending_writes"] = keep
+
+# ---------- 画像表示 / コンタクトシート ----------
+@st.cache_resource(max_entries=16, show_spinner=False)
+def small_image(h, _data):
+    """縮小デコードした画像を 1 枚だけ作り、プレビューと解析（色/上下判定/照合）で共有する。読み取り専用"""
+    return decode_small(_data)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def photo_category(h, _img) -> str:
+    return classify_top_or_bottom(_img)
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def region_colors(h, region, _img) -> tuple:
+    """(主色, パレット)。画像の内容ハッシュ h・領域ごとに 1 回だけ解析する（再描画のたびに k-means を回さない）"""
+    return main_color_from_region(_img, region), extract_palette(_img, region)
+
+def show_media(h, blob, w=640, alt="") -> bool:
+    url = media_url(h, blob, w)
+    if url: st.markdown(f"<img class='media' src='{url}' alt='{ihtml.escape(alt)}' loading='lazy'>", unsafe_allow_html=True)
+    return url is not None
+
+def tile_picker(label, options, format_func, key, on_pick):
+    """シート上のセルに対応するクリック先。選択が変わった時だけ on_pick を呼ぶ"""
+    def _cb():
+        v = st.session_state.get(key)
+        if v is not None: on_pick(v)
+    if hasattr(st, "pills"):
+        st.pills(label, list(options), format_func=format_func, key=key, on_change=_cb)
+    else:
+        st.selectbox(label, [None]+list(options), format_func=lambda v: "—" if v is None else format_func(v),
+                     key=key, on_change=_cb)
+
+@st.cache_data(max_entries=48, show_spinner=False)
+def calendar_sheet(db_path, days:tuple, month:int, sig) -> tuple:
+    """月グリッドのシート。sig（件数, 最大id）が変わった時だけ作り直す"""
+    with storage.pool().connect(db_path) as conn:
+        rows = conn.execute("""SELECT d, img FROM outfits WHERE id IN
+                               (SELECT MAX(id) FROM outfits WHERE d BETWEEN ? AND ? GROUP BY d)""",
+                            (days[0], days[-1])).fetchall()
+    by_day = dict(rows)
+    labels = [str(int(d[-2:])) for d in days]
+    dim = [int(d[5:7]) != month for d in days]
+    return contact_sheet([by_day.get(d) for d in days], 7, labels=labels, dim=dim), tuple(d for d in days if d in by_day)
+
+def calendar_signature(start, end):
+    with storage.db() as conn:
+        return conn.execute("SELECT COUNT(*), MAX(id) FROM outfits WHERE d BETWEEN ? AND ?", (start, end)).fetchone()
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def closet_sheet(key:tuple, cols:int) -> bytes:
+    # key = ((iid, 画像の内容ハッシュ), ...)。画像本体は作り直す時だけ読む
+    imgs = load_item_imgs([iid for iid, h in key if h])
+    return contact_sheet([imgs.get(iid) for iid, _ in key], cols, labels=[str(i+1) for i in range(len(key))])
+
+@st.cache_resource(show_spinner=False)
+def media_sweep():
+    # プロセスで 1 回、どのシャードからも参照されなくなった配信ファイルを裏で掃除する（同期で消えた分など）
+    t = threading.Thread(target=media_gc, name="media-gc", daemon=True); t.start()
+    return t
+
+# ---------- 照合・集計のキャッシュ（sig が変わった時だけ再計算） ----------
+@st.cache_resource(show_spinner=False)
+def item_features_backfill(db_path):
+    # シャードごとにプロセスで 1 回。未計算のヒストグラムを裏で作る（作り終わると item_index_signature が変わる）
+    return backfill_item_features(db_path)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def item_index(db_path, sig) -> dict:
+    return linking.item_index(db_path)
+
+def choice_pills(label, options, format_func, key, default=None):
+    if hasattr(st, "pills"):
+        return st.pills(label, options, format_func=format_func, key=key, default=default)
+    opts = [None] + list(options)
+    return st.radio(label, opts, format_func=lambda v: "なし" if v is None else format_func(v),
+                    index=opts.index(default), horizontal=True, key=key)
+
+def palette_html(pal, label="") -> str:
+    """[(hex, 面積比)] をスウォッチ + % の 1 行にする"""
+    head = f"<span class='badge'>{label}</span> " if label else ""
+    return head + " ".join(f"<span class='swatch' style='background:{h}'></span>{w*100:.0f}%" for h, w in pal)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def wardrobe_analytics(db_path, sig) -> dict:
+    return analytics.wardrobe_analytics(db_path)
+
+# ---------- 色の再解析（アルゴリズム更新後。ジョブはホストで 1 つで、全シャードを順に回る） ----------
+@st.cache_resource(show_spinner=False)
+def reanalysis_autostart(db_path, version):
     try:
-        r=requests.get(url, timeout=10, headers=UA)
-        if r.status_code!=200: return None,None,None
-        html=_decode_best(r)
-        title = _meta(html,"og:title") or _meta(html,"twitter:title")
-        if not title:
-            t2=re.search(r'<title[^>]*>(.*?)</title>', html, re.I|re.S)
-            title=ihtml.unescape(t2.group(1).strip()) if t2 else None
-        desc  = _meta(html,"og:description") or _meta(html,"description")
-        img_url = _meta(html,"og:image:secure_url") or _meta(html,"og:image") or _meta(html,"twitter:image")
-        if not img_url: img_url = _jsonld_image(html)
-        if img_url: img_url=urljoin(url, img_url)
-        img_bytes=None
-        if img_url:
-            try:
-                r2=requests.get(img_url, timeout=10, headers=UA)
-                if r2.status_code==200: img_bytes=r2.content
-            except: pass
-        return title, img_bytes, desc
-    except:
-        return None, None, None
-
-# ---- テキスト→推定（カテゴリ/素材/季節） ----
-CAT_MAP = {
-    "トップス":["tシャツ","tee","シャツ","ブラウス","スウェット","パーカー","ニット","セーター","カーディガン","トップス","pullover","hoodie","sweat","blouse"],
-    "ボトムス":["パンツ","デニム","ジーンズ","スラックス","トラウザー","スカート","ショーツ","ハーフパンツ","shorts","trousers","skirt","jeans"],
-    "アウター":["コート","ジャケット","ブルゾン","ダウン","アウター","マウンテン","ライダース","gジャン","jacket","coat"],
-    "ワンピース":["ワンピース","ドレス","ジャンパースカート","one-piece","dress"],
-    "シューズ":["スニーカー","ブーツ","パンプス","サンダル","shoes","sneaker","boots","heels"],
-    "バッグ":["バッグ","トート","ショルダー","バックパック","リュック","bag","tote","shoulder","backpack"],
-    "アクセ":["帽子","キャップ","ハット","ベルト","マフラー","ストール","アクセ","ネックレス","ピアス","cap","hat","scarf","belt","accessory"]
-}
-MAT_KEYS = ["コットン","綿","ウール","ナイロン","ポリエステル","リネン","麻","デニム","レザー","合皮","カシミヤ","シルク","ダウン","フリース"]
-def guess_category_from_text(text:str)->str:
-    t=(text or "").lower()
-    for cat, kws in CAT_MAP.items():
-        if any(k.lower() in t for k in kws): return cat
-    return "トップス"
-def guess_material_from_text(text:str)->str|None:
-    t=text or ""
-    for k in MAT_KEYS:
-        if k in t: return k
-    return None
-def guess_season_from_text(text:str)->str|None:
-    t=(text or "").lower()
-    if any(k in t for k in ["春夏","ss","summer","春/夏"]): return "summer"
-    if any(k in t for k in ["秋冬","fw","winter","秋/冬"]): return "winter"
-    return None
-
-# ---------- 評価 ----------
-SEASON_PALETTES = {
-    "spring": ["#ffb3a7","#ffd28c","#ffe680","#b7e07a","#8ed1c8","#ffd7ef","#f5deb3"],
-    "summer": ["#c8cbe6","#b0c4de","#c3b1e1","#9fd3c7","#d8d8d8","#e6d5c3","#a3bcd6"],
-    "autumn": ["#a0522d","#c68642","#8f9779","#556b2f","#b5651d","#6b4f3f","#8b6c42"],
-    "winter": ["#000000","#ffffff","#4169e1","#8a2be2","#ff1493","#00ced1","#2f4f4f"],
-}
-def palette_distance(hexstr, user_season):
-    if not user_season or user_season not in SEASON_PALETTES: return 0.0
-    px=hex_to_rgb(hexstr); best=1e9
-    for p in SEASON_PALETTES[user_season]:
-        rr,gg,bb=hex_to_rgb(p)
-        d=(px[0]-rr)**2+(px[1]-gg)**2+(px[2]-bb)**2
-        if d<best: best=d
-    return sqrt(best)
-def rgb_dist(h1,h2):
-    r1,g1,b1=hex_to_rgb(h1); r2,g2,b2=hex_to_rgb(h2)
-    return sqrt((r1-r2)**2+(g1-g2)**2+(b1-b2)**2)
-MAXD = sqrt(255**2*3)
-def harmony_score(top_hex, others):
-    if not others: return 0
-    ds=[]
-    for hx in others:
-        if not hx: continue
-        d=rgb_dist(top_hex, hx)
-        s = max(0.0, 1.0 - d/MAXD)
-        ds.append(s)
-    if not ds: return 0
-    return 40 * (sum(ds)/len(ds))
-def palette_score(hexes, user_season):
-    if not user_season: return 15
-    ss=[]
-    for hx in hexes:
-        d = palette_distance(hx, user_season)
-        s = max(0.0, 1.0 - d/MAXD)
-        ss.append(s)
-    return 30 * (sum(ss)/len(ss)) if ss else 0
-def climate_bonus(material, heat, humidity, rainy):
-    m=(material or "").lower(); s=0
-    if heat in ["暑い","猛暑"] and any(k in m for k in ["linen","リネン","cotton","コットン","メッシュ","ドライ"]): s+=1
-    if heat in ["寒い"] and any(k in m for k in ["wool","ウール","ダウン","中綿","フリース","キルト"]): s+=1
-    if humidity=="湿度高い" and any(k in m for k in ["ドライ","吸汗","速乾","メッシュ","ナイロン","nylon"]): s+=1
-    if humidity=="乾燥" and any(k in m for k in ["ウール","ニット","フリース"]): s+=1
-    if rainy and any(k in m for k in ["ナイロン","nylon","ゴア","gore","防水","撥水"]): s+=1
-    return s
-def purpose_match(notes, want):
-    if not want or want=="指定なし": return 0
-    n=(notes or ""); pts=0
-    if want=="通勤":     pts += any(k in n for k in ["ジャケット","シャツ","スラックス","革靴","きれいめ"])
-    if want=="デート":   pts += any(k in n for k in ["綺麗め","スカート","ワンピ","ヒール","上品"])
-    if want=="カジュアル":pts += any(k in n for k in ["デニム","スニーカー","カジュアル","リラックス"])
-    if want=="スポーツ": pts += any(k in n for k in ["スニーカー","ジャージ","ドライ","ラン","トレ"])
-    if want=="フォーマル":pts += any(k in n for k in ["ネクタイ","セットアップ","ドレス","革靴"])
-    if want=="雨の日":  pts += any(k in n for k in ["撥水","防水","ゴア","レイン","ナイロン"])
-    return int(bool(pts))
-def body_shape_bonus(notes, body, category):
-    if not body: return 0
-    n=(notes or "").lower(); b=body
-    if b=="straight":
-        if category=="ボトムス" and any(k in n for k in ["テーパード","センタープレス","ストレート"]): return 1
-        if category in ["トップス","アウター"] and any(k in n for k in ["vネック","襟","ジャケット","構築的"]): return 1
-    if b=="wave":
-        if category=="ボトムス" and any(k in n for k in ["ハイウエスト","aライン","フレア"]): return 1
-        if category=="トップス" and any(k in n for k in ["短丈","クロップド","柔らか","リブ"]): return 1
-    if b=="natural":
-        if any(k in n for k in ["ワイド","オーバーサイズ","ドロップショルダー","リネン","ツイード"]): return 1
-    return 0
-def evaluate_outfit(outfit, season, body_shape, want, heat, humidity, rainy):
-    items = [outfit[k] for k in ["top","bottom","shoes","bag"] if outfit.get(k)]
-    hexes = [it[3] for it in items if it]
-    top_hex = outfit["top"][3] if outfit.get("top") else (hexes[0] if hexes else "#2f2f2f")
-    sc_harmony = harmony_score(top_hex, [h for h in hexes[1:]])
-    sc_palette = palette_score(hexes, season)
-    clim = sum([climate_bonus(it[5], heat, humidity, rainy) for it in items]); sc_climate = min(clim, 4) / 4 * 20
-    purp = sum([purpose_match(it[7], want) for it in items]); sc_purpose = min(purp, 2) / 2 * 10
-    bodyb = sum([body_shape_bonus(it[7], body_shape, it[2]) for it in items]); sc_body = min(bodyb, 3) / 3 * 10
-    total = round(max(0.0, min(100.0, sc_harmony + sc_palette + sc_climate + sc_purpose + sc_body)), 1)
-    goods=[]; bads=[]
-    if sc_harmony >= 28: goods.append("トップと他アイテムの**色相バランス**が良い")
-    else: bads.append("配色の一体感が弱め。**補色/類似色**を意識するとまとまりやすい")
-    if sc_palette >= 20: goods.append("**パーソナルカラー**に合うトーン")
-    else: bads.append("PCから少し外れ気味。**優先パレット**寄りの色に寄せると◎")
-    if sc_climate >= 12: goods.append("**気候**に合った素材選び")
-    else: bads.append("気候との相性が弱い素材あり")
-    if sc_purpose >= 6: goods.append("用途（シーン）に対する**TPO**が合っている")
-    else: bads.append("TPO要素が弱い")
-    if sc_body >= 6: goods.append("体型に合う**シルエット**/ディテール")
-    else: bads.append("体型補正が弱め")
-    comp = adjust_harmony(top_hex, "complement")[0]
-    ana  = adjust_harmony(top_hex, "analogous")
-    tri  = adjust_harmony(top_hex, "triadic")
-    suggest = sorted([comp, ana[0], tri[0]], key=lambda h: palette_distance(h, season))
-    def jp_name(hx): return JP_COLOR.get(nearest_css_name(hx), nearest_css_name(hx))
-    suggestions = [{"hex":h, "name":jp_name(h)} for h in suggest]
-    breakdown = {"Harmony(40)": round(sc_harmony,1),"PC Fit(30)": round(sc_palette,1),
-                 "Climate(20)": round(sc_climate,1),"Purpose(10)": round(sc_purpose,1),"Body(10)": round(sc_body,1)}
-    return total, goods, bads, suggestions, breakdown
-
-# ---------- オンライン提案 ----------
-SHOP_LINKS = {
-    "ZOZOTOWN": "https://www.google.com/search?q=",
-    "UNIQLO": "https://www.uniqlo.com/jp/ja/search?q=",
-    "GU": "https://www.gu-global.com/jp/ja/search/?q=",
-    "MUJI": "https://www.muji.com/jp/ja/search/?query=",
-    "Rakuten": "https://search.rakuten.co.jp/search/mall/",
-    "Amazon": "https://www.amazon.co.jp/s?k=",
-    "WEAR": "https://wear.jp/item/?keyword=",
-}
-CAT_JP = {"トップス":"トップス","ボトムス":"パンツ","シューズ":"スニーカー","バッグ":"バッグ"}
-def shop_suggestions(category:str, base_hex:str, season:str|None):
-    color_jp = JP_COLOR.get(nearest_css_name(base_hex), "ベーシック")
-    season_jp = {"spring":"春","summer":"夏","autumn":"秋","winter":"冬"}.get(season or "", "")
-    kw = f"{color_jp} {CAT_JP.get(category, category)} {season_jp}".strip()
-    out=[]
-    for site, base in SHOP_LINKS.items():
-        if site=="ZOZOTOWN":
-            q = quote_plus(f"site:zozo.jp {kw}"); url = base + q
-        elif site=="Rakuten":
-            url = base + quote_plus(kw) + "/"
-        else:
-            url = base + quote_plus(kw)
-        out.append({"site":site, "kw":kw, "url":url})
-    return out
+        if any(reanalysis.pending(db_path).values()): reanalysis.launch(first=db_path)
+    except Exception: pass
+    return True
 
 # ---------- UI ----------
-init_db()
+DB_PATH = user_db_path(current_user_key())
+init_db(DB_PATH)   # このスレッド（セッション）の読み書き先
+reanalysis_autostart(DB_PATH, ANALYSIS_VERSION)
+media_sweep()
+SYNC_CFG = sync_secrets()
+if SYNC_CFG: sync_service(*SYNC_CFG).touch(DB_PATH)
 profile = load_profile()
 
 # 上部ではセッション値だけ参照（トグル自体は一番下に配置）
@@ -623,12 +273,15 @@ compact = st.session_state.get("compact", True)
 st.markdown("<div class='compact'>" if compact else "<div>", unsafe_allow_html=True)
 
 st.title("Outf!ts")
-tab1, tabCal, tabCloset, tabAI, tabProfile, tabContact = st.tabs(
-    ["📒 記録","📅 カレンダー","🧳 クローゼット","🤖 AIコーデ","👤 プロフィール","📮 お問い合わせ"]
+tab1, tabCal, tabCloset, tabAI, tabStats, tabProfile, tabContact = st.tabs(
+    ["📒 記録","📅 カレンダー","🧳 クローゼット","🤖 AIコーデ","📊 分析","👤 プロフィール","📮 お問い合わせ"]
 )
 
 SIL_TOP = ["ジャスト/レギュラー","オーバーサイズ","クロップド/短丈","タイト/フィット"]
 SIL_BOTTOM = ["ストレート","ワイド/フレア","スキニー/テーパード","Aライン/スカート","ショーツ"]
+WANT_OPTS = ["指定なし","通勤","デート","カジュアル","スポーツ","フォーマル","雨の日"]
+HEAT_OPTS = ["寒い","涼しい","ちょうど","暑い","猛暑"]
+HUMID_OPTS = ["乾燥","普通","湿度高い"]
 
 # ===== 記録 =====
 with tab1:
@@ -639,15 +292,16 @@ with tab1:
     bottom_sil = colB.selectbox("ボトム", SIL_BOTTOM, index=0, key="rec_bottom_sil")
     notes = st.text_area("メモ", placeholder="", key="rec_notes")
 
-    auto_colors=[]; auto_top="#2f2f2f"; auto_bottom="#c9c9c9"
+    auto_colors=[]; auto_top="#2f2f2f"; auto_bottom="#c9c9c9"; palette=None
     if img_bytes:
-        img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+        ph = content_hash(img_bytes); img = small_image(ph, img_bytes)
         st.image(img, use_container_width=True)
-        auto_top = main_color_from_region(img, "upper")
-        auto_bottom = main_color_from_region(img, "lower")
+        (auto_top, pal_top), (auto_bottom, pal_bottom) = region_colors(ph, "upper", img), region_colors(ph, "lower", img)
         auto_colors = [auto_top, auto_bottom]
-        st.caption("自動カラー認識（上/下それぞれ）")
-        st.markdown(" ".join([f"<span class='swatch' style='background:{h}'></span>" for h in auto_colors]), unsafe_allow_html=True)
+        palette = {"upper": pal_top, "lower": pal_bottom}
+        st.caption("自動カラー認識（上/下それぞれ・面積比）")
+        for label, region in [("上", "upper"), ("下", "lower")]:
+            st.markdown(palette_html(palette[region], label), unsafe_allow_html=True)
 
     use_auto = st.toggle("自動色認識を使う", value=True, key="use_auto_colors")
     if use_auto:
@@ -658,37 +312,66 @@ with tab1:
         top_color = col1.color_picker("トップ色", auto_top, key="rec_top_color")
         bottom_color = col2.color_picker("ボトム色", auto_bottom, key="rec_bottom_color")
 
+    links = []
+    if img_bytes:
+        ensure_item_features(limit=LINK_FEATURES_PER_RUN)   # 新しく追加した分だけ。古い残りは裏で埋める
+        item_features_backfill(DB_PATH)
+        idx = item_index(DB_PATH, item_index_signature())
+        if len(idx["ids"]):
+            st.caption("写っているアイテム（タップで確定・使用回数に反映）")
+            seed = len(img_bytes)
+            for region, label, hx in [("upper", "トップ", top_color), ("lower", "ボトム", bottom_color)]:
+                cands = match_items(idx, region, hx, region_hist(img, region))
+                if not cands: continue
+                info = {iid: (nm, dist) for iid, nm, dist in cands}
+                best = cands[0][0] if cands[0][2] <= LINK_AUTO_DIST else None
+                pick = choice_pills(label, list(info), lambda i: f"{info[i][0] or '（名称未設定）'}",
+                                    key=f"rec_link_{region}_{seed}", default=best)
+                if pick is not None: links.append((pick, region, info[pick][1]))
+
     if st.button("保存", type="primary", key="rec_save", disabled=(img_bytes is None)):
-        insert_outfit(str(pd.to_datetime(d).date()), profile.get("season"),
-                      top_sil, bottom_sil, top_color, bottom_color, auto_colors, img_bytes, notes)
-        st.success("保存しました")
+        track_write(insert_outfit(str(pd.to_datetime(d).date()), profile.get("season"),
+                                  top_sil, bottom_sil, top_color, bottom_color, auto_colors, img_bytes, notes,
+                                  links=links, palette=palette,
+                                  color_src="auto" if (top_color.lower(), bottom_color.lower()) == (auto_top, auto_bottom) else "manual",
+                                  color_ver=ANALYSIS_VERSION))
 
 # ===== カレンダー =====
 with tabCal:
     today = pd.Timestamp.today()
-    colM = st.columns(2)
+    colM = st.columns([2,2,1])
     year = colM[0].number_input("年", value=int(today.year), step=1, min_value=2000, max_value=2100, key="cal_year")
     month = colM[1].number_input("月", value=int(today.month), step=1, min_value=1, max_value=12, key="cal_month")
+    cal_tiles = colM[2].toggle("タイル", value=True, key="cal_tiles", help="1 枚の画像にまとめて表示（高速・省通信）")
     cal = calendar.Calendar(firstweekday=6)
     weeks = cal.monthdatescalendar(int(year), int(month))
     if "modal_day" not in st.session_state: st.session_state["modal_day"] = None
 
-    for wk in weeks:
-        cols = st.columns(7)
-        for i, d0 in enumerate(wk):
-            slots = fetch_outfits_on(str(d0))
-            with cols[i]:
-                style = "padding:6px; border:1px solid #eee; border-radius:8px; min-height:110px; position:relative"
-                if d0.month != int(month): style += "; opacity:0.5"
-                st.markdown(f"<div style='{style}'><b>{d0.day}</b></div>", unsafe_allow_html=True)
-                if slots:
-                    try: st.image(Image.open(io.BytesIO(slots[0][8])), use_container_width=True)
-                    except: pass
-                    if st.button("詳細", key=f"detail_{d0.isoformat()}"):
-                        st.session_state["modal_day"] = str(d0)
+    if cal_tiles:
+        days = tuple(str(d0) for wk in weeks for d0 in wk)
+        sheet, logged = calendar_sheet(DB_PATH, days, int(month), calendar_signature(days[0], days[-1]))
+        st.markdown("<div class='small'>日 月 火 水 木 金 土</div>", unsafe_allow_html=True)
+        show_media(content_hash(sheet), sheet, w=None)
+        if logged:
+            tile_picker("詳細", logged, lambda d: f"{int(d[-2:])}日", key=f"cal_pick_{year}_{month}",
+                        on_pick=lambda d: st.session_state.update(modal_day=d))
+    else:
+        for wk in weeks:
+            cols = st.columns(7)
+            for i, d0 in enumerate(wk):
+                slots = fetch_outfits_on(str(d0))
+                with cols[i]:
+                    style = "padding:6px; border:1px solid #eee; border-radius:8px; min-height:110px; position:relative"
+                    if d0.month != int(month): style += "; opacity:0.5"
+                    st.markdown(f"<div style='{style}'><b>{d0.day}</b></div>", unsafe_allow_html=True)
+                    if slots:
+                        show_media(img_hashes("outfits", [slots[0][0]]).get(slots[0][0]), slots[0][8], w=320)
+                        if st.button("詳細", key=f"detail_{d0.isoformat()}"):
+                            st.session_state["modal_day"] = str(d0)
 
     if st.session_state["modal_day"]:
         day = st.session_state["modal_day"]; lst = fetch_outfits_on(day)
+        day_hash = img_hashes("outfits", [r[0] for r in lst])
         st.markdown("<div style='position:fixed;top:0;left:0;right:0;bottom:0;background:rgba(0,0,0,.45);display:flex;align-items:center;justify-content:center;z-index:10000'>", unsafe_allow_html=True)
         with st.container():
             st.markdown("<div class='card' style='width:92%;max-width:640px'>", unsafe_allow_html=True)
@@ -700,8 +383,7 @@ with tabCal:
                 oid, dd, seas, ts, bs, tc, bc, cols_js, img_b, nt = row
                 colm = st.columns([1,2])
                 with colm[0]:
-                    try: st.image(Image.open(io.BytesIO(img_b)), use_container_width=True)
-                    except: st.write("画像なし")
+                    if not show_media(day_hash.get(oid), img_b): st.write("画像なし")
                 with colm[1]:
                     st.write(f"Top:{ts}({tc}) / Bottom:{bs}({bc})")
                     st.caption(nt or "")
@@ -715,19 +397,20 @@ with tabCloset:
 
     if add_mode=="写真から":
         img_bytes = persistent_uploader("画像", key="cl_img")
-        color_auto="#2f2f2f"; cat_guess="トップス"; season_guess=None; name_suggest="アイテム"; material_guess="コットン"
+        color_auto="#2f2f2f"; cat_guess="トップス"; season_guess=None; name_suggest="アイテム"; material_guess="コットン"; palette_i=None
 
         if img_bytes:
-            img_i = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+            ph = content_hash(img_bytes); img_i = small_image(ph, img_bytes)
             st.image(img_i, use_container_width=True)
-            cat_guess = classify_top_or_bottom(img_i)
+            cat_guess = photo_category(ph, img_i)
             region = "upper" if cat_guess=="トップス" else "lower"
-            color_auto = main_color_from_region(img_i, region)
+            color_auto, palette_i = region_colors(ph, region, img_i)
             material_guess = "コットン" if hex_luma(color_auto)>150 else "ウール/ニット"
             cname = JP_COLOR.get(nearest_css_name(color_auto), "カラー")
             name_suggest = f"{cname} {('Tシャツ' if cat_guess=='トップス' else 'パンツ' if cat_guess=='ボトムス' else cat_guess)}"
             st.caption("自動：カテゴリ/主色（領域別）/素材（簡易）")
             st.markdown(f"<span class='swatch' style='background:{color_auto}'></span> {color_auto}", unsafe_allow_html=True)
+            st.markdown(palette_html(palette_i), unsafe_allow_html=True)
 
         seed = (len(img_bytes) if img_bytes else 0)
         colN = st.columns(2)
@@ -744,10 +427,11 @@ with tabCloset:
         notes_i = st.text_area("メモ（用途/特徴）", key=f"cl_notes_{seed}")
 
         if st.button("追加", key=f"cl_add_btn_{seed}", disabled=(img_bytes is None)):
-            add_item(name or "Unnamed", category, color_hex,
-                     None if season_pref=="指定なし" else season_pref,
-                     material, img_bytes, notes_i)
-            st.success("追加しました")
+            track_write(add_item(name or "Unnamed", category, color_hex,
+                                 None if season_pref=="指定なし" else season_pref,
+                                 material, img_bytes, notes_i,
+                                 color_src="auto" if color_hex.lower() == color_auto else "manual",
+                                 color_ver=ANALYSIS_VERSION, palette=palette_i), "追加しました")
 
     else:
         url = st.text_input("商品URL", placeholder="https://", key="cl_url")
@@ -757,15 +441,16 @@ with tabCloset:
             if not title and not imgb: st.error("取得できませんでした")
             else:
                 st.session_state["url_title"]=title
-                st.session_state["url_img"]=imgb
+                stash("url_img", imgb)
                 st.session_state["url_desc"]=desc
                 st.success("読み込みました")
         if cols_u[1].button("クリア", key="url_clear"):
-            for k in ["url_title","url_img","url_desc"]: st.session_state.pop(k, None)
+            for k in ["url_title","url_desc"]: st.session_state.pop(k, None)
+            stash("url_img", None)
             st.rerun()
 
         title = st.session_state.get("url_title")
-        img_bytes = st.session_state.get("url_img")
+        img_bytes = unstash("url_img")
         desc = st.session_state.get("url_desc","")
         seed = (len(img_bytes) if img_bytes else 0) + (len(title or "") if title else 0)
 
@@ -775,9 +460,9 @@ with tabCloset:
 
         color_guess="#2f2f2f"
         if img_bytes:
-            img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+            ph = content_hash(img_bytes); img = small_image(ph, img_bytes)
             st.image(img, use_container_width=True)
-            color_guess = main_color_from_region(img, "upper")
+            color_guess = region_colors(ph, "upper", img)[0]
             st.markdown(f"<span class='swatch' style='background:{color_guess}'></span> {color_guess}", unsafe_allow_html=True)
 
         colU = st.columns(2)
@@ -794,25 +479,29 @@ with tabCloset:
         notes_url = st.text_area("メモ", value=(url or desc or ""), key=f"cl_notes_url_{seed}")
 
         if st.button("追加", key=f"cl_add_btn_url_{seed}", disabled=(not name_url and img_bytes is None)):
-            add_item(name_url or "Unnamed", category_url, color_url,
-                     None if season_url=="指定なし" else season_url,
-                     material_url, img_bytes, notes_url)
-            st.success("追加しました")
+            # URL の画像は上半分で色を取っているので、バージョンは付けず再解析に回す
+            track_write(add_item(name_url or "Unnamed", category_url, color_url,
+                                 None if season_url=="指定なし" else season_url,
+                                 material_url, img_bytes, notes_url,
+                                 color_src=("auto" if color_url.lower() == color_guess else "manual") if img_bytes else None),
+                        "追加しました")
 
     # ---------- 一覧 ----------
     st.markdown("---")
     st.subheader("クローゼット一覧（カテゴリ別）")
 
     frow = st.columns([2,3,1])
+    cl_tiles = frow[0].toggle("タイル表示", value=True, key="cl_tiles", help="グリッドを 1 枚の画像にまとめて表示（高速・省通信）")
     q = frow[1].text_input("検索（名前/メモ）", key="cl_query", placeholder="例：ネイビー, 撥水, オフィス など")
     per_row = int(frow[2].selectbox("列数", [1,2,3], index=2, help="画面密度を変更"))
 
     use_count, last_used = get_usage_stats()
-    all_items = list_items("すべて")
+    all_items = list_items("すべて", img=False)   # 7 列目は画像の有無。本体は表示するものだけ読む
     if q:
         ql = q.lower()
         all_items = [r for r in all_items if (r[1] and ql in r[1].lower()) or (r[7] and ql in r[7].lower())]
 
+    item_hash = img_hashes("items", [r[0] for r in all_items])
     groups = {
         "トップス": ["トップス","ワンピース"],
         "ボトムス": ["ボトムス"],
@@ -822,23 +511,21 @@ with tabCloset:
     }
 
     def render_card(row, col):
-        iid, nm, cat, hx, sp, mat, imgb, nts = row
+        iid, nm, cat, hx, sp, mat, has_img, nts = row
         worn = use_count.get(iid, 0)
         last = last_used.get(iid)
         last_txt = pd.to_datetime(last).strftime("%Y-%m-%d") if last else "—"
         with col:
             st.markdown("<div class='card'>", unsafe_allow_html=True)
-            if imgb:
-                try: st.image(Image.open(io.BytesIO(imgb)), use_container_width=True)
-                except: st.markdown("<div style='width:100%;aspect-ratio:1/1;border:1px dashed #ccc;border-radius:8px;display:flex;align-items:center;justify-content:center;'>画像表示不可</div>", unsafe_allow_html=True)
+            if has_img:
+                if not show_media(item_hash.get(iid), lambda: load_item_imgs([iid]).get(iid), w=320): st.markdown("<div style='width:100%;aspect-ratio:1/1;border:1px dashed #ccc;border-radius:8px;display:flex;align-items:center;justify-content:center;'>画像表示不可</div>", unsafe_allow_html=True)
             else:
                 st.markdown("<div style='width:100%;aspect-ratio:1/1;border:1px dashed #ccc;border-radius:8px;display:flex;align-items:center;justify-content:center;'>画像なし</div>", unsafe_allow_html=True)
             st.markdown(f"**{nm or '（名称未設定）'}**")
             st.markdown(f"<span class='pill'>{cat}</span> <span class='pill'>{sp or '季節指定なし'}</span> <span class='pill'>{mat or '素材不明'}</span>", unsafe_allow_html=True)
             st.markdown(f"<div class='cap'><span class='mini' style='background:{hx or '#2f2f2f'}'></span>色: {hx or '-'}</div>", unsafe_allow_html=True)
             st.markdown(f"<div class='cap'>使用回数: <b>{worn}</b>／最終着用: {last_txt}</div>", unsafe_allow_html=True)
-            if st.button("編集を開く", key=f"open_edit_{iid}"):
-                st.session_state[f"open_exp_{iid}"] = True
+            st.button("編集を開く", key=f"open_edit_{iid}", on_click=st.session_state.update, kwargs={"cl_edit": iid})
             st.markdown("</div>", unsafe_allow_html=True)
 
     for gname, cats in groups.items():
@@ -846,47 +533,55 @@ with tabCloset:
         with st.expander(f"{gname}（{len(items_g)}）", expanded=True):
             if not items_g:
                 st.caption("該当なし")
+            elif cl_tiles:
+                tcols = per_row * 2
+                for i in range(0, len(items_g), SHEET_PAGE):
+                    page = items_g[i:i+SHEET_PAGE]
+                    sheet = closet_sheet(tuple((r[0], item_hash.get(r[0])) for r in page), tcols)
+                    show_media(content_hash(sheet), sheet, w=None)
+                    names = {r[0]: f"{j+1}. {r[1] or '（名称未設定）'}（{use_count.get(r[0], 0)}回）" for j, r in enumerate(page)}
+                    tile_picker("編集を開く", list(names), names.get, key=f"cl_pick_{gname}_{i}",
+                                on_pick=lambda iid: st.session_state.update(cl_edit=iid))
             else:
                 for i in range(0, len(items_g), per_row):
                     cols = st.columns(per_row)
                     for col, row in zip(cols, items_g[i:i+per_row]):
                         render_card(row, col)
 
+    # フォームは選んだ 1 件だけ描く（ウィジェット数をクローゼットの大きさに比例させない）
     st.markdown("### 編集 / 削除")
-    for row in all_items:
-        iid, nm, cat, hx, sp, mat, imgb, nts = row
-        expanded = st.session_state.get(f"open_exp_{iid}", False)
-        with st.expander(f"{nm}（{cat}）", expanded=expanded):
-            cols = st.columns([1,2])
-            with cols[0]:
-                if imgb:
-                    try: st.image(Image.open(io.BytesIO(imgb)), use_container_width=True)
-                    except: st.write("画像なし")
-                else:
-                    st.write("画像なし")
-            with cols[1]:
-                ename = st.text_input("名前", value=nm, key=f"edit_name_{iid}")
-                ecat = st.selectbox("カテゴリ", ["トップス","ボトムス","アウター","ワンピース","シューズ","バッグ","アクセ"],
-                                    index=(["トップス","ボトムス","アウター","ワンピース","シューズ","バッグ","アクセ"].index(cat) if cat in ["トップス","ボトムス","アウター","ワンピース","シューズ","バッグ","アクセ"] else 0),
-                                    key=f"edit_cat_{iid}")
-                ehx = st.color_picker("色", hx or "#2f2f2f", key=f"edit_color_{iid}")
-                esp = st.selectbox("得意シーズン", ["指定なし","spring","summer","autumn","winter"],
-                                   index=(["指定なし","spring","summer","autumn","winter"].index(sp) if sp in ["spring","summer","autumn","winter"] else 0),
-                                   key=f"edit_season_{iid}")
-                emat = st.text_input("素材", value=mat or "", key=f"edit_mat_{iid}")
-                enotes = st.text_area("メモ", value=nts or "", key=f"edit_notes_{iid}")
-                eup = st.file_uploader("画像差し替え（任意）", type=["jpg","jpeg","png","webp"], key=f"edit_img_{iid}")
-                b1, b2, b3 = st.columns([1,1,1])
-                if b1.button("保存", key=f"edit_save_{iid}"):
-                    new_img_bytes = eup.read() if eup else None
-                    update_item(iid, ename, ecat, ehx, None if esp=="指定なし" else esp, emat, new_img_bytes, enotes)
-                    st.session_state[f"open_exp_{iid}"] = True
-                    st.success("保存しました")
-                confirm = b2.checkbox("本当に削除", key=f"confirm_del_{iid}")
-                if b3.button("削除", key=f"delete_{iid}", disabled=not confirm):
-                    delete_item(iid)
-                    st.success("削除しました")
-                    st.rerun()
+    by_iid = {r[0]: r for r in all_items}
+    if st.session_state.get("cl_edit") not in by_iid: st.session_state.pop("cl_edit", None)   # 削除・検索で消えた
+    sel = st.selectbox("編集するアイテム", [None] + list(by_iid), key="cl_edit",
+                       format_func=lambda v: "— タイル / 一覧から選ぶか、ここで選択 —" if v is None else f"{by_iid[v][1] or '（名称未設定）'}（{by_iid[v][2]}）")
+    if sel is not None:
+        iid, nm, cat, hx, sp, mat, has_img, nts = by_iid[sel]
+        cols = st.columns([1,2])
+        with cols[0]:
+            if not (has_img and show_media(item_hash.get(iid), lambda: load_item_imgs([iid]).get(iid), w=320)): st.write("画像なし")
+        with cols[1]:
+            ename = st.text_input("名前", value=nm, key=f"edit_name_{iid}")
+            ecat = st.selectbox("カテゴリ", ["トップス","ボトムス","アウター","ワンピース","シューズ","バッグ","アクセ"],
+                                index=(["トップス","ボトムス","アウター","ワンピース","シューズ","バッグ","アクセ"].index(cat) if cat in ["トップス","ボトムス","アウター","ワンピース","シューズ","バッグ","アクセ"] else 0),
+                                key=f"edit_cat_{iid}")
+            ehx = st.color_picker("色", hx or "#2f2f2f", key=f"edit_color_{iid}")
+            esp = st.selectbox("得意シーズン", ["指定なし","spring","summer","autumn","winter"],
+                               index=(["指定なし","spring","summer","autumn","winter"].index(sp) if sp in ["spring","summer","autumn","winter"] else 0),
+                               key=f"edit_season_{iid}")
+            emat = st.text_input("素材", value=mat or "", key=f"edit_mat_{iid}")
+            enotes = st.text_area("メモ", value=nts or "", key=f"edit_notes_{iid}")
+            eup = st.file_uploader("画像差し替え（任意）", type=["jpg","jpeg","png","webp"], key=f"edit_img_{iid}")
+            b1, b2, b3 = st.columns([1,1,1])
+            if b1.button("保存", key=f"edit_save_{iid}"):
+                new_img_bytes = eup.read() if eup else None
+                fut = update_item(iid, ename, ecat, ehx, None if esp=="指定なし" else esp, emat, new_img_bytes, enotes)
+                if new_img_bytes: media_gc_after(fut, [item_hash.get(iid)])   # 差し替え前の画像の配信ファイル
+                track_write(fut)
+            confirm = b2.checkbox("本当に削除", key=f"confirm_del_{iid}")
+            if b3.button("削除", key=f"delete_{iid}", disabled=not confirm):
+                fut = delete_item(iid); media_gc_after(fut, [item_hash.get(iid)])
+                fut.result(timeout=30)   # 再描画で消えているよう削除だけは待つ
+                st.rerun()
 
 # ===== AIコーデ =====
 with tabAI:
@@ -895,117 +590,216 @@ with tabAI:
         st.info("まずアイテムを登録してください")
     else:
         colctx = st.columns(4)
-        want = colctx[0].selectbox("用途", ["指定なし","通勤","デート","カジュアル","スポーツ","フォーマル","雨の日"], index=0, key="ai_want")
-        heat = colctx[1].selectbox("体感", ["寒い","涼しい","ちょうど","暑い","猛暑"], index=2, key="ai_heat")
-        humidity = colctx[2].selectbox("空気", ["乾燥","普通","湿度高い"], index=1, key="ai_humid")
+        want = colctx[0].selectbox("用途", WANT_OPTS, index=0, key="ai_want")
+        heat = colctx[1].selectbox("体感", HEAT_OPTS, index=2, key="ai_heat")
+        humidity = colctx[2].selectbox("空気", HUMID_OPTS, index=1, key="ai_humid")
         rainy= colctx[3].toggle("雨", value=False, key="ai_rain")
         season = profile.get("season"); body_shape = profile.get("body_shape")
 
-        def pick_best(items, top_hex, category):
-            cand=[it for it in items if it[2]==category]
-            if not cand: return None, 1e9
-            scored=[]
-            for row in cand:
-                iid,nm,cat,hx,sp,mat,imgb,nts=row
-                d = rgb_dist(top_hex, hx)
-                s_h = max(0.0, 1.0 - d/MAXD)
-                s_p = max(0.0, 1.0 - (palette_distance(hx, season) if season else MAXD/2)/MAXD)
-                s_c = climate_bonus(mat, heat, humidity, rainy)
-                s_u = purpose_match(nts, want)
-                s_b = body_shape_bonus(nts, body_shape, cat)
-                score = -(0.6*s_h + 0.3*s_p + 0.07*s_c + 0.02*s_u + 0.01*s_b)
-                scored.append((score,row))
-            scored.sort(key=lambda x:x[0])
-            return scored[0][1], scored[0][0]
+        # 重みは毎回 DB から読む（同じユーザーの別セッションの学習も反映する）
+        pref_w = load_pref_model()[0]
 
         if st.button("生成", key="ai_gen"):
-            tops=[it for it in all_items if it[2]=="トップス"]
-            if not tops:
+            ids, train = generate_outfit(all_items, season, body_shape, want, heat, humidity, rainy, pref_w)
+            prev = st.session_state.get("ai_result")
+            if ids is None:
                 st.warning("トップスが未登録です")
+                st.session_state.pop("ai_result", None)
             else:
-                best_top=None; best_s=1e9
-                for row in tops:
-                    _,_,cat,hx,sp,mat,imgb,nts=row
-                    s = - (0.5*max(0.0, 1.0 - (palette_distance(hx, season) if season else MAXD/2)/MAXD)
-                           + 0.4*climate_bonus(mat, heat, humidity, rainy)
-                           + 0.1*body_shape_bonus(nts, body_shape, cat))
-                    if s<best_s: best_s=s; best_top=row
-                top=best_top
-                bottom,_ = pick_best(all_items, top[3], "ボトムス")
-                shoes ,_ = pick_best(all_items, top[3], "シューズ")
-                bag   ,_ = pick_best(all_items, top[3], "バッグ")
-                outfit={"top":top,"bottom":bottom,"shoes":shoes,"bag":bag}
-
-                score, goods, bads, suggestions, breakdown = evaluate_outfit(
-                    outfit, season, body_shape, want, heat, humidity, rainy
-                )
-
-                st.markdown("### おすすめコーデ")
-                cols = st.columns(4)
-                labels=[("トップ","top"),("ボトム","bottom"),("靴","shoes"),("バッグ","bag")]
-                for j,(label,key) in enumerate(labels):
-                    with cols[j]:
-                        row = outfit.get(key)
-                        st.markdown("<div class='card'>", unsafe_allow_html=True)
-                        if row and row[6]:
-                            try: st.image(Image.open(io.BytesIO(row[6])), use_container_width=True)
-                            except: st.write("画像なし")
-                        else:
-                            st.markdown("<div style='width:100%;aspect-ratio:1/1;border:1px dashed #ccc;border-radius:8px;display:flex;align-items:center;justify-content:center;'>画像なし</div>", unsafe_allow_html=True)
-                        st.caption(f"{label}：{row[1] if row else '—'} / {row[3] if row else '-'}")
-                        st.markdown("</div>", unsafe_allow_html=True)
-
-                st.markdown("### AIスコア")
-                deg = int(360 * (score/100))
-                st.markdown(f"<div class='scoreRing' style='--deg:{deg}deg'><span>{int(round(score))}</span></div>", unsafe_allow_html=True)
-                st.markdown(
-                    f"<div class='kpi'>Harmony: {breakdown['Harmony(40)']}</div>"
-                    f"<div class='kpi'>PC Fit: {breakdown['PC Fit(30)']}</div>"
-                    f"<div class='kpi'>Climate: {breakdown['Climate(20)']}</div>"
-                    f"<div class='kpi'>Purpose: {breakdown['Purpose(10)']}</div>"
-                    f"<div class='kpi'>Body: {breakdown['Body(10)']}</div>",
-                    unsafe_allow_html=True
-                )
-
-                c1,c2 = st.columns(2)
-                with c1:
-                    st.markdown("#### Good")
-                    for g in goods: st.write("• " + g)
-                with c2:
-                    st.markdown("#### Bad / 改善ポイント")
-                    for b in bads: st.write("• " + b)
-
-                st.markdown("#### 買うべき色（トップ基準の提案）")
-                st.markdown("".join([f"<span class='swatch' style='background:{s['hex']}'></span> {s['name']} ({s['hex']})  " for s in suggestions]), unsafe_allow_html=True)
-
-                missing=[]
-                if outfit["bottom"] is None: missing.append("ボトムス")
-                if outfit["shoes"]  is None: missing.append("シューズ")
-                if outfit["bag"]    is None: missing.append("バッグ")
-                if missing:
-                    st.markdown("### 不足アイテムのオンライン提案")
-                    base_hex = outfit["top"][3] if outfit["top"] else "#2f2f2f"
-                    for cat in missing:
-                        st.markdown(f"**{cat}**（検索キーワード例：{JP_COLOR.get(nearest_css_name(base_hex),'カラー')} + {CAT_JP.get(cat,cat)}）")
-                        links = shop_suggestions(cat, base_hex, season)
-                        cols = st.columns(3)
-                        for col, rec in zip(cols, links[:3]):
-                            with col:
-                                st.markdown("<div class='card'>", unsafe_allow_html=True)
-                                st.caption(rec["site"])
-                                st.link_button("検索を開く", rec["url"])
-                                st.markdown("</div>", unsafe_allow_html=True)
+                # 同じ条件で作り直した＝表示したコーデは選ばれなかった（保存も評価もされていなければ負例にする）
+                if (prev and prev["saved"] is None and prev["train"] and prev["ids"] != ids
+                        and prev["ctx"] == (want, heat, humidity, rainy)):
+                    update_pref_model(*pref_examples(prev["train"], 0.0, prev.get("w")))
+                # 生成結果はセッションに残す（保存/評価ボタンの再描画後も表示するため）
+                st.session_state["ai_result"] = {"ids": ids, "ctx": (want, heat, humidity, rainy), "train": train,
+                                                 "w": pref_w.tolist(), "saved": None, "rated": False, "gen": uuid.uuid4().hex[:8]}
+
+        res = st.session_state.get("ai_result")
+        by_id = {r[0]: r for r in all_items}
+        if res and by_id.get(res["ids"]["top"]):
+            want, heat, humidity, rainy = res["ctx"]
+            outfit = {k: by_id.get(v) if v else None for k, v in res["ids"].items()}
+            score, goods, bads, suggestions, breakdown = evaluate_outfit(
+                outfit, season, body_shape, want, heat, humidity, rainy,
+                palettes=item_palettes([r[0] for r in outfit.values() if r])
+            )
 
+            st.markdown("### おすすめコーデ")
+            cols = st.columns(4)
+            labels=[("トップ","top"),("ボトム","bottom"),("靴","shoes"),("バッグ","bag")]
+            ai_hash = img_hashes("items", [r[0] for r in outfit.values() if r])
+            for j,(label,key) in enumerate(labels):
+                with cols[j]:
+                    row = outfit.get(key)
+                    st.markdown("<div class='card'>", unsafe_allow_html=True)
+                    if row and row[6]:
+                        if not show_media(ai_hash.get(row[0]), row[6], w=320): st.write("画像なし")
+                    else:
+                        st.markdown("<div style='width:100%;aspect-ratio:1/1;border:1px dashed #ccc;border-radius:8px;display:flex;align-items:center;justify-content:center;'>画像なし</div>", unsafe_allow_html=True)
+                    st.caption(f"{label}：{row[1] if row else '—'} / {row[3] if row else '-'}")
+                    st.markdown("</div>", unsafe_allow_html=True)
+
+            st.markdown("### AIスコア")
+            deg = int(360 * (score/100))
+            st.markdown(f"<div class='scoreRing' style='--deg:{deg}deg'><span>{int(round(score))}</span></div>", unsafe_allow_html=True)
+            st.markdown(
+                f"<div class='kpi'>Harmony: {breakdown['Harmony(40)']}</div>"
+                f"<div class='kpi'>PC Fit: {breakdown['PC Fit(30)']}</div>"
+                f"<div class='kpi'>Climate: {breakdown['Climate(20)']}</div>"
+                f"<div class='kpi'>Purpose: {breakdown['Purpose(10)']}</div>"
+                f"<div class='kpi'>Body: {breakdown['Body(10)']}</div>",
+                unsafe_allow_html=True
+            )
+
+            c1,c2 = st.columns(2)
+            with c1:
+                st.markdown("#### Good")
+                for g in goods: st.write("• " + g)
+            with c2:
+                st.markdown("#### Bad / 改善ポイント")
+                for b in bads: st.write("• " + b)
+
+            st.markdown("#### 買うべき色（トップ基準の提案）")
+            st.markdown("".join([f"<span class='swatch' style='background:{s['hex']}'></span> {s['name']} ({s['hex']})  " for s in suggestions]), unsafe_allow_html=True)
+
+            missing=[]
+            if outfit["bottom"] is None: missing.append("ボトムス")
+            if outfit["shoes"]  is None: missing.append("シューズ")
+            if outfit["bag"]    is None: missing.append("バッグ")
+            if missing:
+                st.markdown("### 不足アイテムのオンライン提案")
+                base_hex = outfit["top"][3] if outfit["top"] else "#2f2f2f"
+                for cat in missing:
+                    st.markdown(f"**{cat}**（検索キーワード例：{JP_COLOR.get(nearest_css_name(base_hex),'カラー')} + {CAT_JP.get(cat,cat)}）")
+                    links = shop_suggestions(cat, base_hex, season)
+                    cols = st.columns(3)
+                    for col, rec in zip(cols, links[:3]):
+                        with col:
+                            st.markdown("<div class='card'>", unsafe_allow_html=True)
+                            st.caption(rec["site"])
+                            st.link_button("検索を開く", rec["url"])
+                            st.markdown("</div>", unsafe_allow_html=True)
+
+            if res["saved"] is None:
                 if st.button("このコーデを保存", key="ai_save"):
-                    save_coord(outfit['top'][0],
-                               outfit['bottom'][0] if outfit['bottom'] else None,
-                               outfit['shoes'][0] if outfit['shoes'] else None,
-                               outfit['bag'][0] if outfit['bag'] else None,
-                               {"want":want,"heat":heat,"humidity":humidity,"rainy":rainy,"season":season,"body_shape":body_shape,
-                                "ai_breakdown":breakdown,"goods":goods,"bads":bads,"suggest_colors":[s['hex'] for s in suggestions],
-                                "missing":missing},
-                               score)
-                    st.success("保存しました（AIスコア付き）")
+                    res["saved"] = save_coord(outfit['top'][0],
+                                              outfit['bottom'][0] if outfit['bottom'] else None,
+                                              outfit['shoes'][0] if outfit['shoes'] else None,
+                                              outfit['bag'][0] if outfit['bag'] else None,
+                                              {"want":want,"heat":heat,"humidity":humidity,"rainy":rainy,"season":season,"body_shape":body_shape,
+                                               "ai_breakdown":breakdown,"goods":goods,"bads":bads,"suggest_colors":[s['hex'] for s in suggestions],
+                                               "missing":missing},
+                                              score)
+                    track_write(res["saved"], "保存しました（AIスコア付き）")
+                    if res["train"]:   # 表示して保存されたアイテムが、選ばれなかった候補より好まれた
+                        update_pref_model(*pref_examples(res["train"], 1.0, res.get("w")))
+            elif not res["rated"]:
+                st.caption("このコーデの評価（好みの学習に使います）")
+                stars = (st.feedback("stars", key=f"ai_rate_{res['gen']}") if hasattr(st, "feedback")
+                         else st.select_slider("評価", [None, 0, 1, 2, 3, 4], format_func=lambda v: "—" if v is None else "★"*(v+1), key=f"ai_rate_{res['gen']}"))
+                if stars is not None and res["saved"].done() and res["saved"].exception() is None:
+                    track_write(rate_coord(res["saved"].result(), stars + 1), "評価を保存しました")
+                    if res["train"]:
+                        update_pref_model(*pref_examples(res["train"], stars / 4, res.get("w")))
+                    res["rated"] = True
+
+        # ---- 複数日プラン ----
+        st.markdown("---")
+        st.markdown("### 📆 まとめて計画")
+        # 保存したプランは予定のまま。当日以降に「着た」を押したものだけ着用回数に数える
+        due = list_planned(str(pd.Timestamp.today().date()))
+        if due:
+            with st.expander(f"予定したコーデの確認（{len(due)} 件）", expanded=False):
+                for cid, pday, *ids in due[:14]:
+                    cc = st.columns([2, 5, 1, 1])
+                    cc[0].write(pday); cc[1].write(" / ".join(by_id[i][1] for i in ids if i in by_id) or "—")
+                    if cc[2].button("着た", key=f"plan_ok_{cid}"):
+                        track_write(confirm_coord(cid), "着用に記録しました")
+                    if cc[3].button("着なかった", key=f"plan_ng_{cid}"):
+                        track_write(confirm_coord(cid, worn=False), "予定を取り消しました")
+        cp = st.columns(3)
+        n_days = cp[0].selectbox("日数", [7, 14, 30], index=0, key="plan_days")
+        p_start = cp[1].date_input("開始日", value=pd.Timestamp.today() + pd.Timedelta(days=1), key="plan_start")
+        p_window = int(cp[2].number_input("同じ服を空ける日数", min_value=1, max_value=14, value=3, key="plan_window"))
+        plan_base = pd.DataFrame({"日付": [str(x.date()) for x in pd.date_range(p_start, periods=n_days)],
+                                  "用途": st.session_state.get("ai_want", WANT_OPTS[0]),
+                                  "体感": st.session_state.get("ai_heat", HEAT_OPTS[2]),
+                                  "空気": st.session_state.get("ai_humid", HUMID_OPTS[1]),
+                                  "雨": bool(st.session_state.get("ai_rain", False))})
+        plan_days = st.data_editor(plan_base, key=f"plan_editor_{n_days}_{p_start}", hide_index=True,
+                                   use_container_width=True, disabled=["日付"],
+                                   column_config={"用途": st.column_config.SelectboxColumn(options=WANT_OPTS, required=True),
+                                                  "体感": st.column_config.SelectboxColumn(options=HEAT_OPTS, required=True),
+                                                  "空気": st.column_config.SelectboxColumn(options=HUMID_OPTS, required=True),
+                                                  "雨": st.column_config.CheckboxColumn()})
+        if st.button("プランを作成", key="plan_run"):
+            p_use, p_last = get_usage_stats()
+            days = [{"date": r["日付"], "want": r["用途"], "heat": r["体感"], "humidity": r["空気"], "rainy": bool(r["雨"])}
+                    for r in plan_days.to_dict("records")]
+            t0 = time.perf_counter()
+            plan = plan_outfits(all_items, days, season, body_shape, pref_w, p_last, p_use, window=p_window)
+            st.session_state["plan_result"] = {"days": days, "plan": plan, "sec": time.perf_counter() - t0, "saved": False}
+
+        pr = st.session_state.get("plan_result")
+        if pr and pr["plan"]:
+            nm = lambda iid: (by_id[iid][1] if iid in by_id else "—") if iid else "—"
+            st.dataframe(pd.DataFrame([{"日付": p["date"], "トップ": nm(p["top"]), "ボトム": nm(p["bottom"]),
+                                        "靴": nm(p["shoes"]), "バッグ": nm(p["bag"])} for p in pr["plan"]]),
+                         hide_index=True, use_container_width=True)
+            st.caption(f"計算時間 {pr['sec']*1000:.0f} ms")
+            if not pr["saved"] and st.button("プランをまとめて保存", key="plan_save"):
+                rows = []; pals = item_palettes({p[k] for p in pr["plan"] for k in ("top","bottom","shoes","bag")})
+                for p, day in zip(pr["plan"], pr["days"]):
+                    o = {k: by_id.get(p[k]) if p[k] else None for k in ("top","bottom","shoes","bag")}
+                    total, _, _, _, bd = evaluate_outfit(o, season, body_shape, day["want"], day["heat"], day["humidity"], day["rainy"],
+                                                         palettes=pals)
+                    rows.append((p["top"], p["bottom"], p["shoes"], p["bag"],
+                                 {"want": day["want"], "heat": day["heat"], "humidity": day["humidity"], "rainy": day["rainy"],
+                                  "season": season, "body_shape": body_shape, "ai_breakdown": bd, "plan_date": day["date"]},
+                                 total))
+                track_write(save_coords_batch(rows), f"{len(rows)} 日分のプランを保存しました")
+                pr["saved"] = True
+        elif pr:
+            st.warning("トップスが未登録のため計画できません")
+
+# ===== 分析 =====
+with tabStats:
+    an = wardrobe_analytics(DB_PATH, analytics_signature())
+    wear = an["wear"]
+    if wear.empty and not an["logs"]:
+        st.info("記録やアイテムが増えると分析が表示されます")
+    else:
+        worn_ratio = float((wear["worn"] > 0).mean()) if len(wear) else 0.0
+        st.markdown(f"<div class='kpi'>アイテム: <b>{len(wear)}</b></div><div class='kpi'>着用率: <b>{worn_ratio:.0%}</b></div>"
+                    f"<div class='kpi'>記録: <b>{an['logs']}</b></div><div class='kpi'>保存コーデ: <b>{an['coords']}</b></div>",
+                    unsafe_allow_html=True)
+
+        st.markdown("#### カテゴリ別の着用回数")
+        if not an["by_cat"].empty: st.bar_chart(an["by_cat"][["worn"]])
+        st.dataframe(an["by_cat"].rename(columns={"items":"アイテム数","worn":"着用回数","never":"未着用"}),
+                     use_container_width=True)
+
+        st.markdown("#### よく着るアイテム")
+        st.dataframe(wear[wear["worn"] > 0].head(15)[["name","category","worn","last_used"]]
+                     .rename(columns={"name":"名前","category":"カテゴリ","worn":"回数","last_used":"最終着用"}),
+                     use_container_width=True, hide_index=True)
+
+        never = wear[wear["worn"] == 0]
+        st.markdown(f"#### 一度も着ていないアイテム（{len(never)}）")
+        if never.empty: st.caption("なし 🎉")
+        else:
+            st.markdown(" ".join(f"<span class='pill'><span class='mini' style='background:{h or '#2f2f2f'}'></span>{ihtml.escape(n or '（名称未設定）')}</span>"
+                                 for n, h in zip(never["name"], never["color_hex"])), unsafe_allow_html=True)
+
+        for title, key in [("#### 月別の色（記録）", "by_month"), ("#### 季節別の色（記録）", "by_season")]:
+            df = an[key]
+            if df.empty: continue
+            st.markdown(title)
+            st.bar_chart(df, color=[FAMILY_COLORS.get(c, "#cccccc") for c in df.columns])
+
+        if not an["trend"].empty:
+            st.markdown("#### AIスコアの推移（週平均）")
+            st.line_chart(an["trend"])
 
 # ===== プロフィール =====
 with tabProfile:
@@ -1019,10 +813,71 @@ with tabProfile:
     height = st.number_input("身長(cm)", min_value=120.0, max_value=220.0, step=0.5,
                              value=float(profile.get("height_cm") or 165.0), key="prof_height")
     if st.button("保存", key="prof_save"):
-        save_profile(season=None if season=="未設定" else season,
-                     body_shape=None if body_shape=="未設定" else body_shape,
-                     height_cm=float(height))
-        st.success("保存しました")
+        track_write(save_profile(season=None if season=="未設定" else season,
+                                 body_shape=None if body_shape=="未設定" else body_shape,
+                                 height_cm=float(height)))
+
+    st.markdown("---")
+    st.subheader("色の再解析")
+    st.caption(f"保存済みの写真の色を最新の解析（v{ANALYSIS_VERSION}）でやり直します。手動で変えた色はそのままです。")
+    ra_left = reanalysis.pending(DB_PATH)
+    ra_busy = reanalysis.running()
+    st.markdown(f"<div class='kpi'>アイテム: <b>{ra_left['items']}</b> 件待ち</div>"
+                f"<div class='kpi'>記録: <b>{ra_left['outfits']}</b> 件待ち</div>"
+                f"<div class='kpi'>{'実行中' if ra_busy else '停止中'}</div>", unsafe_allow_html=True)
+    if st.button("再解析を実行", key="ra_run", disabled=ra_busy or not any(ra_left.values())):
+        reanalysis.launch(first=DB_PATH)
+        st.toast("バックグラウンドで再解析を始めました", icon="🔄")
+
+    st.markdown("---")
+    st.subheader("同期")
+    if not SYNC_CFG:
+        st.caption("同期先が設定されていません（secrets の SYNC_URL / SYNC_KEY）。データはこの端末の中だけに保存されます。")
+    else:
+        ss = sync_service(*SYNC_CFG).status(DB_PATH)
+        st.caption("変更はこの端末に保存してから、つながっている時に自動で送受信します（同じ行は新しい変更が優先）。")
+        st.markdown(f"<div class='kpi'>最終同期: <b>{datetime.fromtimestamp(ss['ok_at']).strftime('%H:%M:%S') if ss.get('ok_at') else '未同期'}</b></div>"
+                    f"<div class='kpi'>未送信: <b>{ss.get('pending') if ss.get('pending') is not None else '-'}</b> 件</div>",
+                    unsafe_allow_html=True)
+        if ss.get("error"): st.warning(f"同期に失敗しました（{ss.get('fails')} 回目、あとで再試行します）: {ss['error']}")
+        if st.button("今すぐ同期", key="sync_now"):
+            sync_service(*SYNC_CFG).touch(DB_PATH, now=True)
+            st.toast("同期を始めました", icon="🔄")
+
+    st.markdown("---")
+    st.subheader("バックアップ")
+    st.caption("アイテム・記録・コーデ・プロフィール・お問い合わせを zip に書き出し / 取り込みます（画像は重複なし）。")
+    cb = st.columns(2)
+    if cb[0].button("エクスポートを作成", key="bk_export"):
+        storage.flush(timeout=60)
+        fd, tmp = tempfile.mkstemp(suffix=".zip"); os.close(fd)
+        try:
+            with st.spinner("書き出し中…"):
+                m = backup.export_archive(DB_PATH, tmp)
+            st.caption(" / ".join(f"{t}: {v['rows']}" for t, v in m["tables"].items()) + f" / 画像: {m['blobs']}")
+            with open(tmp, "rb") as f:
+                st.download_button("ダウンロード", f, file_name=f"outfits-{datetime.now():%Y%m%d}.zip",
+                                   mime="application/zip", key="bk_download")
+        finally:
+            os.remove(tmp)
+    bk_up = cb[1].file_uploader("取り込み（zip）", type=["zip"], key="bk_import")
+    if bk_up is not None and st.button("取り込む", key="bk_import_btn"):
+        storage.flush(timeout=60)
+        fd, tmp = tempfile.mkstemp(suffix=".zip")
+        try:
+            with os.fdopen(fd, "wb") as f: shutil.copyfileobj(bk_up, f)
+            with st.spinner("取り込み中…（中断しても再実行で続きから）"):
+                stats = backup.import_archive(tmp, DB_PATH)
+            st.success("取り込みました：" + " / ".join(f"{t} +{v['inserted']}（重複 {v['deduped']}）" for t, v in stats.items()))
+        except Exception as e:
+            st.error(f"取り込みに失敗しました: {e}")
+        finally:
+            os.remove(tmp)
+
+    # セッションの一時データ（アップロード中の画像など）の使用量
+    au = asset_store().usage(_session_id()); ag = asset_store().stats()
+    st.caption(f"一時データ: このセッション {au['count']} 件 / {au['bytes']/2**20:.1f} MB"
+               f"（サーバー全体 {ag['sessions']} セッション / {ag['disk']/2**20:.1f} MB、メモリ {ag['mem']/2**20:.1f} MB）")
 
 # ===== お問い合わせ =====
 with tabContact:
@@ -1046,20 +901,19 @@ with tabContact:
             "profile": {"season": profile.get("season"), "body_shape": profile.get("body_shape")},
             "ts": datetime.utcnow().isoformat()
         }
-        save_feedback(kind, subject or "(件名なし)", body or "", contact or "", img_bytes, meta)
-        st.success("受け付けました。アプリ内に保存しました。")
-
-        if use_github and "GH_REPO" in st.secrets and "GH_TOKEN" in st.secrets:
-            ok, info = send_github_issue(
-                st.secrets["GH_REPO"], st.secrets["GH_TOKEN"],
-                f"[Outf!ts] {kind}: {subject or '(件名なし)'}",
-                (body or "") + f"\n\n---\n連絡先: {contact or '未記入'}\nmeta: {json.dumps(meta, ensure_ascii=False)}"
-            )
-            if ok:
-                st.success("GitHub Issue を作成しました")
-                st.link_button("Issueを開く", info)
-            else:
-                st.warning(f"GitHub Issueの作成に失敗: {info}")
+        gh = github_secrets()
+        issue = None
+        if use_github and gh:
+            # Issue の送信待ちは feedback と同じトランザクションでシャードの outbox に積む（送信はバックグラウンド）
+            issue = (f"[Outf!ts] {kind}: {subject or '(件名なし)'}",
+                     (body or "") + f"\n\n---\n連絡先: {contact or '未記入'}\nmeta: {json.dumps(meta, ensure_ascii=False)}")
+        fb_fut = save_feedback(kind, subject or "(件名なし)", body or "", contact or "", img_bytes, meta, issue=issue)
+        track_write(fb_fut, "受け付けました。アプリ内に保存しました。")
+
+        if issue:
+            ob = feedback_outbox(*gh)
+            fb_fut.add_done_callback(lambda f, shard=DB_PATH: f.exception() is None and ob.watch(shard))
+            st.info("GitHub Issue は順次作成します。状況は下の一覧で確認できます。")
 
     st.markdown("---")
     st.caption("直近の送信（アプリ内保存）")
@@ -1067,15 +921,26 @@ with tabContact:
     if not rows:
         st.write("まだありません")
     else:
-        for fid,created,kind,subject,body,contact,imgb,meta in rows:
+        gh = github_secrets()
+        fb_status = feedback_outbox(*gh).status(DB_PATH, [r[0] for r in rows]) if gh else {}
+        GH_LABEL = {"pending": "送信待ち", "sending": "送信中", "sent": "作成済み", "failed": "失敗"}
+        for fid,created,kind,subject,body,contact,has_img,meta in rows:
             with st.expander(f"[{created[:19]}] {kind}：{subject}（ID:{fid}）", expanded=False):
                 st.write(body or "")
                 st.caption(f"連絡先: {contact or '—'}")
-                if imgb:
-                    try: st.image(Image.open(io.BytesIO(imgb)), use_container_width=True)
-                    except: st.write("画像を表示できませんでした")
-
-# ===== ページ最下部：コンパクト表示トグル =====
+                ob_st = fb_status.get(fid)
+                if ob_st:
+                    msg = f"GitHub: {GH_LABEL.get(ob_st['status'], ob_st['status'])}（試行 {ob_st['attempts']} 回）"
+                    if ob_st["status"] == "sent" and ob_st["url"]: msg += f" [Issueを開く]({ob_st['url']})"
+                    elif ob_st["error"]: msg += f" — {ob_st['error']}"
+                    st.caption(msg)
+                # 添付は開いた時だけ読み込む
+                if has_img and st.toggle("添付画像を表示", key=f"fb_img_{fid}"):
+                    h = img_hashes("feedback", [fid]).get(fid)
+                    if not show_media(h, lambda fid=fid: load_feedback_img(fid), w=1280): st.write("画像を表示できませんでした")
+
+# ===== ページ最下部：保存結果の通知 / コンパクト表示トグル =====
+report_writes()
 st.divider()
 new_compact = st.toggle("コンパクト表示", value=compact, key="compact_ctrl", help="情報密度を上げます。")
 if new_compact != compact:
@@ -0,0 +1,23 @@
+# outfits — Outf!ts のドメインロジック（Streamlit 非依存）
+#
+#   storage    … ユーザー別 SQLite シャード / 書き込みキュー / データ操作
+#   colors     … HEX・RGB・Lab 変換と色名
+#   imaging    … 写真の主色抽出・上下判定・ヒストグラム・コンタクトシート
+#   ingest     … 商品ページ URL からの取り込み
+#   scoring    … コーデの採点と好みモデル
+#   recommend  … コーデ生成・複数日プランナー・検索リンク
+#   linking    … 記録写真とクローゼットのアイテム照合
+#   analytics  … 着用・色・スコアの集計
+#   media      … 内容ハッシュ URL の画像配信（署名付きルート・長期キャッシュ）
+#   feedback   … GitHub Issue 送信の outbox
+#   backup     … zip へのエクスポート / インポート
+#   reanalysis … 解析アルゴリズム更新時の保存済み画像の再解析
+#   assets     … セッション一時データ（画像）の退避と上限管理
+#   loadtest   … 同時セッションの負荷試験（AppTest で app.py を動かす）
+#   bench      … 画像解析のベンチマーク（ラベル付きコーパスで時間と精度）
+#   sync       … リモート（Postgres / Supabase）とのオフラインファースト同期
+#   syncserver … 同期の検証用スタンドイン（PostgREST / Storage の一部を SQLite で）
+#   cli        … python -m outfits
+#
+# app.py（Streamlit）はこれらを呼ぶだけの表示層。ワーカープロセスやバッチからは
+# 必要なモジュールだけを import すればよい（Streamlit は読み込まれない）。
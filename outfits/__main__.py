@@ -0,0 +1,4 @@
+from .cli import main
+
+if __name__ == "__main__":   # spawn のワーカーが __mp_main__ として読み込んでも CLI を実行しない
+    main()
@@ -0,0 +1,69 @@
+# outfits/analytics.py — 着用回数・色の傾向・スコア推移の集計（SQL 集約 + pandas）
+import json
+import numpy as np, pandas as pd
+from .imaging import hsv_from_rgb
+from .storage import db, pool
+
+FAMILY_COLORS = {"black":"#222222","white":"#e8e8e8","gray":"#9a9a9a","red":"#d33b3b","orange":"#f0932b",
+                 "yellow":"#f6d743","green":"#3c9a5f","cyan":"#39b5c4","blue":"#3b64d3","purple":"#7d4cc2",
+                 "magenta":"#d04fb0"}
+MONTH_SEASON = {12:"winter",1:"winter",2:"winter",3:"spring",4:"spring",5:"spring",
+                6:"summer",7:"summer",8:"summer",9:"autumn",10:"autumn",11:"autumn"}
+
+def hex_family_vec(hexes) -> np.ndarray:
+    """hex_family のベクトル版（不正な値は "unknown"）"""
+    hs = pd.Series(hexes, dtype="object").fillna("").str.lower()
+    ok = hs.str.fullmatch(r"#[0-9a-f]{6}").to_numpy()
+    out = np.full(len(hs), "unknown", dtype=object)
+    if not ok.any(): return out
+    rgb = np.frombuffer(bytes.fromhex("".join(s[1:] for s in hs[ok])), np.uint8).reshape(-1, 1, 3)
+    H, S, V = (x[:, 0] for x in hsv_from_rgb(rgb.astype(np.float32) / 255.0))
+    conds = [V < 0.15, (S < 0.15) & (V > 0.9), S < 0.20,
+             H < 15, H < 45, H < 65, H < 170, H < 200, H < 255, H < 290, H < 330]
+    names = ["black","white","gray","red","orange","yellow","green","cyan","blue","purple","magenta"]
+    out[ok] = np.select(conds, names, default="red")
+    return out
+
+def analytics_signature():
+    # 件数・最終 id・更新時刻が変わらなければ集計キャッシュをそのまま使う。updated_at は書き込みのたびに入るので
+    # 編集・評価・予定の確定も拾える。同期で古い時刻の行が入っても変わるよう合計も見る（どれも索引だけで引ける）
+    with db() as conn:
+        return conn.execute(f"""SELECT {','.join(f"(SELECT printf('%d:%d:%d:%d', COUNT(*), MAX(id), MAX(updated_at), TOTAL(updated_at)) FROM {t})"
+                                                for t in ("coords", "outfits", "items"))},
+                                       (SELECT COUNT(*) FROM outfit_items)""").fetchone()
+
+def wardrobe_analytics(db_path) -> dict:
+    with pool().connect(db_path) as conn:
+        wear = pd.read_sql_query("""
+            SELECT i.id, i.name, i.category, i.color_hex, COALESCE(w.n, 0) AS worn, w.last AS last_used
+            FROM items i LEFT JOIN (
+              SELECT item_id, COUNT(*) AS n, MAX(created_at) AS last FROM (
+                SELECT top_id AS item_id, worn_at AS created_at FROM worn_coords UNION ALL
+                SELECT bottom_id, worn_at FROM worn_coords UNION ALL
+                SELECT shoes_id, worn_at FROM worn_coords UNION ALL
+                SELECT bag_id, worn_at FROM worn_coords UNION ALL
+                SELECT l.item_id, o.d FROM outfit_items l JOIN outfits o ON o.id = l.outfit_id)
+              WHERE item_id IS NOT NULL GROUP BY item_id) w ON w.item_id = i.id
+            ORDER BY worn DESC, i.id""", conn)
+        logs = pd.read_sql_query("SELECT d, top_color, bottom_color FROM outfits WHERE d IS NOT NULL", conn)
+        coords = pd.read_sql_query("SELECT created_at, score, ctx FROM coords ORDER BY id", conn)
+
+    by_cat = (wear.groupby("category", dropna=False)
+                  .agg(items=("id", "size"), worn=("worn", "sum"), never=("worn", lambda x: int((x == 0).sum())))
+                  .sort_values("worn", ascending=False))
+
+    colors = logs.melt(id_vars="d", value_vars=["top_color", "bottom_color"], var_name="part", value_name="hex")
+    colors["family"] = hex_family_vec(colors["hex"])
+    dt = pd.to_datetime(colors["d"], errors="coerce")
+    colors["month"] = dt.dt.strftime("%Y-%m"); colors["season"] = dt.dt.month.map(MONTH_SEASON)
+    by_month = pd.crosstab(colors["month"], colors["family"]) if len(colors) else pd.DataFrame()
+    by_season = pd.crosstab(colors["season"], colors["family"]) if len(colors) else pd.DataFrame()
+
+    trend = pd.DataFrame()
+    if len(coords):
+        ctx = pd.json_normalize([json.loads(c or "{}").get("ai_breakdown") or {} for c in coords["ctx"]])
+        trend = pd.concat([pd.to_datetime(coords["created_at"], errors="coerce").rename("date"),
+                           coords["score"].rename("Total"), ctx], axis=1).dropna(subset=["date"])
+        trend = trend.set_index("date").resample("W").mean(numeric_only=True).dropna(how="all")
+    return {"wear": wear, "by_cat": by_cat, "by_month": by_month, "by_season": by_season, "trend": trend,
+            "logs": len(logs), "coords": len(coords)}
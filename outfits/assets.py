@@ -0,0 +1,121 @@
+# outfits/assets.py — セッション一時データ（アップロード/取得した画像）の置き場
+#
+# 画像本体は内容ハッシュ名の一時ファイルに退避し、セッション側はハッシュ（ハンドル）だけを持つ。
+# 同じ画像を複数セッションが持っても実体は 1 つ。セッションごとと全体の上限を超えたら
+# 最も使われていないものから手放す（LRU）。よく読むものだけ小さなメモリキャッシュに置く。
+import os, hashlib, shutil, tempfile, threading, time
+from collections import OrderedDict
+
+ASSET_DIR = os.environ.get("OUTFITS_ASSET_DIR")
+ASSET_SESSION_BUDGET = int(os.environ.get("OUTFITS_ASSET_SESSION_MB", "24")) << 20
+ASSET_GLOBAL_BUDGET = int(os.environ.get("OUTFITS_ASSET_GLOBAL_MB", "512")) << 20
+ASSET_MEM_BUDGET = int(os.environ.get("OUTFITS_ASSET_MEM_MB", "16")) << 20
+ASSET_SESSION_TTL = int(os.environ.get("OUTFITS_ASSET_TTL_SEC", str(6*3600)))
+
+class AssetStore:
+    """put(sid, bytes) → ハンドル、get(sid, ハンドル) → bytes（手放された後は None）"""
+    def __init__(self, root=ASSET_DIR, session_budget=ASSET_SESSION_BUDGET, global_budget=ASSET_GLOBAL_BUDGET,
+                 mem_budget=ASSET_MEM_BUDGET, ttl=ASSET_SESSION_TTL):
+        self.root = root or tempfile.mkdtemp(prefix="outfits-assets-")
+        os.makedirs(self.root, exist_ok=True)
+        self.session_budget = session_budget; self.global_budget = global_budget
+        self.mem_budget = mem_budget; self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = {}          # sid -> {"items": OrderedDict(h -> size), "used": 時刻}
+        self._holders = {}           # h -> {sid, ...}
+        self._sizes = OrderedDict()  # h -> size（全体の LRU 順）
+        self._disk = 0
+        self._mem = OrderedDict(); self._mem_bytes = 0
+
+    def _path(self, h):
+        return os.path.join(self.root, h)
+
+    def put(self, sid, data: bytes) -> str:
+        h = hashlib.sha256(data).hexdigest()[:32]
+        with self._lock:
+            if h not in self._sizes:
+                tmp = f"{self._path(h)}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f: f.write(data)
+                os.replace(tmp, self._path(h))
+                self._sizes[h] = len(data); self._disk += len(data)
+            sess = self._sessions.setdefault(sid, {"items": OrderedDict(), "used": 0})
+            sess["items"][h] = len(data); self._touch(sid, h)
+            self._holders.setdefault(h, set()).add(sid)
+            self._cache(h, data)
+            self._enforce(sid, h)
+        return h
+
+    def get(self, sid, h):
+        with self._lock:
+            sess = self._sessions.get(sid)
+            if not h or not sess or h not in sess["items"]: return None
+            self._touch(sid, h)
+            b = self._mem.get(h)
+            if b is not None:
+                self._mem.move_to_end(h); return b
+        try:
+            with open(self._path(h), "rb") as f: b = f.read()
+        except OSError:
+            return None
+        with self._lock:
+            if h in self._sizes: self._cache(h, b)
+        return b
+
+    def release(self, sid, h):
+        with self._lock: self._drop(sid, h)
+
+    def usage(self, sid) -> dict:
+        with self._lock:
+            items = self._sessions.get(sid, {}).get("items", {})
+            return {"count": len(items), "bytes": sum(items.values())}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._sessions), "files": len(self._sizes),
+                    "disk": self._disk, "mem": self._mem_bytes}
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _touch(self, sid, h):
+        sess = self._sessions[sid]
+        sess["items"].move_to_end(h); sess["used"] = time.time()
+        self._sizes.move_to_end(h)
+
+    def _cache(self, h, b):
+        if len(b) > self.mem_budget // 4: return   # 大きいものはディスクから読む
+        if h not in self._mem:
+            self._mem[h] = b; self._mem_bytes += len(b)
+        self._mem.move_to_end(h)
+        while self._mem_bytes > self.mem_budget:
+            _, old = self._mem.popitem(last=False); self._mem_bytes -= len(old)
+
+    def _drop(self, sid, h):
+        sess = self._sessions.get(sid)
+        if sess: sess["items"].pop(h, None)
+        holders = self._holders.get(h)
+        if holders is not None:
+            holders.discard(sid)
+            if holders: return
+            del self._holders[h]
+        self._disk -= self._sizes.pop(h, 0)
+        b = self._mem.pop(h, None)
+        if b is not None: self._mem_bytes -= len(b)
+        try: os.remove(self._path(h))
+        except OSError: pass
+
+    def _enforce(self, sid, keep):
+        now = time.time()
+        for s, sess in list(self._sessions.items()):   # 閉じられた（放置された）セッション
+            if s != sid and now - sess["used"] > self.ttl:
+                for h in list(sess["items"]): self._drop(s, h)
+                del self._sessions[s]
+        items = self._sessions[sid]["items"]
+        while sum(items.values()) > self.session_budget and len(items) > 1:
+            h = next(iter(items))
+            if h == keep: items.move_to_end(h); continue
+            self._drop(sid, h)
+        for h in list(self._sizes):
+            if self._disk <= self.global_budget: break
+            if h == keep: continue
+            for s in list(self._holders.get(h, ())): self._drop(s, h)
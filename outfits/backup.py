@@ -0,0 +1,169 @@
+# outfits/backup.py — Outf!ts のエクスポート/インポート（Streamlit 非依存・ストリーミング）
+#
+# アーカイブは zip:
+#   manifest.json          … 形式バージョン / アーカイブID / 列名 / 件数
+#   rows/<table>.jsonl     … 1 行 1 JSON。img は "img_sha256" に置き換え
+#   blobs/<sha256>         … 画像本体（内容ハッシュで 1 回だけ格納）
+# 行も画像も 1 件ずつ読み書きするので、DB の大きさに関わらずメモリは一定。
+# 取り込むのは TABLES の、取り込み先に既にある列だけ（アーカイブは利用者のアップロード。中の SQL や
+# 列名を実行・信用しない。スキーマは取り込み先の storage.init_schema が作る）。
+#
+#   python -m outfits export data/users/ab/abcd.db wardrobe.zip
+#   python -m outfits import wardrobe.zip data/users/ab/abcd.db
+import os, re, sqlite3, zipfile, json, hashlib, uuid, io
+from contextlib import closing
+from datetime import datetime
+from . import storage
+from .storage import SYNC_TABLES, NEW_UID, NOW_MS
+
+FORMAT = 1
+# 参照される側から順に（coords / outfit_items は items・outfits の取り込み先 id に付け替える）
+TABLES = ["profile", "pref_model", "items", "outfits", "outfit_items", "feedback", "coords"]
+BLOB_COLS = {"img"}
+COORD_REFS = ["top_id", "bottom_id", "shoes_id", "bag_id"]
+REFS = {"coords": {c: "items" for c in COORD_REFS},
+        "outfit_items": {"outfit_id": "outfits", "item_id": "items"}}
+SINGLETONS = {"profile", "pref_model"}   # id=1 の 1 行だけ。取り込み先に既にあればそちらを優先
+LINKS = {"outfit_items"}                 # id のない対応表。主キーが重なる行は取り込まない
+_SHA256 = re.compile(r"[0-9a-f]{64}")   # blobs/ から読むのはこの形の名前だけ
+IMPORT_BATCH_BYTES = 32 << 20            # 画像が大きい時は行数より先にこの大きさで区切って書く
+# 既存行と同一とみなすキー（インポート時の重複排除）
+DEDUPE_KEYS = {
+    "items":    ["name", "category", "img_hash"],
+    "outfits":  ["d", "img_hash", "notes"],
+    "feedback": ["created_at", "subject", "img_hash"],
+    "coords":   ["created_at", "top_id", "bottom_id", "shoes_id", "bag_id"],
+}
+
+def _columns(conn, table):
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+def _tables(conn):
+    return {r[0]: r[1] for r in conn.execute("SELECT name, sql FROM sqlite_master WHERE type='table'")}
+
+def export_archive(db_path, out_path, progress=None):
+    """db_path の全テーブルを out_path（zip）へ書き出す。progress(table, n) で進捗通知"""
+    conn = sqlite3.connect(db_path)
+    schema = _tables(conn)
+    manifest = {"format": FORMAT, "id": uuid.uuid4().hex, "created_at": datetime.utcnow().isoformat(),
+                "tables": {}, "blobs": 0}
+    blob_src = {}   # sha256 -> (table, id)：画像本体は 2 パス目で 1 件ずつ読む
+    try:
+        with zipfile.ZipFile(out_path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            for t in TABLES:
+                if t not in schema: continue
+                cols = _columns(conn, t)
+                n = 0
+                with zf.open(f"rows/{t}.jsonl", "w", force_zip64=True) as f:
+                    for row in conn.execute(f"SELECT {','.join(cols)} FROM {t} ORDER BY rowid"):
+                        rec = {}
+                        for c, v in zip(cols, row):
+                            if c in BLOB_COLS:
+                                h = hashlib.sha256(v).hexdigest() if v else None
+                                if h: blob_src.setdefault(h, (t, row[cols.index("id")]))
+                                rec[f"{c}_sha256"] = h
+                            else:
+                                rec[c] = v
+                        f.write((json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8"))
+                        n += 1
+                        if progress and n % 200 == 0: progress(t, n)
+                manifest["tables"][t] = {"rows": n, "columns": cols}
+                if progress: progress(t, n)
+            for h, (t, rid) in blob_src.items():
+                b = conn.execute(f"SELECT img FROM {t} WHERE id=?", (rid,)).fetchone()[0]
+                zf.writestr(zipfile.ZipInfo(f"blobs/{h}"), b, compress_type=zipfile.ZIP_STORED)
+            manifest["blobs"] = len(blob_src)
+            zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=1))
+    finally:
+        conn.close()
+    return manifest
+
+def import_archive(archive_path, db_path, batch=200, progress=None):
+    """アーカイブを db_path へ取り込む。
+
+    書き込みはアプリと同じ書き込みキュー（storage.pool().writer）に batch 行ずつ流す。
+    取り込み済みの行は import_map に (archive, table, src_id) → dst_id として記録し、
+    同じトランザクションでコミットする。途中で止まっても再実行すれば続きから進む。
+    DEDUPE_KEYS が一致する既存行は新規作成せずその行へ対応付ける。
+    アーカイブにあって取り込み先にないテーブル・列は読み飛ばす。
+    """
+    with storage.pool().connect(db_path) as conn:   # 初回ならここでスキーマを作る
+        tables = set(_tables(conn))
+    writer = storage.pool().writer(db_path)
+    write = lambda stmts: stmts and writer.submit(stmts, durable=False).result(timeout=300)
+    write([("""CREATE TABLE IF NOT EXISTS import_map(
+        archive TEXT, tbl TEXT, src_id INTEGER, dst_id INTEGER, PRIMARY KEY(archive, tbl, src_id))""", ())])
+    stats = {}
+    with zipfile.ZipFile(archive_path) as zf:
+        manifest = json.loads(zf.read("manifest.json"))
+        if manifest.get("format") != FORMAT: raise ValueError(f"未対応の形式: {manifest.get('format')}")
+        arch = manifest["id"]
+        for t in TABLES:
+            if t not in manifest["tables"] or t not in tables: continue
+            with storage.pool().connect(db_path) as conn:
+                # 同期用の識別子は取り込み先で振り直す
+                cols = [c for c in _columns(conn, t) if c != "id" and not (t in SYNC_TABLES and c in ("uid", "updated_at"))]
+                done = {r[0] for r in conn.execute("SELECT src_id FROM import_map WHERE archive=? AND tbl=?", (arch, t))}
+                refs = {rt: {r[0]: r[1] for r in conn.execute("SELECT src_id, dst_id FROM import_map WHERE archive=? AND tbl=?", (arch, rt))}
+                        for rt in set(REFS.get(t, {}).values())}
+            st = stats[t] = {"inserted": 0, "deduped": 0, "skipped": 0}
+            stmts = []; size = 0; keys = set()   # まだ書いていない行（と、その重複判定キー）
+            # 重複判定はテーブルごとに 1 本の読み取り専用接続で（WAL なので書いた分も次の文から見える）
+            with closing(sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True, timeout=30)) as rconn, \
+                 io.TextIOWrapper(zf.open(f"rows/{t}.jsonl"), encoding="utf-8") as f:
+                for line in f:
+                    rec = json.loads(line); src = rec.get("id")
+                    if src in done: st["skipped"] += 1; continue
+                    h = rec.pop("img_sha256", None)
+                    if h is not None and not (isinstance(h, str) and _SHA256.fullmatch(h)): h = None
+                    if h:
+                        rec["img_hash"] = h[:32]
+                    for c, rt in REFS.get(t, {}).items():
+                        if rec.get(c) is not None: rec[c] = refs[rt].get(rec[c])
+                    if t in LINKS and any(rec.get(c) is None for c in REFS[t]):
+                        st["skipped"] += 1; continue
+                    key = tuple(rec.get(k) for k in DEDUPE_KEYS.get(t, REFS.get(t, ())))
+                    if key and key in keys:   # 同じ行がまだ書いていない分にある。書いてから重複として扱う
+                        write(stmts); stmts = []; size = 0; keys = set()
+                    dst = _find_dup(rconn, t, rec)
+                    if dst is not None:
+                        st["deduped"] += 1
+                    else:
+                        sql, params = _insert_stmt(zf, t, cols, rec, h)
+                        stmts.append((sql, params)); st["inserted"] += 1; keys.add(key)
+                        size += sum(len(v) for v in params if isinstance(v, (bytes, str)))
+                    if t not in LINKS:   # 新しい行の id は同じトランザクションで直前に入れた行（単一ライター）
+                        stmts.append((f"""INSERT OR REPLACE INTO import_map(archive,tbl,src_id,dst_id)
+                                          VALUES(?,?,?,{'?' if dst is not None else f'(SELECT MAX(rowid) FROM {t})'})""",
+                                       (arch, t, src) + ((dst,) if dst is not None else ())))
+                    if len(stmts) >= batch or size >= IMPORT_BATCH_BYTES:
+                        write(stmts); stmts = []; size = 0; keys = set()
+                        if progress: progress(t, st)
+            write(stmts)
+            if progress: progress(t, st)
+    return stats
+
+def _find_dup(conn, t, rec):
+    if t in SINGLETONS:   # 既存のプロフィール / 好みの学習結果を優先
+        return 1 if conn.execute(f"SELECT 1 FROM {t} WHERE id=1").fetchone() else None
+    if t in LINKS:   # 主キーが同じリンクは取り込み済み
+        where = " AND ".join(f"{k}=?" for k in REFS[t])
+        return 1 if conn.execute(f"SELECT 1 FROM {t} WHERE {where}", [rec[k] for k in REFS[t]]).fetchone() else None
+    keys = DEDUPE_KEYS.get(t)
+    if not keys: return None
+    where = " AND ".join(f"{k} IS ?" for k in keys)
+    row = conn.execute(f"SELECT id FROM {t} WHERE {where} LIMIT 1", [rec.get(k) for k in keys]).fetchone()
+    return row[0] if row else None
+
+def _insert_stmt(zf, t, cols, rec, blob_hash):
+    if t in SINGLETONS:
+        use = [c for c in cols if c in rec]
+        sync_cols, sync_vals = (",uid,updated_at", f",'profile',{NOW_MS}") if t == "profile" else ("", "")
+        return (f"INSERT INTO {t}(id,{','.join(use)}{sync_cols}) VALUES(1,{','.join('?'*len(use))}{sync_vals})",
+                tuple(rec[c] for c in use))
+    if blob_hash and "img" in cols:
+        rec["img"] = zf.read(f"blobs/{blob_hash}")
+    use = [c for c in cols if c in rec]
+    sync_cols, sync_vals = (",uid,updated_at", f",{NEW_UID},{NOW_MS}") if t in SYNC_TABLES else ("", "")
+    return (f"INSERT INTO {t}({','.join(use)}{sync_cols}) VALUES({','.join('?'*len(use))}{sync_vals})",
+            tuple(rec[c] for c in use))
@@ -0,0 +1,283 @@
+# outfits/bench.py — 画像解析パイプラインのベンチマーク（正解ラベル付きコーパス）
+#
+# 上下判定（classify_top_or_bottom）と主色（main_color_from_region）はしきい値と投票の
+# ヒューリスティックなので、速度を上げる変更で精度が落ちても気づけない。ここでは
+# ラベル付きの画像（既定は seed 固定で毎回同じに生成する合成画像）を、アプリと同じ流れ
+# （縮小デコード → 上下判定 → 上/下の主色 → パレット）で解析し、次を JSON に出す。
+#
+#   ・段階別の所要時間（decode / resize / hsv / mask / quantile / votes / palette）
+#   ・スループット（1 枚ずつ / プロセスプールでまとめて）
+#   ・上下判定の正解率と主色の ΔE（ラベルとの色差）
+#   ・しきい値チェック（BENCH_LIMITS と、--baseline で渡した過去の結果との比較）
+#
+#   python -m outfits bench
+#   python -m outfits bench --baseline data/bench/base.json     # 同じマシンで取った結果と比べる
+#   python -m outfits bench --write-corpus bench_corpus          # 合成コーパスを書き出す
+#   python -m outfits bench --corpus my_photos                   # 実写真（labels.json 付き）で測る
+#
+# labels.json は [{"file": "a.jpg", "category": "トップス"|"ボトムス"|null,
+#                  "upper": "#rrggbb"|null, "lower": "#rrggbb"|null, "tags": [...]}, ...]。
+# tags に "hard" があるものは参考値として集計し、しきい値チェックには使わない。
+import os, io, json, time, random, platform
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+import numpy as np
+from . import imaging
+from .imaging import decode_small, classify_top_or_bottom, main_color_from_region, extract_palette
+from .colors import hex_to_rgb, srgb_to_lab
+from .loadtest import percentile, git_rev
+
+BENCH_DIR = "data/bench"
+CORPUS_SEED = 20240601
+STAGES = ("decode", "resize", "hsv", "mask", "quantile", "votes", "palette")
+BENCH_LIMITS = {
+    "min_accuracy": 0.90,      # 上下判定の正解率（hard 以外）
+    "max_de_mean": 6.0,        # 主色 ΔE の平均（hard 以外）
+    "max_de_p95": 15.0,
+    # 以下は --baseline（同じマシン・同じコーパスの過去の結果）がある時だけ
+    "max_accuracy_drop": 0.0,
+    "max_de_mean_rise": 1.0,
+    "max_slowdown": 0.15,      # 1 枚ずつのスループットの低下率
+}
+
+# ---------- 合成コーパス ----------
+GARMENT_COLORS = {
+    "navy": "#1f2a44", "black": "#111111", "charcoal": "#3a3a3a", "red": "#b0202a", "olive": "#556b2f",
+    "mustard": "#c9a227", "denim": "#3b5b8c", "khaki": "#a08a5a", "green": "#2e7d4f", "burgundy": "#6d1f2f",
+    "royal": "#2446a8", "orange": "#d9642b", "brown": "#6b4226", "teal": "#1f7a7a", "purple": "#5b3a8c",
+    "grey": "#808080",
+}
+HARD_COLORS = {"white": "#f4f4f2", "cream": "#efe6d2", "pastel_pink": "#f3d3dc", "light_grey": "#d0d0d0"}
+BACKGROUNDS = ("#ebe8e2", "#f2f2f2", "#dcd8d0", "#e6ebef")
+SKIN = "#e0bca0"
+SIZES = ((1080, 1440), (480, 640), (1080, 1440), (3024, 4032))
+FORMATS = ("JPEG", "PNG", "WEBP")
+
+def corpus_spec(seed=CORPUS_SEED) -> list:
+    """合成画像の設計図（ラベル込み）。seed が同じなら毎回同じ"""
+    rng = random.Random(seed); names = list(GARMENT_COLORS); specs = []
+    for kind, n in (("top", 14), ("bottom", 14), ("outfit", 14)):
+        for i in range(n):
+            top, bottom = rng.sample(names, 2)
+            size, fmt = SIZES[i % len(SIZES)], FORMATS[i % len(FORMATS)]   # 周期をずらして組み合わせを散らす
+            orient = 6 if fmt == "JPEG" and i % 2 == 1 else 1
+            specs.append({"kind": kind, "top": GARMENT_COLORS[top], "bottom": GARMENT_COLORS[bottom],
+                          "bg": rng.choice(BACKGROUNDS), "size": size, "fmt": fmt, "orient": orient,
+                          "model": kind == "outfit" or i % 2 == 1, "noise": rng.choice((4, 8, 12)),
+                          "tags": [kind, fmt.lower(), f"{size[0]}w"] + (["exif"] if orient != 1 else [])})
+    for i, (name, hx) in enumerate(HARD_COLORS.items()):   # 背景に近い淡色：苦手なケースの参考値
+        kind = ("top", "bottom")[i % 2]
+        specs.append({"kind": kind, "top": hx, "bottom": hx, "bg": BACKGROUNDS[i % len(BACKGROUNDS)], "size": (1080, 1440),
+                      "fmt": "JPEG", "orient": 1, "model": False, "noise": 6, "tags": [kind, "hard", name]})
+    for i, s in enumerate(specs): s["id"] = f"{i:03d}-{s['kind']}"
+    return specs
+
+def spec_labels(s) -> dict:
+    up = s["top"] if s["kind"] in ("top", "outfit") else None
+    lo = s["bottom"] if s["kind"] in ("bottom", "outfit") else None
+    cat = {"top": "トップス", "bottom": "ボトムス"}.get(s["kind"])
+    return {"id": s["id"], "category": cat, "upper": up, "lower": lo, "tags": s["tags"]}
+
+def render(s) -> bytes:
+    """設計図から画像ファイル（bytes）を作る。orient=6 は画素を回転して EXIF で戻させる"""
+    from PIL import Image, ImageDraw, ImageChops, ImageFilter
+    w, h = s["size"]
+    im = Image.new("RGB", (w, h), hex_to_rgb(s["bg"])); dr = ImageDraw.Draw(im)
+    box = lambda x0, y0, x1, y1: (x0*w, y0*h, x1*w, y1*h)
+    skin, top, bottom = hex_to_rgb(SKIN), hex_to_rgb(s["top"]), hex_to_rgb(s["bottom"])
+    if s["kind"] == "outfit":
+        t0, t1, b0, b1 = 0.13, 0.50, 0.50, 0.90
+    elif s["kind"] == "top":
+        t0, t1, b0, b1 = 0.14, 0.58, None, None
+    else:
+        t0, t1, b0, b1 = None, None, 0.40, 0.94
+    if s["model"] and t0 is not None:
+        dr.ellipse(box(0.43, t0-0.11, 0.57, t0-0.01), fill=skin)
+        dr.rectangle(box(0.14, t0+0.16, 0.20, t1-0.02), fill=skin); dr.rectangle(box(0.80, t0+0.16, 0.86, t1-0.02), fill=skin)
+    if t0 is not None:
+        dr.rectangle(box(0.30, t0, 0.70, t1), fill=top)
+        dr.polygon([(0.30*w, t0*h), (0.16*w, (t0+0.17)*h), (0.22*w, (t0+0.20)*h), (0.30*w, (t0+0.09)*h)], fill=top)
+        dr.polygon([(0.70*w, t0*h), (0.84*w, (t0+0.17)*h), (0.78*w, (t0+0.20)*h), (0.70*w, (t0+0.09)*h)], fill=top)
+    if b0 is not None:
+        dr.rectangle(box(0.32, b0, 0.68, b0+0.07), fill=bottom)
+        dr.rectangle(box(0.32, b0+0.07, 0.48, b1), fill=bottom); dr.rectangle(box(0.52, b0+0.07, 0.68, b1), fill=bottom)
+        if s["model"]:
+            dr.ellipse(box(0.28, b1, 0.48, b1+0.04), fill=(40, 36, 34)); dr.ellipse(box(0.52, b1, 0.72, b1+0.04), fill=(40, 36, 34))
+    im = im.filter(ImageFilter.GaussianBlur(max(1, w // 600)))
+    n = Image.effect_noise((w, h), s["noise"])
+    im = ImageChops.add(im, Image.merge("RGB", (n, n, n)), 1.0, -128)
+    kw = {}
+    if s["orient"] == 6:
+        im = im.rotate(90, expand=True)
+        exif = Image.Exif(); exif[0x0112] = 6; kw["exif"] = exif
+    buf = io.BytesIO()
+    if s["fmt"] == "JPEG": im.save(buf, "JPEG", quality=88, **kw)
+    elif s["fmt"] == "WEBP": im.save(buf, "WEBP", quality=85)
+    else: im.save(buf, "PNG")
+    return buf.getvalue()
+
+def synthetic_corpus(seed=CORPUS_SEED) -> list:
+    return [(spec_labels(s), render(s)) for s in corpus_spec(seed)]
+
+_EXT = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+def write_corpus(dirpath, seed=CORPUS_SEED) -> int:
+    os.makedirs(dirpath, exist_ok=True); labels = []
+    for s in corpus_spec(seed):
+        fn = f"{s['id']}.{_EXT[s['fmt']]}"
+        with open(os.path.join(dirpath, fn), "wb") as f: f.write(render(s))
+        labels.append({"file": fn, **{k: v for k, v in spec_labels(s).items() if k != "id"}})
+    with open(os.path.join(dirpath, "labels.json"), "w", encoding="utf-8") as f:
+        json.dump(labels, f, ensure_ascii=False, indent=1)
+    return len(labels)
+
+def load_corpus(dirpath) -> list:
+    with open(os.path.join(dirpath, "labels.json"), encoding="utf-8") as f: labels = json.load(f)
+    out = []
+    for lb in labels:
+        with open(os.path.join(dirpath, lb["file"]), "rb") as f:
+            out.append(({"id": lb["file"], "category": lb.get("category"), "upper": lb.get("upper"),
+                         "lower": lb.get("lower"), "tags": lb.get("tags", [])}, f.read()))
+    return out
+
+# ---------- 解析（アプリの記録/アイテム追加と同じ流れ） ----------
+def analyse(b, palette=True) -> dict:
+    img = decode_small(b)
+    cat = classify_top_or_bottom(img)
+    res = {"category": cat, "upper": main_color_from_region(img, "upper"), "lower": main_color_from_region(img, "lower")}
+    if palette: res["palette"] = extract_palette(img, "upper" if cat == "トップス" else "lower")
+    return res
+
+def _analyse_chunk(args):
+    blobs, palette = args
+    return [analyse(b, palette) for b in blobs]
+
+def delta_e(a, b) -> float:
+    lab = srgb_to_lab(np.array([hex_to_rgb(a), hex_to_rgb(b)], np.float64))
+    return float(np.linalg.norm(lab[0] - lab[1]))
+
+def _ms(sec):
+    return None if sec is None else round(sec * 1000, 2)
+
+def _de_summary(xs) -> dict:
+    return {"n": len(xs), "mean": round(float(np.mean(xs)), 2) if xs else None,
+            "p95": round(percentile(xs, 95), 2) if xs else None, "max": round(max(xs), 2) if xs else None}
+
+def accuracy(cases, results) -> dict:
+    """hard 以外（core）/ hard / タグ別に、上下判定の正解率と主色の ΔE をまとめる"""
+    rows = []
+    for (lb, _), res in zip(cases, results):
+        de = [delta_e(lb[r], res[r]) for r in ("upper", "lower") if lb.get(r)]
+        ok = None if lb.get("category") is None else res["category"] == lb["category"]
+        rows.append((lb, ok, de))
+    def agg(sel):
+        oks = [ok for _, ok, _ in sel if ok is not None]
+        des = [d for _, _, de in sel for d in de]
+        return {"n": len(sel), "category_n": len(oks), "accuracy": round(sum(oks) / len(oks), 4) if oks else None,
+                "de": _de_summary(des)}
+    tags = sorted({t for lb, _, _ in rows for t in lb["tags"]})
+    fails = [{"id": lb["id"], "expected": {k: lb.get(k) for k in ("category", "upper", "lower")},
+              "got": {k: res[k] for k in ("category", "upper", "lower")}, "de": [round(d, 1) for d in de]}
+             for (lb, ok, de), res in zip(rows, results) if ok is False or any(d > BENCH_LIMITS["max_de_p95"] for d in de)]
+    return {"core": agg([r for r in rows if "hard" not in r[0]["tags"]]), "hard": agg([r for r in rows if "hard" in r[0]["tags"]]),
+            "by_tag": {t: agg([r for r in rows if t in r[0]["tags"]]) for t in tags}, "failures": fails}
+
+# ---------- 計測 ----------
+def stage_times(blobs, palette=True, repeat=3):
+    """1 枚ずつ、段階別の時間を計る（画像ごとに repeat 回の最速を採用）"""
+    per_image = []; results = []
+    try:
+        for b in blobs:
+            best = None
+            for _ in range(repeat):
+                st = {}
+                imaging.stage_timer = lambda k, sec: st.__setitem__(k, st.get(k, 0.0) + sec)
+                t0 = time.perf_counter(); res = analyse(b, palette); total = time.perf_counter() - t0
+                if best is None or total < best[0]: best = (total, st, res)
+            per_image.append(dict(best[1], total=best[0])); results.append(best[2])
+    finally:
+        imaging.stage_timer = None
+    stages = {}
+    for k in STAGES + ("total",):
+        xs = [p.get(k, 0.0) for p in per_image]
+        stages[k] = {"mean_ms": _ms(float(np.mean(xs))), "p50_ms": _ms(percentile(xs, 50)), "p95_ms": _ms(percentile(xs, 95))}
+    covered = sum(stages[k]["mean_ms"] for k in STAGES)
+    stages["other"] = {"mean_ms": round(stages["total"]["mean_ms"] - covered, 2)}   # 段階の外（crop・呼び出し等）
+    return stages, results
+
+def throughput_single(blobs, palette=True, repeat=3) -> float:
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for b in blobs: analyse(b, palette)
+        sec = time.perf_counter() - t0; best = sec if best is None else min(best, sec)
+    return len(blobs) / best
+
+def throughput_batched(blobs, palette=True, repeat=3, workers=None, chunk=4):
+    workers = workers or max(1, (os.cpu_count() or 2) // 2)
+    chunks = [(blobs[i:i+chunk], palette) for i in range(0, len(blobs), chunk)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as ex:
+        results = [r for rs in ex.map(_analyse_chunk, chunks[:workers]) for r in rs]   # 起動・import を計測から外す
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            results = [r for rs in ex.map(_analyse_chunk, chunks) for r in rs]
+            sec = time.perf_counter() - t0; best = sec if best is None else min(best, sec)
+    return len(blobs) / best, workers, results
+
+def checks(res, baseline=None) -> list:
+    L = BENCH_LIMITS; core = res["accuracy"]["core"]; out = []
+    def check(name, value, limit, ok):
+        out.append({"name": name, "value": value, "limit": limit, "ok": bool(ok)})
+    if core["accuracy"] is not None: check("accuracy", core["accuracy"], L["min_accuracy"], core["accuracy"] >= L["min_accuracy"])
+    if core["de"]["n"]:
+        check("de_mean", core["de"]["mean"], L["max_de_mean"], core["de"]["mean"] <= L["max_de_mean"])
+        check("de_p95", core["de"]["p95"], L["max_de_p95"], core["de"]["p95"] <= L["max_de_p95"])
+    if baseline:
+        bcore = baseline["accuracy"]["core"]
+        if core["accuracy"] is not None and bcore.get("accuracy") is not None:
+            lim = round(bcore["accuracy"] - L["max_accuracy_drop"], 4)
+            check("accuracy_vs_baseline", core["accuracy"], lim, core["accuracy"] >= lim)
+        if core["de"]["n"] and bcore["de"].get("mean") is not None:
+            lim = round(bcore["de"]["mean"] + L["max_de_mean_rise"], 2)
+            check("de_mean_vs_baseline", core["de"]["mean"], lim, core["de"]["mean"] <= lim)
+        b_ips = baseline["throughput"]["single_ips"]
+        lim = round(b_ips * (1 - L["max_slowdown"]), 2)
+        check("single_ips_vs_baseline", res["throughput"]["single_ips"], lim, res["throughput"]["single_ips"] >= lim)
+    return out
+
+def run(corpus=None, repeat=3, workers=None, palette=True, baseline=None, out=None, progress=None) -> dict:
+    """コーパスを解析して結果 JSON（既定 data/bench/<時刻>-<rev>.json）を書き、結果を返す"""
+    started = datetime.now(); rev = git_rev()
+    cases = load_corpus(corpus) if corpus else synthetic_corpus()
+    blobs = [b for _, b in cases]
+    if progress: progress("corpus", f"{len(cases)} images ({corpus or 'synthetic'})")
+    analyse(blobs[0], palette)   # 初回の import / 初期化を計測から外す
+    stages, results = stage_times(blobs, palette, repeat)
+    if progress: progress("stages", ", ".join(f"{k} {stages[k]['mean_ms']}" for k in STAGES + ("total",)) + " ms/img")
+    single = throughput_single(blobs, palette, repeat)
+    batched, n_workers, bres = throughput_batched(blobs, palette, repeat, workers)
+    if progress: progress("throughput", f"single {single:.1f} img/s, batched {batched:.1f} img/s ({n_workers} workers)")
+    mismatch = sum(a[k] != b.get(k) for a, b in zip(results, bres) for k in ("category", "upper", "lower", "palette") if k in a)
+    res = {"meta": {"started_at": started.isoformat(timespec="seconds"), "git_rev": rev,
+                    "analysis_version": imaging.ANALYSIS_VERSION, "python": platform.python_version(),
+                    "numpy": np.__version__, "platform": platform.platform(), "cpus": os.cpu_count(),
+                    "params": {"corpus": corpus or f"synthetic:{CORPUS_SEED}", "repeat": repeat, "palette": palette}},
+           "corpus": {"n": len(cases)},
+           "stages": stages,
+           "throughput": {"single_ips": round(single, 2), "batched_ips": round(batched, 2), "workers": n_workers,
+                          "batched_mismatch": mismatch},
+           "accuracy": accuracy(cases, results)}
+    if baseline:
+        with open(baseline, encoding="utf-8") as f: base = json.load(f)
+        res["meta"]["baseline"] = {"path": baseline, "git_rev": base["meta"].get("git_rev")}
+    else:
+        base = None
+    res["checks"] = checks(res, base)
+    res["ok"] = all(c["ok"] for c in res["checks"]) and not mismatch
+    out = os.path.abspath(out or os.path.join(BENCH_DIR, f"{started:%Y%m%d-%H%M%S}-{rev or 'local'}.json"))
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f: json.dump(res, f, ensure_ascii=False, indent=1)
+    res["path"] = out
+    return res
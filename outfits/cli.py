@@ -0,0 +1,238 @@
+# outfits/cli.py — よく使う処理のコマンドライン（Streamlit なしで動く）
+#
+#   python -m outfits analyse photo1.jpg photo2.jpg
+#   python -m outfits import-url --db data/app.db https://example.com/item/1
+#   python -m outfits generate --db data/app.db --want 通勤 --heat 暑い --days 7 --save
+#   python -m outfits export data/app.db wardrobe.zip
+#   python -m outfits import wardrobe.zip data/app.db
+#   python -m outfits reindex --db data/app.db --media
+#   python -m outfits reanalyse --all-shards --workers 2
+#   python -m outfits loadtest --levels 1,2,4,8 --rounds 3
+#   python -m outfits bench --baseline data/bench/base.json
+#   python -m outfits sync --all-shards          # 接続先は OUTFITS_SYNC_URL / OUTFITS_SYNC_KEY
+#   python -m outfits sync-server --port 54321   # 検証用のスタンドイン
+#
+# --db の代わりに --user user:me@example.com でユーザーのシャードを指定できる。
+import argparse, json, os, sys
+from datetime import date, timedelta
+from . import storage, backup
+from .storage import (init_db, flush, list_items, load_profile, add_item, get_usage_stats,
+                      save_coords_batch, img_hashes, item_palettes, user_db_path, LEGACY_DB_PATH)
+
+def _out(obj):
+    print(json.dumps(obj, ensure_ascii=False))
+
+def _open_db(a):
+    path = user_db_path(a.user) if a.user else a.db
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    init_db(path)
+    return path
+
+def cmd_analyse(a):
+    from .imaging import main_color_from_region, classify_top_or_bottom, decode_small, extract_palette
+    from .colors import nearest_css_name, JP_COLOR
+    for fn in a.images:
+        try:
+            img = decode_small(fn)
+        except Exception as e:
+            _out({"file": fn, "error": str(e)}); continue
+        cat = classify_top_or_bottom(img)
+        upper, lower = main_color_from_region(img, "upper"), main_color_from_region(img, "lower")
+        main = upper if cat == "トップス" else lower
+        _out({"file": fn, "category": cat, "upper": upper, "lower": lower,
+              "color": main, "color_name": JP_COLOR.get(nearest_css_name(main)),
+              "palette": {r: extract_palette(img, r) for r in ("upper", "lower")}})
+
+def cmd_import_url(a):
+    from .ingest import item_from_url
+    _open_db(a)
+    for url in a.urls:
+        it = item_from_url(url)
+        if it is None:
+            _out({"url": url, "error": "取得できませんでした"}); continue
+        iid = add_item(**it).result(timeout=60)
+        _out({"url": url, "id": iid, **{k: v for k, v in it.items() if k != "img_bytes"}, "has_img": bool(it["img_bytes"])})
+
+def cmd_generate(a):
+    from .scoring import load_pref_model, evaluate_outfit
+    from .recommend import generate_outfit, plan_outfits
+    _open_db(a)
+    items = list_items("すべて"); prof = load_profile(); w = load_pref_model()[0]
+    season, body_shape = prof.get("season"), prof.get("body_shape")
+    by_id = {r[0]: r for r in items}
+    start = date.fromisoformat(a.start) if a.start else date.today() + timedelta(days=1)
+    days = [{"date": str(start + timedelta(days=i)), "want": a.want, "heat": a.heat, "humidity": a.humidity,
+             "rainy": a.rainy} for i in range(a.days)]
+    if a.days == 1:
+        ids, _ = generate_outfit(items, season, body_shape, a.want, a.heat, a.humidity, a.rainy, w)
+        plan = [dict(ids, date=days[0]["date"])] if ids else []
+    else:
+        use_count, last_used = get_usage_stats()
+        plan = plan_outfits(items, days, season, body_shape, w, last_used, use_count, window=a.window)
+    if not plan:
+        _out({"error": "トップスが未登録です"}); return 1
+    rows = []; pals = item_palettes({p[k] for p in plan for k in ("top","bottom","shoes","bag")})
+    for p, day in zip(plan, days):
+        o = {k: by_id.get(p[k]) if p[k] else None for k in ("top","bottom","shoes","bag")}
+        total, _, _, _, bd = evaluate_outfit(o, season, body_shape, day["want"], day["heat"], day["humidity"], day["rainy"],
+                                             palettes=pals)
+        _out({"date": day["date"], "score": total, **{k: {"id": r[0], "name": r[1], "color": r[3]} if r else None
+                                                      for k, r in o.items()}})
+        rows.append((p["top"], p["bottom"], p["shoes"], p["bag"],
+                     {"want": day["want"], "heat": day["heat"], "humidity": day["humidity"], "rainy": day["rainy"],
+                      "season": season, "body_shape": body_shape, "ai_breakdown": bd, "plan_date": day["date"]}, total))
+    if a.save: save_coords_batch(rows).result(timeout=60)
+
+def cmd_export(a):
+    init_db(a.db); flush()
+    m = backup.export_archive(a.db, a.archive, progress=_log)
+    _out({t: v["rows"] for t, v in m["tables"].items()} | {"blobs": m["blobs"]})
+
+def cmd_import(a):
+    os.makedirs(os.path.dirname(a.db) or ".", exist_ok=True)
+    init_db(a.db); flush()
+    _out(backup.import_archive(a.archive, a.db, progress=_log))
+
+def cmd_reindex(a):
+    """内容ハッシュ・アイテムの特徴量を埋め直し、--media なら配信用サムネイルも作る"""
+    from .linking import ensure_item_features
+    _open_db(a)
+    out = {"features": 0}
+    while True:
+        n = ensure_item_features(limit=200); out["features"] += n
+        if not n: break
+    hashes = {}
+    for t in ("items", "outfits", "feedback"):
+        with storage.db() as conn:
+            ids = [r[0] for r in conn.execute(f"SELECT id FROM {t} WHERE img IS NOT NULL")]
+        hashes[t] = img_hashes(t, ids); out[t] = len(ids)
+    flush()
+    if a.media:
+        from .media import media_url, media_gc, MEDIA_WIDTHS
+        def blob(t, iid):
+            with storage.db() as conn: return conn.execute(f"SELECT img FROM {t} WHERE id=?", (iid,)).fetchone()[0]
+        n = 0
+        for t, hs in hashes.items():
+            for iid, h in hs.items():
+                for w in MEDIA_WIDTHS[1:3]:   # 一覧(320)と詳細(640)
+                    n += media_url(h, lambda t=t, iid=iid: blob(t, iid), w) is not None
+        out["media"] = n; out["media_removed"] = media_gc()   # どのシャードも使っていない配信ファイル
+    _out(out)
+
+def cmd_reanalyse(a):
+    from . import reanalysis
+    log = None if a.quiet else _log
+    if a.all_shards:
+        stats = reanalysis.reanalyse_all([a.first] if a.first else [], workers=a.workers, duty=a.duty,
+                                         legacy_items=a.legacy_items, progress=log)
+    else:
+        path = _open_db(a)
+        stats = reanalysis.reanalyse(path, workers=a.workers, duty=a.duty, legacy_items=a.legacy_items, progress=log)
+    if not a.quiet: _out({"reanalysed": stats, "skipped": stats is None})
+
+def cmd_loadtest(a):
+    from . import loadtest
+    res = loadtest.run(levels=[int(x) for x in a.levels.split(",")], users=a.users, rounds=a.rounds, items=a.items,
+                       think=a.think, seed=a.seed, out=a.out, workdir=a.workdir, keep=a.keep, progress=_log)
+    _out({"path": res["path"], "levels": [{k: lv[k] for k in ("sessions", "all", "mem_per_session_mb", "errors")}
+                                          for lv in res["levels"]]})
+    return 1 if any(lv["errors"] for lv in res["levels"]) else 0
+
+def cmd_bench(a):
+    from . import bench
+    if a.write_corpus:
+        _out({"written": bench.write_corpus(a.write_corpus), "dir": a.write_corpus}); return 0
+    res = bench.run(corpus=a.corpus, repeat=a.repeat, workers=a.workers, palette=not a.no_palette,
+                    baseline=a.baseline, out=a.out, progress=_log)
+    _out({"path": res["path"], "ok": res["ok"], "throughput": res["throughput"], "core": res["accuracy"]["core"],
+          "failed": [c for c in res["checks"] if not c["ok"]]})
+    return 0 if res["ok"] else 1
+
+def cmd_sync(a):
+    from . import sync
+    if a.schema:
+        print(sync.REMOTE_SCHEMA); return 0
+    if not a.url:
+        print("接続先がありません（--url または OUTFITS_SYNC_URL）", file=sys.stderr); return 2
+    remote = sync.RestRemote(a.url, a.key)
+    paths = storage.shard_paths() if a.all_shards else [_open_db(a)]
+    failed = 0
+    for path in paths:
+        init_db(path)
+        try:
+            _out({"db": path, **sync.Syncer(path, remote).sync()})
+        except Exception as e:
+            failed += 1; _out({"db": path, "error": f"{type(e).__name__}: {e}"})
+    return 1 if failed else 0
+
+def cmd_sync_server(a):
+    from . import syncserver
+    syncserver.serve(a.host, a.port, a.store, a.key)
+
+def _log(t, x):
+    print(f"  {t}: {x}", file=sys.stderr)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m outfits", description="Outf!ts のコマンドライン")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    def with_db(p):
+        p.add_argument("--db", default=LEGACY_DB_PATH, help=f"SQLite ファイル（既定: {LEGACY_DB_PATH}）")
+        p.add_argument("--user", help="ユーザーキー（例: user:me@example.com）。指定時はそのシャードを使う")
+        return p
+    p = sub.add_parser("analyse", help="写真の上下判定と主色"); p.add_argument("images", nargs="+")
+    p.set_defaults(fn=cmd_analyse)
+    p = with_db(sub.add_parser("import-url", help="商品 URL からアイテムを追加")); p.add_argument("urls", nargs="+")
+    p.set_defaults(fn=cmd_import_url)
+    p = with_db(sub.add_parser("generate", help="コーデを生成（--days で複数日プラン）"))
+    p.add_argument("--want", default="指定なし"); p.add_argument("--heat", default="ちょうど")
+    p.add_argument("--humidity", default="普通"); p.add_argument("--rainy", action="store_true")
+    p.add_argument("--days", type=int, default=1); p.add_argument("--start", help="開始日（YYYY-MM-DD、既定は明日）")
+    p.add_argument("--window", type=int, default=3, help="同じトップ/ボトムを空ける日数")
+    p.add_argument("--save", action="store_true", help="保存コーデとして記録する")
+    p.set_defaults(fn=cmd_generate)
+    p = sub.add_parser("export", help="zip へ書き出し"); p.add_argument("db"); p.add_argument("archive")
+    p.set_defaults(fn=cmd_export)
+    p = sub.add_parser("import", help="zip を取り込み"); p.add_argument("archive"); p.add_argument("db")
+    p.set_defaults(fn=cmd_import)
+    p = with_db(sub.add_parser("reindex", help="内容ハッシュ / 特徴量 / 配信サムネイルを作り直す"))
+    p.add_argument("--media", action="store_true"); p.set_defaults(fn=cmd_reindex)
+    p = with_db(sub.add_parser("reanalyse", help="保存済み画像の色を現在のアルゴリズムで解析し直す（再開可能）"))
+    p.add_argument("--all-shards", action="store_true", help="全ユーザーのシャードを順に処理")
+    p.add_argument("--first", help="--all-shards で最初に処理するシャード")
+    p.add_argument("--workers", type=int, help="ワーカープロセス数（既定: CPU 数の半分、最大 2）")
+    p.add_argument("--duty", type=float, default=0.5, help="稼働率 0〜1（既定 0.5）")
+    p.add_argument("--legacy-items", action="store_true", help="由来不明な旧アイテムの色も自動扱いで更新")
+    p.add_argument("--quiet", action="store_true"); p.set_defaults(fn=cmd_reanalyse)
+    p = sub.add_parser("loadtest", help="同時セッション数ごとの再描画レイテンシ / DB 待ち / メモリを計測")
+    p.add_argument("--levels", default="1,2,4,8", help="同時セッション数（カンマ区切り）")
+    p.add_argument("--users", type=int, default=0, help="ユーザー数（0 = セッションごとに別ユーザー）")
+    p.add_argument("--rounds", type=int, default=2, help="1 セッションが操作の流れを繰り返す回数")
+    p.add_argument("--items", type=int, default=4, help="最初に登録するアイテム数")
+    p.add_argument("--think", type=float, default=0.2, help="操作間の平均待ち秒")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", help="結果 JSON（既定: data/loadtest/<時刻>-<rev>.json）")
+    p.add_argument("--workdir", help="作業ディレクトリ（既定: 一時ディレクトリ）")
+    p.add_argument("--keep", action="store_true", help="作業ディレクトリを残す"); p.set_defaults(fn=cmd_loadtest)
+    p = sub.add_parser("bench", help="画像解析の段階別時間 / スループット / 精度（ラベル付きコーパス）")
+    p.add_argument("--corpus", help="labels.json のあるディレクトリ（既定: 合成コーパス）")
+    p.add_argument("--write-corpus", metavar="DIR", help="合成コーパスを書き出して終了")
+    p.add_argument("--repeat", type=int, default=3, help="計測の繰り返し回数（最速を採用）")
+    p.add_argument("--workers", type=int, help="まとめて処理する時のプロセス数（既定: CPU 数の半分）")
+    p.add_argument("--no-palette", action="store_true", help="パレット抽出を含めない")
+    p.add_argument("--baseline", help="比較する過去の結果 JSON")
+    p.add_argument("--out", help="結果 JSON（既定: data/bench/<時刻>-<rev>.json）"); p.set_defaults(fn=cmd_bench)
+    p = with_db(sub.add_parser("sync", help="リモート（Postgres / Supabase）と変更を送受信"))
+    p.add_argument("--all-shards", action="store_true", help="全ユーザーのシャードを順に同期")
+    p.add_argument("--url", default=os.environ.get("OUTFITS_SYNC_URL"), help="接続先（既定: OUTFITS_SYNC_URL）")
+    p.add_argument("--key", default=os.environ.get("OUTFITS_SYNC_KEY"), help="API キー（既定: OUTFITS_SYNC_KEY）")
+    p.add_argument("--schema", action="store_true", help="リモートに作るテーブルの SQL を表示して終了")
+    p.set_defaults(fn=cmd_sync)
+    p = sub.add_parser("sync-server", help="同期の検証用スタンドイン（PostgREST / Storage の一部を SQLite で）")
+    p.add_argument("--host", default="127.0.0.1"); p.add_argument("--port", type=int, default=54321)
+    p.add_argument("--store", default=":memory:", help="保存先 SQLite（既定: メモリ）")
+    p.add_argument("--key", help="要求する API キー（未指定ならチェックしない）"); p.set_defaults(fn=cmd_sync_server)
+    a = ap.parse_args(argv)
+    try:
+        sys.exit(a.fn(a) or 0)
+    finally:
+        storage.pool().close_all()
@@ -0,0 +1,72 @@
+# outfits/colors.py — 色名・HEX/RGB 変換・配色の補助
+import colorsys, re
+import numpy as np
+
+CSS_COLORS = {
+ "Black":"#000000","White":"#ffffff","Gray":"#808080","Silver":"#c0c0c0","DimGray":"#696969",
+ "Navy":"#000080","MidnightBlue":"#191970","RoyalBlue":"#4169e1","Blue":"#0000ff","DodgerBlue":"#1e90ff",
+ "LightBlue":"#add8e6","Teal":"#008080","Aqua":"#00ffff","Turquoise":"#40e0d0",
+ "Green":"#008000","Lime":"#00ff00","Olive":"#808000","ForestGreen":"#228b22","SeaGreen":"#2e8e57",
+ "Yellow":"#ffff00","Gold":"#ffd700","Khaki":"#f0e68c","Beige":"#f5f5dc","Tan":"#d2b48c",
+ "Orange":"#ffa500","Coral":"#ff7f50","Tomato":"#ff6347","Red":"#ff0000","Maroon":"#800000",
+ "Pink":"#ffc0cb","HotPink":"#ff69b4","Magenta":"#ff00ff","Purple":"#800080","Indigo":"#4b0082",
+ "Lavender":"#e6e6fa","Plum":"#dda0dd","Brown":"#a52a2a","Chocolate":"#d2691e","SaddleBrown":"#8b4513"
+}
+JP_COLOR = {"Black":"ブラック","White":"ホワイト","Gray":"グレー","Silver":"シルバー","DimGray":"ダークグレー",
+"Navy":"ネイビー","MidnightBlue":"ミッドナイトブルー","RoyalBlue":"ロイヤルブルー","Blue":"ブルー","DodgerBlue":"ドッジャーブルー",
+"LightBlue":"ライトブルー","Teal":"ティール","Aqua":"アクア","Turquoise":"ターコイズ",
+"Green":"グリーン","Lime":"ライム","Olive":"オリーブ","ForestGreen":"フォレストグリーン","SeaGreen":"シーグリーン",
+"Yellow":"イエロー","Gold":"ゴールド","Khaki":"カーキ","Beige":"ベージュ","Tan":"タン",
+"Orange":"オレンジ","Coral":"コーラル","Tomato":"トマト","Red":"レッド","Maroon":"マルーン",
+"Pink":"ピンク","HotPink":"ホットピンク","Magenta":"マゼンタ","Purple":"パープル","Indigo":"インディゴ",
+"Lavender":"ラベンダー","Plum":"プラム","Brown":"ブラウン","Chocolate":"チョコレート","SaddleBrown":"サドルブラウン"}
+
+def hex_to_rgb(h): h=h.lstrip("#"); return tuple(int(h[i:i+2],16) for i in (0,2,4))
+def rgb_to_hex(rgb): return "#{:02x}{:02x}{:02x}".format(*rgb)
+def hex_luma(h): r,g,b=hex_to_rgb(h); return 0.2126*r+0.7152*g+0.0722*b
+
+def nearest_css_name(hexstr):
+    r,g,b = hex_to_rgb(hexstr); best=None; bd=10**9
+    for name,hx in CSS_COLORS.items():
+        rr,gg,bb = hex_to_rgb(hx); d=(r-rr)**2+(g-gg)**2+(b-bb)**2
+        if d<bd: bd, best=d, name
+    return best
+
+def hex_family(hx):
+    r,g,b=[v/255 for v in hex_to_rgb(hx)]
+    h,s,v=colorsys.rgb_to_hsv(r,g,b); hue=h*360
+    if v<0.15: return "black"
+    if s<0.15 and v>0.9: return "white"
+    if s<0.20: return "gray"
+    if 0<=hue<15: return "red"
+    if 15<=hue<45: return "orange"
+    if 45<=hue<65: return "yellow"
+    if 65<=hue<170: return "green"
+    if 170<=hue<200: return "cyan"
+    if 200<=hue<255: return "blue"
+    if 255<=hue<290: return "purple"
+    if 290<=hue<330: return "magenta"
+    return "red"
+
+def adjust_harmony(hx, mode="complement", delta=30):
+    r,g,b=[v/255 for v in hex_to_rgb(hx)]
+    h,s,v=colorsys.rgb_to_hsv(r,g,b)
+    def wrap(deg): return ((h*360+deg)%360)/360
+    hs = [wrap(180)] if mode=="complement" else ([wrap(+delta),wrap(-delta)] if mode=="analogous" else [wrap(+120),wrap(-120)])
+    outs=[]
+    for hh in hs:
+        rr,gg,bb=colorsys.hsv_to_rgb(hh,s,v); outs.append(rgb_to_hex((int(rr*255),int(gg*255),int(bb*255))))
+    return outs
+
+def rgb_array(hexes) -> np.ndarray:
+    hs = [h if isinstance(h, str) and re.fullmatch(r"#[0-9a-fA-F]{6}", h) else "#2f2f2f" for h in hexes]
+    return np.frombuffer(bytes.fromhex("".join(h[1:] for h in hs)), np.uint8).reshape(-1, 3).astype(np.float32)
+
+def srgb_to_lab(rgb) -> np.ndarray:
+    """sRGB（0〜255, (..., 3)）→ CIELAB（D65）"""
+    c = np.asarray(rgb, np.float64) / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([[0.4124, 0.2126, 0.0193], [0.3576, 0.7152, 0.1192], [0.1805, 0.0722, 0.9505]])
+    xyz = xyz / np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > 216/24389, np.cbrt(xyz), (24389/27 * xyz + 16) / 116)
+    return np.stack([116*f[..., 1] - 16, 500*(f[..., 0] - f[..., 1]), 200*(f[..., 1] - f[..., 2])], axis=-1)
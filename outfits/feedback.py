@@ -0,0 +1,183 @@
+# outfits/feedback.py — お問い合わせの GitHub Issue 送信（outbox + ワーカースレッド）
+#
+# 送信待ちはユーザーのシャードの outbox テーブルにあり、storage.save_feedback が feedback と
+# 同じトランザクションで積む（保存できたお問い合わせは必ず送られる）。ワーカーは watch() された
+# シャードと、起動時に見つけた送信待ちのあるシャードを回り、結果も同じシャードに書き戻す。
+import sqlite3, os, threading, time, random, requests
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from . import storage
+
+GH_API = os.environ.get("OUTFITS_GH_API", "https://api.github.com")
+
+def _retry_after(v) -> float|None:
+    """Retry-After（秒数または HTTP-date）→ 待つ秒数。読めなければ None（通常のバックオフにする）"""
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(v)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if dt.tzinfo is None: dt = dt.replace(tzinfo=timezone.utc)   # "-0000" は UTC 扱い
+    return max(0.0, dt.timestamp() - time.time())
+
+def send_github_issue(repo:str, token:str, title:str, body:str, session=None, api=GH_API, timeout=10):
+    """(ok, info, retry_after)。レート制限時は retry_after に待つべき秒数が入る"""
+    try:
+        headers={"Authorization": f"token {token}", "Accept":"application/vnd.github+json"}
+        url=f"{api}/repos/{repo}/issues"
+        r=(session or requests).post(url, headers=headers, json={"title": title, "body": body}, timeout=timeout)
+        retry_after = None
+        if r.headers.get("Retry-After"):
+            retry_after = _retry_after(r.headers["Retry-After"])
+        elif r.headers.get("X-RateLimit-Remaining") == "0" and r.headers.get("X-RateLimit-Reset"):
+            try: retry_after = max(0.0, float(r.headers["X-RateLimit-Reset"]) - time.time())
+            except ValueError: pass
+        if r.status_code==201:
+            return True, r.json().get("html_url"), retry_after
+        if r.status_code in (403, 429) and retry_after is None and "rate limit" in r.text.lower():
+            retry_after = 60.0
+        return False, f"HTTP {r.status_code}", retry_after
+    except Exception as e:
+        return False, str(e), None
+
+# ---------- outbox（バックグラウンド配送・再試行） ----------
+LEGACY_OUTBOX_PATH = "data/outbox.db"   # 以前の共有 outbox。起動時に各シャードへ移す
+OUTBOX_BATCH = 10
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BASE_DELAY = 5.0      # 秒。失敗ごとに 2 倍（上限 1 時間）+ ジッタ
+OUTBOX_MIN_INTERVAL = 1.0    # Issue 作成の間隔（GitHub の二次レート制限対策）
+OUTBOX_TIMEOUT = 10.0        # 1 リクエストの上限秒（API が遅くても次の行に進む）
+
+class FeedbackOutbox:
+    """フォーム送信はシャードに積むだけで戻り、配送はワーカースレッドが行う。
+
+    行ごとに status（pending/sending/sent/failed）・試行回数・次回試行時刻・結果を記録する。
+    レート制限を受けたらその時刻までワーカー全体を止め、試行回数は数えない。
+    """
+    def __init__(self, repo, token, api=GH_API, timeout=OUTBOX_TIMEOUT, start=True):
+        self.repo = repo; self.token = token; self.api = api; self.timeout = timeout
+        self.session = requests.Session()
+        self._lock = threading.Lock(); self._wake = threading.Event(); self._stop = False; self.paused_until = 0.0
+        self._shards = set()   # ワーカーが見回るシャード（ワーカースレッドだけが触る）
+        self._new = set()      # watch() されたシャード（次の 1 回で _shards に入れる）
+        self._scanned = False
+        self._thread = threading.Thread(target=self._run, name="feedback-outbox", daemon=True)
+        if start: self._thread.start()
+
+    def watch(self, shard):
+        """shard に送信待ちが積まれた（コミット後に呼ぶ）"""
+        with self._lock: self._new.add(shard)
+        self._wake.set()
+
+    def status(self, shard, feedback_ids) -> dict:
+        ids = [int(i) for i in feedback_ids]
+        if not ids: return {}
+        with storage.pool().connect(shard) as conn:
+            rows = conn.execute(f"""SELECT feedback_id,status,attempts,last_error,result FROM outbox
+                                    WHERE feedback_id IN ({','.join('?'*len(ids))})""", ids).fetchall()
+        return {r[0]: {"status": r[1], "attempts": r[2], "error": r[3], "url": r[4]} for r in rows}
+
+    def close(self):
+        self._stop = True; self._wake.set()
+        if self._thread.is_alive(): self._thread.join(5)
+
+    def _write(self, shard, stmts):
+        storage.pool().writer(shard).submit(stmts, durable=False).result(60)
+
+    def _scan(self):
+        """起動時：前回の途中終了分（sending）を戻し、送信待ちのあるシャードを見回りに加える"""
+        self._migrate_legacy()
+        for shard in storage.shard_paths():
+            try:
+                conn = sqlite3.connect(f"file:{os.path.abspath(shard)}?mode=ro", uri=True, timeout=5)
+                try: st_ = {r[0] for r in conn.execute("SELECT DISTINCT status FROM outbox WHERE status IN ('pending','sending')")}
+                finally: conn.close()
+            except sqlite3.Error:
+                continue   # outbox のない古いシャード
+            if "sending" in st_: self._write(shard, [("UPDATE outbox SET status='pending' WHERE status='sending'", ())])
+            if st_: self._shards.add(shard)
+
+    def _migrate_legacy(self):
+        if not os.path.exists(LEGACY_OUTBOX_PATH): return
+        conn = sqlite3.connect(LEGACY_OUTBOX_PATH, timeout=30)
+        try:
+            rows = conn.execute("""SELECT shard,created_at,feedback_id,title,body,status,attempts,next_at,last_error,result
+                                   FROM outbox ORDER BY id""").fetchall()
+        except sqlite3.Error:
+            rows = []
+        finally:
+            conn.close()
+        by_shard = {}
+        for r in rows: by_shard.setdefault(r[0], []).append(r[1:])
+        for shard, rs in by_shard.items():
+            if not os.path.exists(shard): continue
+            self._write(shard, [("""INSERT INTO outbox(created_at,feedback_id,title,body,status,attempts,next_at,last_error,result)
+                                    VALUES(?,?,?,?,CASE WHEN ?='sending' THEN 'pending' ELSE ? END,?,?,?,?)""",
+                                 (r[0], r[1], r[2], r[3], r[4], r[4], *r[5:])) for r in rs])
+        os.replace(LEGACY_OUTBOX_PATH, LEGACY_OUTBOX_PATH + ".migrated")
+
+    def _claim(self, shard):
+        with storage.pool().connect(shard) as conn:
+            rows = conn.execute("""SELECT id,title,body,attempts FROM outbox
+                                   WHERE status='pending' AND next_at<=? ORDER BY next_at LIMIT ?""",
+                                (time.time(), OUTBOX_BATCH)).fetchall()
+        if rows:
+            self._write(shard, [(f"UPDATE outbox SET status='sending' WHERE id IN ({','.join('?'*len(rows))})", [r[0] for r in rows])])
+        return rows
+
+    def _next_due(self, shard):
+        with storage.pool().connect(shard) as conn:
+            return conn.execute("SELECT MIN(next_at) FROM outbox WHERE status='pending'").fetchone()[0]
+
+    def _deliver(self, shard, batch):
+        for n, (oid, title, body, attempts) in enumerate(batch):
+            ok, info, retry_after = send_github_issue(self.repo, self.token, title, body, session=self.session,
+                                                      api=self.api, timeout=self.timeout)
+            now = time.time()
+            if ok:
+                stmts = [("UPDATE outbox SET status='sent',attempts=?,result=?,last_error=NULL WHERE id=?", (attempts+1, info, oid))]
+            elif retry_after is not None:   # レート制限：試行回数は増やさず待つ
+                stmts = [("UPDATE outbox SET status='pending',next_at=?,last_error=? WHERE id=?", (now + retry_after, info, oid))]
+            else:
+                attempts += 1
+                delay = min(OUTBOX_BASE_DELAY * 2**attempts, 3600) * random.uniform(0.8, 1.2)
+                st_ = "failed" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending"
+                stmts = [("UPDATE outbox SET status=?,attempts=?,next_at=?,last_error=? WHERE id=?", (st_, attempts, now + delay, info, oid))]
+            if retry_after is not None and not ok:
+                self.paused_until = now + retry_after
+                rest = [b[0] for b in batch[n+1:]]
+                if rest: stmts.append((f"UPDATE outbox SET status='pending' WHERE id IN ({','.join('?'*len(rest))})", rest))
+                self._write(shard, stmts)
+                return
+            self._write(shard, stmts)
+            time.sleep(OUTBOX_MIN_INTERVAL)
+
+    def _step(self):
+        """1 回分の配送。次に起きるまでの秒を返す（None = 次の watch() まで待つ）"""
+        if not self._scanned:
+            self._scanned = True; self._scan()
+        wait = self.paused_until - time.time()
+        if wait > 0: return wait
+        with self._lock:
+            self._shards |= self._new; self._new = set()
+        due = []
+        for shard in sorted(self._shards):
+            batch = self._claim(shard)
+            if batch:
+                self._deliver(shard, batch); return 0.0
+            nxt = self._next_due(shard)
+            if nxt is None: self._shards.discard(shard)   # 送るものがなくなったシャードは見回らない
+            else: due.append(nxt)
+        return max(0.0, min(due) - time.time()) if due else None
+
+    def _run(self):
+        while not self._stop:
+            self._wake.clear()   # 確認の前に下ろす（確認中の watch() は次の wait で拾う）
+            try:
+                wait = self._step()
+            except Exception:
+                wait = OUTBOX_BASE_DELAY   # DB の一時的なエラーなど。少し待ってやり直す
+            if wait is None or wait > 0: self._wake.wait(wait)
@@ -0,0 +1,294 @@
+# outfits/imaging.py — 写真の色解析・上下判定・ヒストグラム・コンタクトシート
+import io, colorsys, time
+import numpy as np
+from PIL import Image, ImageOps, ImageDraw, ExifTags
+from .colors import rgb_to_hex, srgb_to_lab
+
+# main_color_from_region / _foreground_mask / classify_top_or_bottom の結果が変わる修正をしたら上げる。
+# 保存済みの自動色は reanalysis が新しいバージョンで解析し直す。
+# 2: 縮小デコード + EXIF の向きを反映した画像で解析
+ANALYSIS_VERSION = 2
+ANALYSIS_SIDE = 640   # 解析とプレビューで共有する縮小画像の長辺
+
+# ---- 段階別の所要時間（outfits.bench が stage_timer を差し込んだ時だけ計る） ----
+stage_timer = None   # callable(段階名, 秒)
+
+def _tick() -> float:
+    return time.perf_counter() if stage_timer else 0.0
+
+def _lap(stage, t0) -> float:
+    """t0 からの経過を stage に足し、次の区間の開始時刻を返す"""
+    if not stage_timer: return 0.0
+    t = time.perf_counter(); stage_timer(stage, t - t0)
+    return t
+
+_ORIENT = {2: Image.Transpose.FLIP_LEFT_RIGHT, 3: Image.Transpose.ROTATE_180, 4: Image.Transpose.FLIP_TOP_BOTTOM,
+           5: Image.Transpose.TRANSPOSE, 6: Image.Transpose.ROTATE_270, 7: Image.Transpose.TRANSVERSE,
+           8: Image.Transpose.ROTATE_90}   # EXIF Orientation → transpose（ImageOps.exif_transpose と同じ対応）
+
+# ---- 縮小デコード（JPEG は DCT スケーリング、それ以外は reduce） ----
+def decode_small(src, max_side=ANALYSIS_SIDE) -> Image.Image:
+    """bytes / パス / ファイルから、長辺 max_side 程度の RGB 画像を作る（EXIF の向きを反映）。
+
+    JPEG は draft() でデコーダに 1/2〜1/8 の縮小を指示するので、原寸の画素を展開しない。
+    PNG/WebP などは原寸で読んだ直後に reduce() で整数分の 1 にしてから後段へ渡す。
+    向きは縮小した後に直す（原寸のまま回転すると原寸のコピーがもう 1 枚できる）。
+    """
+    t = _tick()
+    im = Image.open(io.BytesIO(src) if isinstance(src, (bytes, bytearray, memoryview)) else src)
+    if im.format == "JPEG":
+        im.draft("RGB", (max_side, max_side))
+    orient = _ORIENT.get(im.getexif().get(ExifTags.Base.Orientation))
+    f = max(im.size) // max_side
+    if f >= 2:
+        if im.mode not in ("RGB", "RGBA", "L", "LA"): im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+        im = im.reduce(f)
+    im = im.convert("RGB")
+    if max(im.size) > max_side: im.thumbnail((max_side, max_side))
+    if orient is not None: im = im.transpose(orient)
+    _lap("decode", t)
+    return im
+
+def hsv_from_rgb(arrf):
+    r,g,b = arrf[...,0],arrf[...,1],arrf[...,2]
+    mx = np.max(arrf,axis=2); mn = np.min(arrf,axis=2); diff = mx-mn
+    h = np.zeros_like(mx)
+    mask = diff!=0
+    r2 = ((mx==r) & mask); g2 = ((mx==g) & mask); b2 = ((mx==b) & mask)
+    h[r2] = (60*((g-b)/diff)%360)[r2]
+    h[g2] = (60*((b-r)/diff)+120)[g2]
+    h[b2] = (60*((r-g)/diff)+240)[b2]
+    s = np.where(mx==0, 0, diff/mx); v = mx
+    return h, s, v
+
+def _clothing_mask(arrf):
+    cmax = np.max(arrf, axis=2); cmin = np.min(arrf, axis=2)
+    sat  = (cmax - cmin); val = cmax
+    return ((sat > 0.12) | (val < 0.75)) & (val < 0.98)
+
+def _skin_score(arrf):
+    H,S,V = hsv_from_rgb(arrf)
+    mask = ((H<=50) | (H>=330)) & (S>=0.15) & (S<=0.68) & (V>=0.20) & (V<=0.95)
+    return float(mask.mean())
+
+# ---- 前景マスク（彩度/暗度×サリエンシー×中心重み）と重み付中央値 ----
+def _weighted_quantile(values, weights, q=0.5):
+    if len(values) == 0: return 0.0
+    sorter = np.argsort(values)
+    v = values[sorter]; w = weights[sorter]
+    cw = np.cumsum(w); cutoff = q * cw[-1]
+    idx = np.searchsorted(cw, cutoff)
+    return float(v[min(idx, len(v)-1)])
+
+def _foreground_mask(arrf):
+    t = _tick()
+    cloth = _clothing_mask(arrf)
+    mean = arrf.reshape(-1,3).mean(axis=0)
+    sal = np.sqrt(((arrf-mean)**2).sum(axis=2))
+    if sal.max()>1e-6: sal = sal/sal.max()
+    h, w = arrf.shape[:2]
+    yy, xx = np.mgrid[0:h, 0:w]
+    cx, cy = w/2, h/2
+    sigma = max(h, w) / 3.5
+    center = np.exp(-(((xx-cx)**2 + (yy-cy)**2)/(2*sigma*sigma)))
+    t = _lap("mask", t)
+    H,S,V = hsv_from_rgb(arrf)
+    t = _lap("hsv", t)
+    dark_neutral = (S < 0.25) & (V < 0.35)
+    m = (cloth & (sal > 0.15)) | (cloth & (center > 0.30)) | dark_neutral
+    weights = np.clip(0.6*sal + 0.4*center, 0.0, 1.0)
+    _lap("mask", t)
+    return m, weights
+
+# ---- 主色抽出（領域別・精密版 / 黒や白の中立色スナップ） ----
+def main_color_from_region(img: Image.Image, region: str) -> str:
+    t = _tick()
+    w, h = img.size
+    crop = img.crop((0, 0, w, h//2)) if region == "upper" else img.crop((0, h//2, w, h))
+    small = crop.copy(); small.thumbnail((256, 256))
+    arr = np.asarray(small).astype(np.float32) / 255.0
+    _lap("resize", t)
+
+    mask, wts = _foreground_mask(arr)
+    t = _tick()
+    if mask.sum() < 50:
+        arr = np.asarray(small).astype(np.float32) / 255.0
+        mask = np.ones(arr.shape[:2], bool)
+        wts = np.ones(arr.shape[:2], np.float32)
+
+    sel = arr[mask]; wsel = wts[mask]
+    if len(sel) == 0:
+        sel = arr.reshape(-1,3); wsel = np.ones(len(sel), np.float32)
+
+    R = _weighted_quantile(sel[:,0], wsel, 0.5)
+    G = _weighted_quantile(sel[:,1], wsel, 0.5)
+    B = _weighted_quantile(sel[:,2], wsel, 0.5)
+    r,g,b = float(R), float(G), float(B)
+
+    h_, s_, v_ = colorsys.rgb_to_hsv(r, g, b)
+    if s_ < 0.10:
+        if v_ < 0.18: r=g=b=0.07
+        elif v_ < 0.35: r=g=b=0.16
+        elif v_ > 0.92: r=g=b=0.97
+        else: r=g=b=v_
+
+    _lap("quantile", t)
+    return rgb_to_hex((int(r*255), int(g*255), int(b*255)))
+
+# --- 上/下判定（重心×面積×靴エッジ×デニム×肌色帯） ---
+def classify_top_or_bottom(img: Image.Image) -> str:
+    t = _tick()
+    arr = np.asarray(img.resize((224, 224))).astype(np.float32)/255.0
+    t = _lap("resize", t)
+    H,S,V = hsv_from_rgb(arr)
+    _lap("hsv", t)
+    mask, salw = _foreground_mask(arr)
+    t = _tick()
+
+    row_w = (mask*salw).mean(axis=1)
+    if row_w.sum() == 0:
+        _lap("votes", t); return "トップス"
+    centroid = float(np.average(np.arange(row_w.size), weights=row_w) / row_w.size)
+    vote_top = 0; vote_bot = 0
+    if centroid > 0.56: vote_bot += 2
+    elif centroid < 0.46: vote_top += 2
+
+    mid = arr.shape[0]//2
+    up_m, lo_m = mask[:mid,:].mean(), mask[mid:,:].mean()
+    if lo_m >= up_m*1.10: vote_bot += 1
+    elif up_m >= lo_m*1.05: vote_top += 1
+
+    edge = np.abs(np.diff(arr, axis=1, prepend=arr[:,:1,:])).mean(axis=2)
+    edge_row = edge.mean(axis=1)
+    peak = np.argmax(edge_row)/edge_row.size
+    if 0.55 <= peak <= 0.95: vote_bot += 1
+    if 0.15 <= peak <= 0.45: vote_top += 1
+
+    bh = int(0.18*edge.shape[0])
+    bottom = arr[-bh:,:,:]
+    ebot = edge[-bh:,:]
+    contrast = (np.max(bottom, axis=2) - np.min(bottom, axis=2))
+    shoe_score = float(((contrast > 0.35) & (ebot > 0.10)).mean())
+    if shoe_score > 0.07: vote_bot += 2
+
+    lowerH, lowerS, lowerV = H[mid:,:], S[mid:,:], V[mid:,:]
+    denim_like = (((lowerH >= 195) & (lowerH <= 260)) | (lowerS < 0.20)) & (lowerV < 0.55)
+    if float(denim_like.mean()) > 0.08: vote_bot += 1
+
+    up_band = arr[:int(0.28*arr.shape[0]),:,:]
+    if _skin_score(up_band) > 0.03: vote_top += 1
+
+    _lap("votes", t)
+    return "ボトムス" if vote_bot >= vote_top else "トップス"
+
+# ---- 配色パレット（前景画素のミニバッチ k-means、Lab 空間） ----
+PALETTE_K = 5
+PALETTE_SAMPLES = 2048     # 前景画素からこの数だけ抜き出してクラスタリング
+PALETTE_BATCH = 256
+PALETTE_ITERS = 40         # ミニバッチ更新の回数の上限（時間では打ち切らない：負荷で結果が変わらないように）
+PALETTE_TOL = 0.5          # 中心の移動がすべてこれ（ΔE）未満になったら収束とみなして止める
+PALETTE_MIN_SHARE = 0.04
+PALETTE_MERGE_DE = 10.0    # これより近い色は 1 色にまとめる
+PALETTE_SEED = 0
+
+def extract_palette(img: Image.Image, region: str|None=None, k=PALETTE_K, seed=PALETTE_SEED) -> list:
+    """領域の主要色を [(hex, 面積比), ...]（面積比の大きい順、合計 1）で返す。
+
+    乱数は seed 固定、更新回数も回数と収束だけで決まるので、同じ画像からは負荷によらず同じパレットになる。
+    """
+    t = _tick()
+    w, h = img.size
+    crop = img if region is None else (img.crop((0, 0, w, h//2)) if region == "upper" else img.crop((0, h//2, w, h)))
+    small = crop.copy(); small.thumbnail((128, 128))
+    arr = np.asarray(small).astype(np.float32) / 255.0
+    _lap("resize", t)
+    mask, wts = _foreground_mask(arr)
+    t = _tick()
+    if mask.sum() < 50: mask = np.ones(arr.shape[:2], bool); wts = np.ones(arr.shape[:2], np.float32)
+    rgb = arr[mask] * 255.0; wsel = np.maximum(wts[mask], 1e-3).astype(np.float64)
+    rng = np.random.default_rng(seed)
+    if len(rgb) > PALETTE_SAMPLES:
+        pick = rng.choice(len(rgb), PALETTE_SAMPLES, replace=False)
+        rgb, wsel = rgb[pick], wsel[pick]
+    lab = srgb_to_lab(rgb)
+    k = max(1, min(k, len(lab)))
+
+    # k-means++ で初期中心
+    cen = [lab[rng.choice(len(lab), p=wsel / wsel.sum())]]
+    d2 = ((lab - cen[0])**2).sum(1)
+    for _ in range(1, k):
+        p = d2 * wsel
+        if p.sum() <= 0: break
+        cen.append(lab[rng.choice(len(lab), p=p / p.sum())])
+        d2 = np.minimum(d2, ((lab - cen[-1])**2).sum(1))
+    cen = np.array(cen); cnt = np.zeros(len(cen))
+
+    # ミニバッチ更新（中心ごとの学習率 1/件数）
+    for _ in range(PALETTE_ITERS):
+        b = rng.choice(len(lab), min(PALETTE_BATCH, len(lab)), replace=False)
+        near = ((lab[b, None, :] - cen[None])**2).sum(2).argmin(1)
+        prev = cen.copy()
+        for j in np.unique(near):
+            sel = b[near == j]; ws = wsel[sel]
+            cnt[j] += ws.sum()
+            cen[j] += (ws.sum() / cnt[j]) * (np.average(lab[sel], axis=0, weights=ws) - cen[j])
+        if np.abs(cen - prev).max() < PALETTE_TOL: break
+
+    # 全サンプルを割り当て、面積比と RGB の平均色を出す
+    near = ((lab[:, None, :] - cen[None])**2).sum(2).argmin(1)
+    share = np.bincount(near, weights=wsel, minlength=len(cen)); share = share / share.sum()
+    mean = np.stack([np.bincount(near, weights=wsel*rgb[:, c], minlength=len(cen)) for c in range(3)], 1)
+    mean = mean / np.maximum(np.bincount(near, weights=wsel, minlength=len(cen)), 1e-9)[:, None]
+    out = []   # [(lab, rgb, share)]
+    for j in np.argsort(-share):
+        if share[j] <= 0: continue
+        m = next((o for o in out if np.linalg.norm(o[0] - cen[j]) < PALETTE_MERGE_DE), None)
+        if m is not None: m[2] += share[j]; continue
+        out.append([cen[j], mean[j], share[j]])
+    out = [o for o in out if o[2] >= PALETTE_MIN_SHARE] or out[:1]
+    total = sum(o[2] for o in out)
+    out = sorted([(rgb_to_hex(tuple(int(round(v)) for v in np.clip(o[1], 0, 255))), round(float(o[2] / total), 3))
+                  for o in out], key=lambda x: -x[1])
+    _lap("palette", t)
+    return out
+
+# ---------- コンタクトシート（グリッドを画像 1 枚 + 選択 1 つにまとめる） ----------
+SHEET_CELL = 160
+SHEET_PAGE = 30
+
+def _sheet_thumb(img_bytes, px):
+    try:
+        return ImageOps.fit(decode_small(img_bytes, px*2), (px, px))
+    except Exception:
+        return None
+
+def contact_sheet(imgs, cols, px=SHEET_CELL, labels=None, dim=None) -> bytes:
+    """サムネイルを cols 列のスプライトに合成して JPEG で返す（labels は ASCII のみ）"""
+    rows = max(1, -(-len(imgs)//cols))
+    sheet = Image.new("RGB", (cols*px, rows*px), (244,242,238))
+    draw = ImageDraw.Draw(sheet)
+    for i, b in enumerate(imgs):
+        x, y = (i % cols)*px, (i // cols)*px
+        t = _sheet_thumb(b, px) if b else None
+        if t is not None:
+            if dim and dim[i]: t = Image.blend(t, Image.new("RGB", t.size, (244,242,238)), 0.55)
+            sheet.paste(t, (x, y))
+        draw.rectangle([x, y, x+px-1, y+px-1], outline=(225,225,225))
+        if labels and labels[i]:
+            draw.rectangle([x+3, y+3, x+9+7*len(labels[i]), y+17], fill=(255,255,255))
+            draw.text((x+6, y+4), labels[i], fill=(150,150,150) if dim and dim[i] else (34,34,34))
+    buf = io.BytesIO(); sheet.save(buf, "JPEG", quality=80, optimize=True, progressive=True)
+    return buf.getvalue()
+
+# ---- 前景色ヒストグラム（記録写真とアイテムの照合用） ----
+def region_hist(img: Image.Image, region: str|None=None) -> np.ndarray:
+    """前景画素の 4×4×4 色ヒストグラム（合計 1）"""
+    w, h = img.size
+    crop = img if region is None else (img.crop((0, 0, w, h//2)) if region == "upper" else img.crop((0, h//2, w, h)))
+    small = crop.copy(); small.thumbnail((96, 96))
+    arr = np.asarray(small).astype(np.float32) / 255.0
+    mask, wts = _foreground_mask(arr)
+    if mask.sum() < 20: mask = np.ones(arr.shape[:2], bool); wts = np.ones(arr.shape[:2], np.float32)
+    q = np.minimum((arr[mask] * 4).astype(int), 3)
+    hist = np.bincount(q[:, 0]*16 + q[:, 1]*4 + q[:, 2], weights=wts[mask], minlength=64)
+    return (hist / max(hist.sum(), 1e-9)).astype(np.float32)
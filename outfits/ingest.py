@@ -0,0 +1,99 @@
+# outfits/ingest.py — 商品ページ URL からの取り込み（タイトル/画像/説明 → カテゴリ・素材・季節の推定）
+import re, json, requests, html as ihtml
+from urllib.parse import urljoin
+from .imaging import main_color_from_region, decode_small
+
+UA = {"User-Agent":"Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1","Accept-Language":"ja,en;q=0.8"}
+def _decode_best(r):
+    b = r.content; cands=[]
+    if getattr(r, "encoding", None): cands.append(r.encoding)
+    if getattr(r, "apparent_encoding", None): cands.append(r.apparent_encoding)
+    cands += ["utf-8","cp932","shift_jis","euc-jp"]
+    for enc in cands:
+        try:
+            s = b.decode(enc)
+            if "Ã" in s or "Â" in s:
+                try:
+                    s2 = s.encode("latin-1","ignore").decode("utf-8","ignore")
+                    if len(s2.replace("�","")) > len(s.replace("�","")): s = s2
+                except: pass
+            return s
+        except: continue
+    return b.decode("utf-8", errors="ignore")
+def _meta(content, name):
+    m=re.search(rf'<meta[^>]+(?:property|name)=["\']{re.escape(name)}["\'][^>]+content=["\']([^"\']+)["\']', content, re.I)
+    return ihtml.unescape(m.group(1)) if m else None
+def _jsonld_image(content):
+    for m in re.finditer(r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', content, re.I|re.S):
+        try:
+            data=json.loads(m.group(1))
+            if isinstance(data, list):
+                for d in data:
+                    if isinstance(d, dict) and d.get("image"):
+                        img=d["image"]; return img[0] if isinstance(img, list) else img
+            elif isinstance(data, dict) and data.get("image"):
+                img=data["image"]; return img[0] if isinstance(img, list) else img
+        except: pass
+    return None
+def fetch_from_page(url:str):
+    try:
+        r=requests.get(url, timeout=10, headers=UA)
+        if r.status_code!=200: return None,None,None
+        html=_decode_best(r)
+        title = _meta(html,"og:title") or _meta(html,"twitter:title")
+        if not title:
+            t2=re.search(r'<title[^>]*>(.*?)</title>', html, re.I|re.S)
+            title=ihtml.unescape(t2.group(1).strip()) if t2 else None
+        desc  = _meta(html,"og:description") or _meta(html,"description")
+        img_url = _meta(html,"og:image:secure_url") or _meta(html,"og:image") or _meta(html,"twitter:image")
+        if not img_url: img_url = _jsonld_image(html)
+        if img_url: img_url=urljoin(url, img_url)
+        img_bytes=None
+        if img_url:
+            try:
+                r2=requests.get(img_url, timeout=10, headers=UA)
+                if r2.status_code==200: img_bytes=r2.content
+            except: pass
+        return title, img_bytes, desc
+    except:
+        return None, None, None
+
+# ---- テキスト→推定（カテゴリ/素材/季節） ----
+CAT_MAP = {
+    "トップス":["tシャツ","tee","シャツ","ブラウス","スウェット","パーカー","ニット","セーター","カーディガン","トップス","pullover","hoodie","sweat","blouse"],
+    "ボトムス":["パンツ","デニム","ジーンズ","スラックス","トラウザー","スカート","ショーツ","ハーフパンツ","shorts","trousers","skirt","jeans"],
+    "アウター":["コート","ジャケット","ブルゾン","ダウン","アウター","マウンテン","ライダース","gジャン","jacket","coat"],
+    "ワンピース":["ワンピース","ドレス","ジャンパースカート","one-piece","dress"],
+    "シューズ":["スニーカー","ブーツ","パンプス","サンダル","shoes","sneaker","boots","heels"],
+    "バッグ":["バッグ","トート","ショルダー","バックパック","リュック","bag","tote","shoulder","backpack"],
+    "アクセ":["帽子","キャップ","ハット","ベルト","マフラー","ストール","アクセ","ネックレス","ピアス","cap","hat","scarf","belt","accessory"]
+}
+MAT_KEYS = ["コットン","綿","ウール","ナイロン","ポリエステル","リネン","麻","デニム","レザー","合皮","カシミヤ","シルク","ダウン","フリース"]
+def guess_category_from_text(text:str)->str:
+    t=(text or "").lower()
+    for cat, kws in CAT_MAP.items():
+        if any(k.lower() in t for k in kws): return cat
+    return "トップス"
+def guess_material_from_text(text:str)->str|None:
+    t=text or ""
+    for k in MAT_KEYS:
+        if k in t: return k
+    return None
+def guess_season_from_text(text:str)->str|None:
+    t=(text or "").lower()
+    if any(k in t for k in ["春夏","ss","summer","春/夏"]): return "summer"
+    if any(k in t for k in ["秋冬","fw","winter","秋/冬"]): return "winter"
+    return None
+
+def item_from_url(url:str):
+    """URL から add_item に渡す値を推定する（取得できなければ None）"""
+    title, img_bytes, desc = fetch_from_page(url)
+    if not title and not img_bytes: return None
+    text = (title or "") + " " + (desc or "")
+    color = "#2f2f2f"
+    if img_bytes:
+        try: color = main_color_from_region(decode_small(img_bytes), "upper")
+        except Exception: pass
+    return {"name": title or "Unnamed", "category": guess_category_from_text(text), "color_hex": color,
+            "season_pref": guess_season_from_text(text), "material": guess_material_from_text(text) or "",
+            "img_bytes": img_bytes, "notes": url, "color_src": "auto" if img_bytes else None}
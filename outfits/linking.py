@@ -0,0 +1,71 @@
+# outfits/linking.py — 記録写真 → クローゼットのアイテム紐付け
+import hashlib, threading
+import numpy as np
+from .colors import rgb_array, srgb_to_lab
+from .imaging import region_hist, decode_small
+from .storage import db, write, pool, content_hash, use_db
+
+# 領域の主色（Lab の ΔE）と前景色ヒストグラム（4×4×4）の交差で近いアイテムを探す。
+# アイテム側のヒストグラムは item_features に画像ハッシュ付きで保存し、画像が変わった時だけ作り直す。
+LINK_CATS = {"upper": ["トップス","アウター","ワンピース"], "lower": ["ボトムス","ワンピース"]}
+LINK_HIST_W = 40.0   # ヒストグラム非類似度(0〜1)を ΔE 相当に換算
+LINK_AUTO_DIST = 25.0
+LINK_FEATURES_PER_RUN = 8     # 再描画の中で作るのはこの件数まで（残りは backfill_item_features）
+LINK_BACKFILL_BATCH = 50
+
+def ensure_item_features(limit=200):
+    """未計算/画像変更済みアイテムのヒストグラムを作って保存（件数を返す）"""
+    with db() as conn:
+        todo = conn.execute("""SELECT i.id, i.img_hash FROM items i LEFT JOIN item_features f ON f.item_id = i.id
+                               WHERE i.img IS NOT NULL AND (f.item_id IS NULL OR f.img_hash IS NOT i.img_hash)
+                               LIMIT ?""", (int(limit),)).fetchall()
+        stmts = []
+        for iid, h in todo:
+            b = conn.execute("SELECT img FROM items WHERE id=?", (iid,)).fetchone()[0]
+            try:
+                hist = region_hist(decode_small(b, 256))
+            except Exception:
+                hist = np.zeros(64, np.float32)
+            stmts.append(("INSERT OR REPLACE INTO item_features(item_id,img_hash,hist) VALUES(?,?,?)",
+                          (iid, h or content_hash(b), hist.tobytes())))
+    if stmts: write(stmts, durable=False).result(timeout=60)
+    return len(stmts)
+
+def backfill_item_features(db_path, batch=LINK_BACKFILL_BATCH):
+    """残りのヒストグラムをバックグラウンドスレッドで作る（画像のデコードで再描画を待たせない）"""
+    def run():
+        use_db(db_path)
+        try:
+            while ensure_item_features(limit=batch): pass
+        except Exception:
+            pass   # 途中で失敗しても次の再描画が少しずつ埋める
+    t = threading.Thread(target=run, name="item-features", daemon=True)
+    t.start()
+    return t
+
+def item_index_signature():
+    # 色/カテゴリの編集も拾えるよう、全アイテムの (id, 色, カテゴリ) を要約する
+    with db() as conn:
+        n, feats, cat = conn.execute("""SELECT (SELECT COUNT(*) FROM items), (SELECT COUNT(*) FROM item_features),
+                                               (SELECT group_concat(id || color_hex || category, ',') FROM items)""").fetchone()
+    return n, feats, hashlib.md5((cat or "").encode("utf-8")).hexdigest()
+
+def item_index(db_path) -> dict:
+    with pool().connect(db_path) as conn:
+        rows = conn.execute("""SELECT i.id, i.name, i.category, i.color_hex, f.hist
+                               FROM items i LEFT JOIN item_features f ON f.item_id = i.id""").fetchall()
+    hist = np.stack([np.frombuffer(r[4], np.float32) if r[4] else np.full(64, 1/64, np.float32) for r in rows]) \
+           if rows else np.zeros((0, 64), np.float32)
+    return {"ids": np.array([r[0] for r in rows], int), "names": [r[1] for r in rows],
+            "cats": np.array([r[2] or "" for r in rows], object),
+            "lab": srgb_to_lab(rgb_array([r[3] for r in rows])) if rows else np.zeros((0, 3)), "hist": hist}
+
+def match_items(index, region, region_hex, hist, k=3):
+    """[(item_id, name, dist)] を近い順に最大 k 件"""
+    if not len(index["ids"]): return []
+    ok = np.isin(index["cats"], LINK_CATS[region])
+    if not ok.any(): return []
+    de = np.linalg.norm(index["lab"][ok] - srgb_to_lab(rgb_array([region_hex]))[0], axis=1)
+    dist = de + LINK_HIST_W * (1.0 - np.minimum(index["hist"][ok], hist[None, :]).sum(1))
+    idx = np.flatnonzero(ok); order = np.argsort(dist)[:k]
+    return [(int(index["ids"][idx[j]]), index["names"][idx[j]], float(dist[j])) for j in order]
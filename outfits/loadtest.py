@@ -0,0 +1,226 @@
+# outfits/loadtest.py — 同時セッション数ごとの再描画レイテンシ計測（負荷試験）
+#
+# streamlit.testing.v1.AppTest で app.py を N セッション同時に動かし、実際の操作の流れ
+# （アイテム追加 → 写真で記録 → カレンダー → クローゼット検索/編集 → AI コーデ生成/保存）を
+# 繰り返す。1 操作 = 1 再実行として、同時数ごとに p50/p95/p99、DB のロック待ち
+# （storage.wait_stats）、セッションあたりのメモリを JSON に書き出す。
+#
+#   python -m outfits loadtest --levels 1,2,4,8 --rounds 3
+#   python -m outfits loadtest --levels 8 --users 1     # 全セッションが同じシャードを使う
+#
+# データは一時作業ディレクトリに作るので既存の data/ には触れない。
+# このモジュールだけは Streamlit と Pillow を使う（呼び出し時に読み込む）。
+import os, sys, io, gc, json, math, time, random, shutil, tempfile, threading, subprocess, platform
+from datetime import datetime
+from . import storage, media
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+LOADTEST_DIR = "data/loadtest"
+RERUN_TIMEOUT = 120
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f: pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource   # Linux 以外：最大 RSS（KB / macOS は byte）で代用
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return r / 2**20 if sys.platform == "darwin" else r / 2**10
+
+def percentile(xs, p):
+    if not xs: return None
+    xs = sorted(xs)
+    return xs[min(len(xs)-1, max(0, math.ceil(p / 100 * len(xs)) - 1))]   # nearest-rank
+
+def _summary(xs) -> dict:
+    ms = lambda v: None if v is None else round(v * 1000, 1)
+    return {"n": len(xs), "p50_ms": ms(percentile(xs, 50)), "p95_ms": ms(percentile(xs, 95)), "p99_ms": ms(percentile(xs, 99)),
+            "max_ms": ms(max(xs) if xs else None)}
+
+def synthetic_photo(rng, w=480, h=640) -> bytes:
+    """上下 2 色の服っぽい JPEG（毎回中身が変わるので内容ハッシュも変わる）"""
+    from PIL import Image, ImageDraw
+    im = Image.new("RGB", (w, h), tuple(rng.randint(215, 245) for _ in range(3)))
+    dr = ImageDraw.Draw(im)
+    top, bottom = [tuple(rng.randint(20, 230) for _ in range(3)) for _ in range(2)]
+    dr.ellipse((w*0.4, h*0.02, w*0.6, h*0.14), fill=(224, 188, 160))
+    dr.rectangle((w*0.25, h*0.15, w*0.75, h*0.5), fill=top)
+    dr.rectangle((w*0.3, h*0.5, w*0.7, h*0.95), fill=bottom)
+    x, y = rng.randint(0, w-20), rng.randint(0, h-20)
+    dr.rectangle((x, y, x+12, y+12), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    buf = io.BytesIO(); im.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+# ---------- 1 セッションの操作 ----------
+class Session:
+    """AppTest 1 つ = ブラウザのタブ 1 つ。step() ごとに所要時間を記録する"""
+    def __init__(self, sid, user_token, rng, think):
+        from streamlit.testing.v1 import AppTest
+        self.sid = sid; self.rng = rng; self.think = think; self.n = 0
+        self.samples = []   # [(操作名, 秒)]
+        self.errors = []
+        self.at = AppTest.from_file(APP_PATH, default_timeout=RERUN_TIMEOUT)
+        self.at.query_params["u"] = user_token
+
+    def step(self, name, fn):
+        if self.think: time.sleep(self.rng.uniform(0, 2 * self.think))
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            self.errors.append(f"{name}: {type(e).__name__}: {e}"); return False
+        self.samples.append((name, time.perf_counter() - t0))
+        if self.at.exception:
+            self.errors.append(f"{name}: {self.at.exception[0].message}"); return False
+        return True
+
+    def _keys(self, kind, prefix):
+        return [w.key for w in getattr(self.at, kind) if w.key and w.key.startswith(prefix)]
+
+    def open(self):
+        self.step("open", lambda: self.at.run())
+
+    def add_item(self, category):
+        img = synthetic_photo(self.rng); seed = len(img); self.n += 1
+        def upload():
+            self.at.session_state["cl_img_inject"] = img; self.at.run()
+        def add():
+            self.at.text_input(key=f"cl_name_{seed}").set_value(f"LT-{self.sid}-{self.n}")
+            self.at.selectbox(key=f"cl_category_{seed}").set_value(category)
+            self.at.button(key=f"cl_add_btn_{seed}").click().run()
+        if self.step("item_upload", upload): self.step("item_add", add)
+
+    def log_outfit(self):
+        img = synthetic_photo(self.rng)
+        def upload():
+            self.at.session_state["rec_photo_inject"] = img; self.at.run()
+        if self.step("outfit_upload", upload):
+            self.step("outfit_save", lambda: self.at.button(key="rec_save").click().run())
+
+    def browse_calendar(self):
+        cur = datetime.now().month; prev = 12 if cur == 1 else cur - 1
+        self.step("calendar", lambda: self.at.number_input(key="cal_month").set_value(prev).run())
+        self.step("calendar", lambda: self.at.number_input(key="cal_month").set_value(cur).run())
+
+    def search_edit_closet(self):
+        self.step("closet_search", lambda: self.at.text_input(key="cl_query").input(f"LT-{self.sid}").run())
+        n = len(self.at.selectbox(key="cl_edit").options) - 1 if self._keys("selectbox", "cl_edit") else 0   # 先頭は「選択なし」
+        if n > 0 and self.step("closet_pick", lambda: self.at.selectbox(key="cl_edit").select_index(self.rng.randint(1, n)).run()):
+            iid = self._keys("text_input", "edit_name_")[0][len("edit_name_"):]
+            def edit():
+                self.at.text_area(key=f"edit_notes_{iid}").input(f"edited {datetime.now():%H:%M:%S.%f}")
+                self.at.button(key=f"edit_save_{iid}").click().run()
+            self.step("closet_edit", edit)
+        self.step("closet_search", lambda: self.at.text_input(key="cl_query").input("").run())
+
+    def ai_coordinate(self):
+        if not self.step("ai_generate", lambda: self.at.button(key="ai_gen").click().run()): return
+        if self._keys("button", "ai_save"):
+            self.step("ai_save", lambda: self.at.button(key="ai_save").click().run())
+
+    def run_script(self, rounds, items):
+        for r in range(rounds):
+            for i in range(items if r == 0 else 1):
+                self.add_item("トップス" if i % 2 == 0 else "ボトムス")
+            self.log_outfit()
+            self.browse_calendar()
+            self.search_edit_closet()
+            self.ai_coordinate()
+
+# ---------- 同時数ごとの実行 ----------
+# AppTest は実行のたびにプロセスで 1 つの Runtime._instance を差し替えて最後に None へ戻すので、
+# 同じプロセスのスレッドで同時に動かすと互いの実行を壊す。セッションは spawn した子プロセスで 1 つずつ動かす。
+def _drive(sid, token, seed, think, rounds, items, workdir, start, results):
+    os.chdir(workdir); media.MEDIA_DIR = os.path.join(workdir, "data", "media")
+    s = Session(sid, token, random.Random(seed), think)
+    s.open()   # 最初の描画（import・キャッシュ）はプロセスごとの固定費なので、測る前に済ませる
+    gc.collect(); rss_before = _rss_mb(); peak = [rss_before]; stop = threading.Event()
+    def sample():
+        while not stop.wait(0.2): peak[0] = max(peak[0], _rss_mb())
+    sampler = threading.Thread(target=sample, daemon=True); sampler.start()
+    start.wait()
+    try:
+        s.run_script(rounds, items)
+    except Exception as e:
+        s.errors.append(f"session: {type(e).__name__}: {e}")
+    end = time.perf_counter()
+    storage.pool().writer(storage.user_db_path("tok:" + token)).flush(timeout=60)
+    rss_live = _rss_mb()   # セッションを保持したまま（= 接続中のユーザーが使っている量）
+    stop.set(); sampler.join(); storage.pool().close_all()
+    results.put({"sid": sid, "end": end, "samples": s.samples, "errors": s.errors, "db_waits": storage.wait_stats.snapshot(),
+                 "rss_before": rss_before, "rss_peak": max(peak[0], rss_live), "rss_live": rss_live})
+
+def _merge_waits(snaps) -> dict:
+    out = {}
+    for snap in snaps:
+        for k, v in snap.items():
+            o = out.setdefault(k, {"n": 0, "total_ms": 0.0, "max_ms": 0.0})
+            o["n"] += v["n"]; o["total_ms"] = round(o["total_ms"] + v["total_ms"], 2); o["max_ms"] = max(o["max_ms"], v["max_ms"])
+    return out
+
+def run_level(n, users, rounds, items, think, seed, progress=None) -> dict:
+    from multiprocessing import get_context
+    tokens = [f"{seed:08x}{n:08x}{u:016x}" for u in range(users or n)]   # 同時数ごとに新しいユーザー
+    ctx = get_context("spawn"); start = ctx.Barrier(n + 1); results = ctx.Queue()
+    procs = [ctx.Process(target=_drive, name=f"loadtest-{i}", daemon=True,
+                         args=(i, tokens[i % len(tokens)], seed * 1000 + i, think, rounds, items, os.getcwd(), start, results))
+             for i in range(n)]
+    for pr in procs: pr.start()
+    start.wait(timeout=RERUN_TIMEOUT); t0 = time.perf_counter()   # 全セッションが起動してから一斉に始める
+    got = [results.get(timeout=RERUN_TIMEOUT * 10 * rounds) for _ in procs]
+    for pr in procs: pr.join()
+    wall = max(r["end"] for r in got) - t0   # perf_counter はシステム共通の単調時計
+    samples = [x for r in got for x in r["samples"]]
+    errors = [e for r in got for e in r["errors"]]
+    by_step = {}
+    for name, sec in samples: by_step.setdefault(name, []).append(sec)
+    rss = lambda k: sum(r[k] for r in got)
+    out = {"sessions": n, "users": len(tokens), "wall_sec": round(wall, 2),
+           "ops_per_sec": round(len(samples) / wall, 2) if wall else None,
+           "all": _summary([sec for _, sec in samples]),
+           "steps": {k: _summary(v) for k, v in sorted(by_step.items())},
+           "db_waits": _merge_waits(r["db_waits"] for r in got),
+           # 全セッションの合計。before は最初の描画を終えた状態
+           "rss_mb": {"before": round(rss("rss_before"), 1), "peak": round(rss("rss_peak"), 1), "live": round(rss("rss_live"), 1)},
+           "mem_per_session_mb": round((rss("rss_live") - rss("rss_before")) / n, 2),
+           "errors": len(errors), "error_samples": errors[:10]}
+    if progress: progress(f"{n} sessions", f"p50 {out['all']['p50_ms']} / p95 {out['all']['p95_ms']} / p99 {out['all']['p99_ms']} ms, "
+                                            f"{out['mem_per_session_mb']} MB/session, errors {out['errors']}")
+    return out
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(APP_PATH),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run(levels=(1, 2, 4, 8), users=0, rounds=2, items=4, think=0.2, seed=0, out=None, workdir=None, keep=False,
+        progress=None) -> dict:
+    """levels の各同時数で負荷をかけ、結果を out（既定 data/loadtest/<時刻>-<rev>.json）に保存して返す"""
+    import streamlit
+    rev = git_rev(); started = datetime.now()
+    out = os.path.abspath(out or os.path.join(LOADTEST_DIR, f"{started:%Y%m%d-%H%M%S}-{rev or 'local'}.json"))
+    own = workdir is None
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix="outfits-loadtest-"))
+    cwd = os.getcwd(); media_dir = media.MEDIA_DIR
+    os.makedirs(workdir, exist_ok=True)
+    os.environ.setdefault("OUTFITS_ASSET_DIR", os.path.join(workdir, "assets"))
+    try:
+        os.chdir(workdir)   # data/users/... を作業ディレクトリに作る
+        media.MEDIA_DIR = os.path.join(workdir, "data", "media")
+        result = {"meta": {"started_at": started.isoformat(timespec="seconds"), "git_rev": rev,
+                           "python": platform.python_version(), "streamlit": streamlit.__version__,
+                           "platform": platform.platform(), "cpus": os.cpu_count(),
+                           "params": {"levels": list(levels), "users": users, "rounds": rounds, "items": items,
+                                      "think": think, "seed": seed}},
+                  "levels": [run_level(n, users, rounds, items, think, seed, progress) for n in levels]}
+        result["meta"]["finished_at"] = datetime.now().isoformat(timespec="seconds")
+    finally:
+        storage.pool().close_all()   # シャードは作業ディレクトリからの相対パスなので戻る前に閉じる
+        os.chdir(cwd); media.MEDIA_DIR = media_dir
+        if own and not keep: shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f: json.dump(result, f, ensure_ascii=False, indent=1)
+    result["path"] = out
+    return result
@@ -0,0 +1,155 @@
+# outfits/media.py — 画像配信（内容ハッシュ URL + 署名付きの専用ルート）
+#
+# 配信ファイルは data/media/ に置き、serve.py が Streamlit に足す /m/<name> ルートから返す。
+# ファイル名が内容ハッシュなので中身は不変で、1 年・immutable の Cache-Control を付ける。
+# static/ には置かない（Streamlit の静的配信は誰にでもハッシュだけで読めてしまう）。URL には
+# サーバー鍵での署名 ?t= を付け、画面に出した URL 以外は 404 にする。
+#
+#   streamlit run serve.py
+import io, os, re, hmac, hashlib, secrets, uuid, time, sqlite3, threading
+from .imaging import decode_small
+from . import storage
+
+MEDIA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "media")
+MEDIA_URL = "m"
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MEDIA_KEY_ENV = "OUTFITS_MEDIA_KEY"   # 未設定なら data/media.key に作って使い回す（再起動しても URL が変わらない）
+MEDIA_WIDTHS = (160, 320, 640, 1280)
+MEDIA_GC_GRACE = 300.0   # 秒。書いて間もないファイルは消さない（消しても次の表示で作り直される）
+MEDIA_TABLES = ("items", "outfits", "feedback")
+_IMG_MAGIC = ((b"\xff\xd8\xff", "jpg"), (b"\x89PNG", "png"), (b"GIF8", "gif"))
+_MEDIA_NAME = re.compile(r"[0-9a-f]{8,64}(?:_w\d+)?\.(jpg|png|webp|gif)")
+_MEDIA_TYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+_keys = {}
+
+def _image_ext(b):
+    for sig, ext in _IMG_MAGIC:
+        if b.startswith(sig): return ext
+    if b[:4] == b"RIFF" and b[8:12] == b"WEBP": return "webp"
+    return None
+
+def _media_thumb(b, w):
+    im = decode_small(b, w*2); im.thumbnail((w, w*2))
+    buf = io.BytesIO(); im.save(buf, "JPEG", quality=82, optimize=True, progressive=True)
+    return buf.getvalue()
+
+def _media_write(name, data):
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    path = os.path.join(MEDIA_DIR, name); tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f: f.write(data)
+    os.replace(tmp, path)
+
+def _media_key() -> bytes:
+    if os.environ.get(MEDIA_KEY_ENV): return os.environ[MEDIA_KEY_ENV].encode()
+    path = os.path.join(os.path.dirname(MEDIA_DIR), "media.key")
+    if path not in _keys:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:   # 同時に起動したプロセスとも同じ鍵になるよう、作れた 1 つだけが書く
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+            with os.fdopen(fd, "w") as f: f.write(secrets.token_hex(32))
+        except FileExistsError:
+            pass
+        for _ in range(50):
+            with open(path) as f: key = f.read().strip()
+            if key: break
+            time.sleep(0.01)   # 作った側がまだ書いていない
+        _keys[path] = key.encode()
+    return _keys[path]
+
+def media_token(name) -> str:
+    return hmac.new(_media_key(), name.encode(), hashlib.sha256).hexdigest()[:32]
+
+def media_url(h, blob, w=None) -> str|None:
+    """内容ハッシュ h の画像 URL。w 指定時は MEDIA_WIDTHS に丸めたサムネイル、なければ原寸。
+
+    blob は bytes か bytes を返す関数。配信ファイルが無い時だけ呼ばれ、初回に書き出す。
+    """
+    if not h: return None
+    if w:
+        w = next((x for x in MEDIA_WIDTHS if x >= w), MEDIA_WIDTHS[-1])
+        name = f"{h}_w{w}.jpg"
+    else:
+        name = next((f"{h}.{e}" for e in ("jpg","png","webp","gif") if os.path.exists(os.path.join(MEDIA_DIR, f"{h}.{e}"))), None)
+    if name is None or not os.path.exists(os.path.join(MEDIA_DIR, name)):
+        b = blob() if callable(blob) else blob
+        if not b: return None
+        try:
+            if w: data = _media_thumb(b, w)
+            else:
+                ext = _image_ext(b)
+                data = b if ext else _media_thumb(b, MEDIA_WIDTHS[-1]); name = f"{h}.{ext or 'jpg'}"
+        except Exception:
+            return None
+        _media_write(name, data)
+    return f"{MEDIA_URL}/{name}?t={media_token(name)}"
+
+def media_routes(prefix="/" + MEDIA_URL):
+    """serve.py の st.App に渡す Starlette ルート（starlette は Streamlit の依存で入っている）"""
+    from starlette.responses import FileResponse, Response
+    from starlette.routing import Route
+
+    async def serve(request):
+        name = request.path_params["name"]; m = _MEDIA_NAME.fullmatch(name)
+        if not m or not hmac.compare_digest(request.query_params.get("t", ""), media_token(name)):
+            return Response(status_code=404)
+        path = os.path.join(MEDIA_DIR, name)
+        if not os.path.isfile(path): return Response(status_code=404)
+        return FileResponse(path, media_type=_MEDIA_TYPES[m.group(1)],
+                            headers={"Cache-Control": MEDIA_CACHE_CONTROL, "X-Content-Type-Options": "nosniff"})
+    return [Route(f"{prefix}/{{name}}", serve, methods=["GET", "HEAD"])]
+
+# ---------- 掃除（どのシャードからも参照されなくなった配信ファイルを消す） ----------
+def _media_hash(name):
+    return name.split(".", 1)[0].split("_w", 1)[0]
+
+def _referenced(hashes=None) -> set:
+    """全シャードで使われている内容ハッシュ（hashes 指定時はその中で使われているものだけ）"""
+    out = set(); hs = sorted(hashes or ())
+    for path in storage.shard_paths():
+        try:
+            conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True, timeout=30)
+        except sqlite3.Error:
+            continue
+        try:
+            for t in MEDIA_TABLES:
+                if hashes is None:
+                    out.update(r[0] for r in conn.execute(f"SELECT DISTINCT img_hash FROM {t} WHERE img_hash IS NOT NULL"))
+                for i in range(0, len(hs), 500):
+                    chunk = hs[i:i+500]
+                    out.update(r[0] for r in conn.execute(f"SELECT DISTINCT img_hash FROM {t} WHERE img_hash IN ({','.join('?'*len(chunk))})", chunk))
+        except sqlite3.Error:
+            pass   # 読めないシャードがあっても他は続ける
+        finally:
+            conn.close()
+    return out
+
+def media_gc(hashes=None, grace=MEDIA_GC_GRACE) -> int:
+    """参照されていない配信ファイルを消して件数を返す。hashes 指定時はそのハッシュのファイルだけを見る"""
+    try: names = os.listdir(MEDIA_DIR)
+    except OSError: return 0
+    by_hash = {}
+    for name in names:
+        h = _media_hash(name)
+        if hashes is None or h in hashes: by_hash.setdefault(h, []).append(name)
+    if not by_hash: return 0
+    keep = _referenced(None if hashes is None else set(by_hash))
+    now = time.time(); n = 0
+    for h, files in by_hash.items():
+        if h in keep: continue
+        for name in files:
+            path = os.path.join(MEDIA_DIR, name)
+            try:   # 書き込み途中の一時ファイルは常に猶予を置く
+                if now - os.path.getmtime(path) < (max(grace, MEDIA_GC_GRACE) if name.endswith(".tmp") else grace): continue
+                os.remove(path); n += 1
+            except OSError:
+                pass
+    return n
+
+def media_gc_after(fut, hashes):
+    """書き込み（削除・画像の差し替え）が確定したら、hashes の配信ファイルをバックグラウンドで掃除する"""
+    hashes = {h for h in hashes if h}
+    if not hashes: return
+    def run(f):
+        if f.exception() is None:
+            threading.Thread(target=media_gc, args=(hashes, 0), name="media-gc", daemon=True).start()
+    fut.add_done_callback(run)
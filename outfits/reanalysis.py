@@ -0,0 +1,278 @@
+# outfits/reanalysis.py — 解析アルゴリズム更新時の保存済み画像の再解析（バックグラウンド・再開可能）
+#
+# items / outfits を id 順のチャンクで走査し、プロセスプールで色を解析し直して
+# チャンクごとに 1 トランザクションで書き戻す。進捗（最後の id）は analysis_job に同じ
+# トランザクションで記録するので、途中で止まっても次回は続きから進む。
+# 手動で設定された色（color_src='manual'）は上書きしない。
+# ジョブはホストで 1 つだけ（data/reanalyse.lock を flock）。全シャードを順に回り、プロセスプールは
+# 全体で 1 つ・ワーカー数は REANALYSE_WORKERS までに抑える（ユーザーごとにプールを起こさない）。
+# 解析できない画像は 1 件ずつ失敗として印を付け（analysis_job.failed / last_error）、ジョブは止めない。
+#
+#   python -m outfits reanalyse --db data/app.db
+#   python -m outfits reanalyse --all-shards --workers 2
+import os, sys, time, sqlite3, subprocess
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from multiprocessing import get_context
+from .imaging import ANALYSIS_VERSION, main_color_from_region, classify_top_or_bottom, decode_small, extract_palette
+from . import storage
+
+try: import fcntl
+except ImportError: fcntl = None   # Windows：ロックファイルの pid が生きているかで判断する
+
+REANALYSE_CHUNK = 16      # 1 タスク（ワーカー 1 回の呼び出し）あたりの行数
+REANALYSE_DUTY = 0.5      # 稼働率。処理にかかった時間に応じて休み、対話セッションに CPU を譲る
+REANALYSE_NICE = 10
+REANALYSE_WORKERS = 2     # ワーカープロセス数の上限（既定。CPU 数の半分がこれより少なければそちら）
+
+# 手動で変えていないと判断できる行だけ色を更新する条件
+# outfits の旧データ（color_src が NULL）は、top/bottom が自動認識結果 colors と一致していれば自動とみなす
+ITEM_AUTO = "(color_src='auto' OR (color_src IS NULL AND ?))"
+OUTFIT_AUTO = """(color_src='auto' OR (color_src IS NULL AND top_color IS json_extract(colors,'$[0]')
+                                      AND bottom_color IS json_extract(colors,'$[1]')))"""
+
+def _worker_init():
+    try: os.nice(REANALYSE_NICE)
+    except (AttributeError, OSError): pass
+
+def _analyse(args):
+    """ワーカープロセス側：DB から画像を直接読んで解析する（画像をプロセス間で送らない）"""
+    db_path, table, ids = args
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True, timeout=30)
+    out = []
+    try:
+        for iid in ids:
+            row = conn.execute(f"SELECT img, img_hash FROM {table} WHERE id=?", (iid,)).fetchone()
+            if not row or not row[0]: continue
+            err = None
+            try:
+                img = decode_small(row[0])
+                if table == "items":   # 追加時と同じく、上下判定した領域の主色
+                    region = "upper" if classify_top_or_bottom(img) == "トップス" else "lower"
+                    res = {"color": main_color_from_region(img, region), "palette": extract_palette(img, region)}
+                else:
+                    res = {"top": main_color_from_region(img, "upper"), "bottom": main_color_from_region(img, "lower"),
+                           "palette": {"upper": extract_palette(img, "upper"), "lower": extract_palette(img, "lower")}}
+            except Exception as e:
+                res = None; err = f"{type(e).__name__}: {e}"
+            out.append((iid, row[1], res, err))
+    finally:
+        conn.close()
+    return out
+
+def _update_stmts(table, results, ver, legacy_items):
+    stmts = []
+    for iid, h, res, _ in results:
+        if res is None:   # 読めない画像は印だけ付けて次回の走査から外す
+            stmts.append((f"UPDATE {table} SET color_ver=? WHERE id=?", (ver, iid))); continue
+        # 走査中に画像が差し替えられた行は触らない（img_hash で確認）
+        if table == "items":
+            stmts.append((f"""UPDATE items SET color_ver=?, palette=?, updated_at={storage.NOW_MS},
+                                color_hex=CASE WHEN {ITEM_AUTO} THEN ? ELSE color_hex END,
+                                color_src=CASE WHEN {ITEM_AUTO} THEN 'auto' ELSE color_src END
+                              WHERE id=? AND img_hash IS ?""",
+                          (ver, storage.json_dumps(res["palette"]), int(legacy_items), res["color"], int(legacy_items), iid, h)))
+        else:
+            stmts.append((f"""UPDATE outfits SET color_ver=?, colors=?, palette=?, updated_at={storage.NOW_MS},
+                                top_color=CASE WHEN {OUTFIT_AUTO} THEN ? ELSE top_color END,
+                                bottom_color=CASE WHEN {OUTFIT_AUTO} THEN ? ELSE bottom_color END,
+                                color_src=CASE WHEN {OUTFIT_AUTO} THEN 'auto' ELSE COALESCE(color_src,'manual') END
+                              WHERE id=? AND img_hash IS ?""",
+                          (ver, storage.json_dumps([res["top"], res["bottom"]]), storage.json_dumps(res["palette"]), res["top"], res["bottom"], iid, h)))
+    return stmts
+
+def _todo_sql(table, legacy_items):
+    extra = " OR color_src IS NULL" if table == "items" and legacy_items else ""
+    return f"FROM {table} WHERE img IS NOT NULL AND (color_ver IS NOT ?{extra})"
+
+def pending(db_path, legacy_items=False) -> dict:
+    """テーブル → 未解析（現バージョンでない）の行数"""
+    with storage.pool().connect(db_path) as conn:
+        return {t: conn.execute(f"SELECT COUNT(*) {_todo_sql(t, legacy_items)}", (ANALYSIS_VERSION,)).fetchone()[0]
+                for t in ("items", "outfits")}
+
+def _lock_path():
+    """ホストで 1 つのロック（シャード置き場の隣）"""
+    return os.path.join(os.path.dirname(os.path.abspath(storage.SHARD_DIR)), "reanalyse.lock")
+
+def _alive(pid):
+    if pid <= 0: return False   # 空・壊れたロックファイル（os.kill(0, 0) は自分のグループに届いてしまう）
+    try: os.kill(pid, 0); return True
+    except (OSError, ValueError): return False
+
+def _read_pid(path) -> int:
+    try:
+        with open(path) as f: return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def running() -> bool:
+    path = _lock_path()
+    if fcntl is None: return _alive(_read_pid(path))
+    try: fd = os.open(path, os.O_RDWR)
+    except OSError: return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        return False   # 誰もロックしていない（ファイルは前回の残り）
+    except OSError:
+        return True
+    finally:
+        os.close(fd)
+
+@contextmanager
+def _job_lock():
+    """ホストで 1 ジョブだけ。ロックは flock なので、持ち主が死ねば OS が外す"""
+    path = _lock_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fcntl is None:
+        fd = None
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY); break
+            except FileExistsError:
+                if running(): break
+                try: os.remove(path)   # 持ち主のプロセスが死んでいる
+                except OSError: pass
+        if fd is None:
+            yield False; return
+        try:
+            os.write(fd, str(os.getpid()).encode()); os.close(fd)
+            yield True
+        finally:
+            try: os.remove(path)
+            except OSError: pass
+        return
+    fd = os.open(path, os.O_CREAT | os.O_RDWR)   # ファイルは消さない（消すと別の inode を取り合う）
+    try:
+        try: fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False; return
+        os.ftruncate(fd, 0); os.write(fd, str(os.getpid()).encode())   # 表示用。判定はロックで行う
+        try:
+            yield True
+        finally:
+            os.ftruncate(fd, 0)
+    finally:
+        os.close(fd)   # ロックも外れる
+
+def _workers(workers):
+    return max(1, workers or min(REANALYSE_WORKERS, (os.cpu_count() or 2) // 2))
+
+class _Pool:
+    """ワーカープロセスのプール。解析中にワーカーが落ちても（壊れた画像でデコーダが死ぬなど）作り直して続ける"""
+    def __init__(self, workers):
+        self.workers = workers; self.ex = None
+
+    def _ex(self):
+        # spawn：Streamlit など親プロセスのスレッドや状態を引き継がない。ワーカーは outfits だけを import する
+        if self.ex is None:
+            self.ex = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"), initializer=_worker_init)
+        return self.ex
+
+    def _restart(self):
+        self.ex.shutdown(wait=False, cancel_futures=True); self.ex = None
+
+    def analyse(self, parts) -> list:
+        """parts（[(db_path, table, ids)]）を解析する。失敗したチャンクは 1 件ずつやり直し、それでも
+        だめな行は (iid, None, None, エラー) にする"""
+        futs = [(p, self._ex().submit(_analyse, p)) for p in parts]
+        out, retry, broken = [], [], False
+        for part, fut in futs:
+            try: out += fut.result()
+            except Exception as e:   # BrokenProcessPool（ワーカーが落ちた）も含む
+                retry.append(part); broken |= isinstance(e, BrokenProcessPool)
+        if broken: self._restart()
+        for db_path, table, ids in retry:
+            for iid in ids:
+                try: out += self._ex().submit(_analyse, (db_path, table, [iid])).result()
+                except BrokenProcessPool as e:
+                    self._restart(); out.append((iid, None, None, f"worker crashed: {e}"))
+                except Exception as e:
+                    out.append((iid, None, None, f"{type(e).__name__}: {e}"))
+        return out
+
+    def close(self):
+        if self.ex is not None: self.ex.shutdown(wait=True); self.ex = None
+
+def _reanalyse_shard(pool, db_path, workers, chunk, duty, legacy_items, progress):
+    ver = ANALYSIS_VERSION
+    writer = storage.pool().writer(db_path)
+    stats = {}
+    for t in ("items", "outfits"):
+        with storage.pool().connect(db_path) as conn:
+            row = conn.execute("SELECT version, last_id, done, failed, last_error FROM analysis_job WHERE tbl=?", (t,)).fetchone()
+        last, done, failed, error = (row[1] or 0, row[2] or 0, row[3] or 0, row[4]) if row and row[0] == ver else (0, 0, 0, None)
+        n = 0
+        while True:
+            with storage.pool().connect(db_path) as conn:
+                ids = [r[0] for r in conn.execute(f"SELECT id {_todo_sql(t, legacy_items)} AND id>? ORDER BY id LIMIT ?",
+                                                  (ver, last, chunk * workers))]
+            if not ids: break
+            t0 = time.monotonic()
+            parts = [(db_path, t, ids[i:i+chunk]) for i in range(0, len(ids), chunk)]
+            results = pool.analyse(parts)
+            last = ids[-1]; done += len(ids); n += len(ids)
+            errs = [r[3] for r in results if r[2] is None and r[3]]
+            failed += len(errs); error = errs[-1] if errs else error
+            stmts = _update_stmts(t, results, ver, legacy_items)
+            stmts.append(("""INSERT OR REPLACE INTO analysis_job(tbl,version,last_id,done,failed,last_error,updated_at)
+                             VALUES(?,?,?,?,?,?,?)""", (t, ver, last, done, failed, error, datetime.utcnow().isoformat())))
+            writer.submit(stmts, durable=False).result(timeout=300)
+            if progress: progress(t, done)
+            busy = time.monotonic() - t0
+            if duty < 1: time.sleep(busy * (1 - duty) / duty)
+        stats[t] = n
+        if failed: stats[f"{t}_failed"] = failed
+    return stats
+
+def reanalyse(db_path, workers=None, chunk=REANALYSE_CHUNK, duty=REANALYSE_DUTY, legacy_items=False, progress=None):
+    """db_path の保存済み画像を ANALYSIS_VERSION で解析し直す。
+
+    legacy_items=True なら由来不明（color_src が NULL）のアイテムの色も自動扱いで更新する。
+    既に別のジョブが動いていれば何もせず None を返す。
+    """
+    out = reanalyse_all([db_path], workers, chunk, duty, legacy_items, progress, rescan=False)
+    return None if out is None else out[os.path.abspath(db_path)]
+
+def reanalyse_all(first=(), workers=None, chunk=REANALYSE_CHUNK, duty=REANALYSE_DUTY, legacy_items=False,
+                  progress=None, rescan=True):
+    """first のシャードから順に、このホストの全シャード（rescan=False なら first だけ）を解析し直す。
+
+    シャード → 件数 の dict。既に別のジョブが動いていれば None。走査中に増えたシャードも最後に回る。
+    """
+    workers = _workers(workers)
+    stats = {}
+    with _job_lock() as ok:
+        if not ok: return None
+        pool = _Pool(workers)
+        try:
+            todo = list(first) + (storage.shard_paths() if rescan else [])
+            while True:
+                todo = [p for p in dict.fromkeys(map(os.path.abspath, todo)) if p not in stats]
+                if not todo: break
+                for path in todo:
+                    try:
+                        stats[path] = _reanalyse_shard(pool, path, workers, chunk, duty, legacy_items, progress)
+                    except Exception as e:   # 壊れた・読めないシャードは飛ばして次へ（他のユーザーは続ける）
+                        stats[path] = None
+                        if progress: progress(path, f"skipped: {type(e).__name__}: {e}")
+                todo = storage.shard_paths() if rescan else []
+        finally:
+            pool.close()
+    return stats
+
+def launch(first=None):
+    """別プロセス（python -m outfits reanalyse --all-shards）で全シャードの再解析を始める。
+
+    first のシャードから先に処理する。ホストで実行中なら何もしない。
+    """
+    if running(): return None
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cmd = [sys.executable, "-m", "outfits", "reanalyse", "--all-shards", "--quiet"]
+    if first: cmd += ["--first", os.path.abspath(first)]
+    # 作業ディレクトリはこのプロセスと同じ（data/ の相対パスとロックを共有する）
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")]))}
+    return subprocess.Popen(cmd, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
@@ -0,0 +1,141 @@
+# outfits/recommend.py — コーデ生成・複数日プランナー・不足アイテムの検索リンク
+import numpy as np
+from datetime import datetime
+from urllib.parse import quote_plus
+from .colors import rgb_array, nearest_css_name, JP_COLOR
+from .scoring import (MAXD, PALETTE_RGB, palette_distance, climate_bonus, purpose_match,
+                      body_shape_bonus, candidate_features)
+
+# ---------- 単日生成（トップを選び、残りのカテゴリを学習済み重みで選ぶ） ----------
+def top_score(row, season, body_shape, heat, humidity, rainy):
+    _,_,cat,hx,sp,mat,imgb,nts = row
+    return (0.5*max(0.0, 1.0 - (palette_distance(hx, season) if season else MAXD/2)/MAXD)
+            + 0.4*climate_bonus(mat, heat, humidity, rainy)
+            + 0.1*body_shape_bonus(nts, body_shape, cat))
+
+def pick_best(items, top_hex, category, season, body_shape, want, heat, humidity, rainy, w):
+    """カテゴリ内の全候補を一括で特徴化し、学習済み重みでスコアリング"""
+    cand=[it for it in items if it[2]==category]
+    if not cand: return None, None
+    X = candidate_features(cand, top_hex, season, body_shape, want, heat, humidity, rainy)
+    best = int(np.argmax(X @ w))
+    return cand[best], {"X": X.tolist(), "best": best}
+
+def generate_outfit(items, season, body_shape, want, heat, humidity, rainy, w):
+    """({"top","bottom","shoes","bag"} の id, 学習用の候補記録) を返す。トップスが無ければ (None, {})"""
+    tops=[it for it in items if it[2]=="トップス"]
+    if not tops: return None, {}
+    top = max(tops, key=lambda r: top_score(r, season, body_shape, heat, humidity, rainy))
+    ids={"top": top[0]}; train={}
+    for key, cat in [("bottom","ボトムス"),("shoes","シューズ"),("bag","バッグ")]:
+        row, tr = pick_best(items, top[3], cat, season, body_shape, want, heat, humidity, rainy, w)
+        ids[key] = row[0] if row else None
+        if tr: train[key] = tr
+    return ids, train
+
+# ---------- 複数日プランナー（ビームサーチ） ----------
+PLAN_FRESH_W = 0.15    # 最終着用から日が空いているほど加点（60 日で頭打ち）
+PLAN_BALANCE_W = 0.10  # 着用回数が多いほど減点（クローゼット全体を満遍なく）
+PLAN_REPEAT_PEN = 10.0 # window 日以内のトップ/ボトム再登場（実質禁止）
+PLAN_SOFT_PEN = 0.3    # 靴/バッグの連続使用
+
+def _days_since(iso, now):
+    try: return (now - datetime.fromisoformat(str(iso)[:19])).days
+    except: return 60
+
+def plan_outfits(items, days, season, body_shape, w, last_used, use_count, window=3, beam=8, expand=12):
+    """days（[{"date","want","heat","humidity","rainy"}]）ぶんのコーデを計画して
+    [{"date","top","bottom","shoes","bag","score"}]（id）を返す。
+
+    トップ×各カテゴリの色相性行列を先に作り、日ごとに状態ごとの上位 expand 組を展開して
+    累積スコア上位 beam 本を残す。
+    """
+    keys = [("top","トップス"),("bottom","ボトムス"),("shoes","シューズ"),("bag","バッグ")]
+    cats = {k: [r for r in items if r[2]==c] for k, c in keys}
+    if not cats["top"] or not days: return []
+    now = datetime.utcnow()
+    rgb = {k: rgb_array([r[3] for r in v]) for k, v in cats.items() if v}
+    def pal(x):
+        if not season: return np.full(len(x), 0.5)
+        p = PALETTE_RGB.get(season)
+        if p is None: return np.ones(len(x))
+        return np.clip(1.0 - np.sqrt(((x[:, None, :] - p[None])**2).sum(-1)).min(1) / MAXD, 0.0, 1.0)
+    P = {k: pal(x) for k, x in rgb.items()}
+    H = {k: np.clip(1.0 - np.linalg.norm(rgb["top"][:, None, :] - rgb[k][None, :, :], axis=2) / MAXD, 0.0, 1.0)
+         for k in rgb if k != "top"}                               # (T, N)
+    max_use = max([use_count.get(r[0], 0) for v in cats.values() for r in v] + [1])
+    R = {k: PLAN_FRESH_W * np.array([min(_days_since(last_used[r[0]], now), 60) / 60 if r[0] in last_used else 1.0 for r in v])
+            - PLAN_BALANCE_W * np.array([use_count.get(r[0], 0) / max_use for r in v])
+         for k, v in cats.items() if v}
+
+    ctx_cache = {}
+    def day_scores(day):
+        key = (day["want"], day["heat"], day["humidity"], bool(day["rainy"]))
+        if key not in ctx_cache:
+            want, heat, humidity, rainy = key
+            tt = np.array([(climate_bonus(r[5], heat, humidity, rainy), body_shape_bonus(r[7], body_shape, r[2]))
+                           for r in cats["top"]], float)
+            out = {"top": 0.5*P["top"] + 0.4*tt[:, 0] + 0.1*tt[:, 1] + R["top"]}   # 単日生成と同じトップ評価
+            for k in H:
+                tx = np.array([(climate_bonus(r[5], heat, humidity, rainy), purpose_match(r[7], want),
+                                body_shape_bonus(r[7], body_shape, r[2])) for r in cats[k]], float)
+                out[k] = w[0]*H[k] + (w[1]*P[k] + tx @ w[2:] + R[k])[None, :]
+            ctx_cache[key] = out
+        return ctx_cache[key]
+
+    fresh = {k: np.full(len(v), -10**6) for k, v in cats.items() if v}   # 計画内での最終使用日
+    states = [(0.0, [], fresh)]
+    for i, day in enumerate(days):
+        sc = day_scores(day); nxt = []
+        for total, picks, last in states:
+            rep_pen = {k: np.where(i - last[k] <= window, PLAN_REPEAT_PEN if k in ("top","bottom") else PLAN_SOFT_PEN, 0.0)
+                       for k in last}
+            top_v = sc["top"] - rep_pen["top"]
+            M = (top_v[:, None] + sc["bottom"] - rep_pen["bottom"][None, :]) if "bottom" in sc else top_v[:, None]
+            flat = M.ravel(); k_ = min(expand, flat.size)
+            for f in np.argpartition(-flat, k_-1)[:k_]:
+                t, b = divmod(int(f), M.shape[1])
+                pick = {"top": t, "bottom": b if "bottom" in sc else None}; gain = float(M[t, b])
+                for k in ("shoes", "bag"):
+                    if k in sc:
+                        v = sc[k][t] - rep_pen[k]; j = int(np.argmax(v))
+                        pick[k] = j; gain += float(v[j])
+                    else:
+                        pick[k] = None
+                new_last = {k: a.copy() for k, a in last.items()}
+                for k, j in pick.items():
+                    if j is not None: new_last[k][j] = i
+                nxt.append((total + gain, picks + [(pick, gain)], new_last))
+        nxt.sort(key=lambda x: -x[0])
+        states = nxt[:beam]
+
+    _, picks, _ = states[0]
+    return [{"date": day["date"], "score": round(g, 3),
+             **{k: (cats[k][j][0] if j is not None else None) for k, j in pick.items()}}
+            for day, (pick, g) in zip(days, picks)]
+
+# ---------- オンライン提案（不足カテゴリの検索リンク） ----------
+SHOP_LINKS = {
+    "ZOZOTOWN": "https://www.google.com/search?q=",
+    "UNIQLO": "https://www.uniqlo.com/jp/ja/search?q=",
+    "GU": "https://www.gu-global.com/jp/ja/search/?q=",
+    "MUJI": "https://www.muji.com/jp/ja/search/?query=",
+    "Rakuten": "https://search.rakuten.co.jp/search/mall/",
+    "Amazon": "https://www.amazon.co.jp/s?k=",
+    "WEAR": "https://wear.jp/item/?keyword=",
+}
+CAT_JP = {"トップス":"トップス","ボトムス":"パンツ","シューズ":"スニーカー","バッグ":"バッグ"}
+def shop_suggestions(category:str, base_hex:str, season:str|None):
+    color_jp = JP_COLOR.get(nearest_css_name(base_hex), "ベーシック")
+    season_jp = {"spring":"春","summer":"夏","autumn":"秋","winter":"冬"}.get(season or "", "")
+    kw = f"{color_jp} {CAT_JP.get(category, category)} {season_jp}".strip()
+    out=[]
+    for site, base in SHOP_LINKS.items():
+        if site=="ZOZOTOWN":
+            q = quote_plus(f"site:zozo.jp {kw}"); url = base + q
+        elif site=="Rakuten":
+            url = base + quote_plus(kw) + "/"
+        else:
+            url = base + quote_plus(kw)
+        out.append({"site":site, "kw":kw, "url":url})
+    return out
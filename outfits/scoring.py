@@ -0,0 +1,198 @@
+# outfits/scoring.py — コーデの採点（配色/パーソナルカラー/気候/用途/体型）と好みモデル
+import json
+import numpy as np
+from math import sqrt
+from datetime import datetime
+from .colors import hex_to_rgb, adjust_harmony, nearest_css_name, rgb_array, JP_COLOR
+from .storage import db, write
+
+SEASON_PALETTES = {
+    "spring": ["#ffb3a7","#ffd28c","#ffe680","#b7e07a","#8ed1c8","#ffd7ef","#f5deb3"],
+    "summer": ["#c8cbe6","#b0c4de","#c3b1e1","#9fd3c7","#d8d8d8","#e6d5c3","#a3bcd6"],
+    "autumn": ["#a0522d","#c68642","#8f9779","#556b2f","#b5651d","#6b4f3f","#8b6c42"],
+    "winter": ["#000000","#ffffff","#4169e1","#8a2be2","#ff1493","#00ced1","#2f4f4f"],
+}
+def palette_distance(hexstr, user_season):
+    if not user_season or user_season not in SEASON_PALETTES: return 0.0
+    px=hex_to_rgb(hexstr); best=1e9
+    for p in SEASON_PALETTES[user_season]:
+        rr,gg,bb=hex_to_rgb(p)
+        d=(px[0]-rr)**2+(px[1]-gg)**2+(px[2]-bb)**2
+        if d<best: best=d
+    return sqrt(best)
+def rgb_dist(h1,h2):
+    r1,g1,b1=hex_to_rgb(h1); r2,g2,b2=hex_to_rgb(h2)
+    return sqrt((r1-r2)**2+(g1-g2)**2+(b1-b2)**2)
+MAXD = sqrt(255**2*3)
+def as_palette(c):
+    """hex 1 色でもパレット [(hex, 面積比), ...] でも [(hex, 重み)] にそろえる"""
+    if not c: return []
+    if isinstance(c, str): return [(c, 1.0)]
+    return [(hx, float(w)) for hx, w in c if hx]
+def harmony_score(top_hex, others):
+    # top_hex / others の各要素はパレットでもよい（面積比で重み付けした色の近さ）
+    if not others: return 0
+    top = as_palette(top_hex)
+    ds=[]
+    for hx in others:
+        pal = as_palette(hx)
+        if not pal: continue
+        s = sum(wa*wb*max(0.0, 1.0 - rgb_dist(a, b)/MAXD) for a, wa in top for b, wb in pal)
+        ds.append(s / (sum(w for _, w in top) * sum(w for _, w in pal)))
+    if not ds: return 0
+    return 40 * (sum(ds)/len(ds))
+def palette_score(hexes, user_season):
+    if not user_season: return 15
+    ss=[]
+    for hx in hexes:
+        pal = as_palette(hx)
+        if not pal: continue
+        s = sum(w*max(0.0, 1.0 - palette_distance(c, user_season)/MAXD) for c, w in pal)
+        ss.append(s / sum(w for _, w in pal))
+    return 30 * (sum(ss)/len(ss)) if ss else 0
+def climate_bonus(material, heat, humidity, rainy):
+    m=(material or "").lower(); s=0
+    if heat in ["暑い","猛暑"] and any(k in m for k in ["linen","リネン","cotton","コットン","メッシュ","ドライ"]): s+=1
+    if heat in ["寒い"] and any(k in m for k in ["wool","ウール","ダウン","中綿","フリース","キルト"]): s+=1
+    if humidity=="湿度高い" and any(k in m for k in ["ドライ","吸汗","速乾","メッシュ","ナイロン","nylon"]): s+=1
+    if humidity=="乾燥" and any(k in m for k in ["ウール","ニット","フリース"]): s+=1
+    if rainy and any(k in m for k in ["ナイロン","nylon","ゴア","gore","防水","撥水"]): s+=1
+    return s
+def purpose_match(notes, want):
+    if not want or want=="指定なし": return 0
+    n=(notes or ""); pts=0
+    if want=="通勤":     pts += any(k in n for k in ["ジャケット","シャツ","スラックス","革靴","きれいめ"])
+    if want=="デート":   pts += any(k in n for k in ["綺麗め","スカート","ワンピ","ヒール","上品"])
+    if want=="カジュアル":pts += any(k in n for k in ["デニム","スニーカー","カジュアル","リラックス"])
+    if want=="スポーツ": pts += any(k in n for k in ["スニーカー","ジャージ","ドライ","ラン","トレ"])
+    if want=="フォーマル":pts += any(k in n for k in ["ネクタイ","セットアップ","ドレス","革靴"])
+    if want=="雨の日":  pts += any(k in n for k in ["撥水","防水","ゴア","レイン","ナイロン"])
+    return int(bool(pts))
+def body_shape_bonus(notes, body, category):
+    if not body: return 0
+    n=(notes or "").lower(); b=body
+    if b=="straight":
+        if category=="ボトムス" and any(k in n for k in ["テーパード","センタープレス","ストレート"]): return 1
+        if category in ["トップス","アウター"] and any(k in n for k in ["vネック","襟","ジャケット","構築的"]): return 1
+    if b=="wave":
+        if category=="ボトムス" and any(k in n for k in ["ハイウエスト","aライン","フレア"]): return 1
+        if category=="トップス" and any(k in n for k in ["短丈","クロップド","柔らか","リブ"]): return 1
+    if b=="natural":
+        if any(k in n for k in ["ワイド","オーバーサイズ","ドロップショルダー","リネン","ツイード"]): return 1
+    return 0
+def evaluate_outfit(outfit, season, body_shape, want, heat, humidity, rainy, palettes=None):
+    """palettes: {item_id: [(hex, 面積比), ...]} があれば配色/PC 評価はパレット全体で行う"""
+    items = [outfit[k] for k in ["top","bottom","shoes","bag"] if outfit.get(k)]
+    hexes = [it[3] for it in items if it]
+    top_hex = outfit["top"][3] if outfit.get("top") else (hexes[0] if hexes else "#2f2f2f")
+    pals = [(palettes or {}).get(it[0]) or it[3] for it in items if it]
+    top_pal = pals[0] if outfit.get("top") and pals else top_hex
+    sc_harmony = harmony_score(top_pal, pals[1:])
+    sc_palette = palette_score(pals, season)
+    clim = sum([climate_bonus(it[5], heat, humidity, rainy) for it in items]); sc_climate = min(clim, 4) / 4 * 20
+    purp = sum([purpose_match(it[7], want) for it in items]); sc_purpose = min(purp, 2) / 2 * 10
+    bodyb = sum([body_shape_bonus(it[7], body_shape, it[2]) for it in items]); sc_body = min(bodyb, 3) / 3 * 10
+    total = round(max(0.0, min(100.0, sc_harmony + sc_palette + sc_climate + sc_purpose + sc_body)), 1)
+    goods=[]; bads=[]
+    if sc_harmony >= 28: goods.append("トップと他アイテムの**色相バランス**が良い")
+    else: bads.append("配色の一体感が弱め。**補色/類似色**を意識するとまとまりやすい")
+    if sc_palette >= 20: goods.append("**パーソナルカラー**に合うトーン")
+    else: bads.append("PCから少し外れ気味。**優先パレット**寄りの色に寄せると◎")
+    if sc_climate >= 12: goods.append("**気候**に合った素材選び")
+    else: bads.append("気候との相性が弱い素材あり")
+    if sc_purpose >= 6: goods.append("用途（シーン）に対する**TPO**が合っている")
+    else: bads.append("TPO要素が弱い")
+    if sc_body >= 6: goods.append("体型に合う**シルエット**/ディテール")
+    else: bads.append("体型補正が弱め")
+    comp = adjust_harmony(top_hex, "complement")[0]
+    ana  = adjust_harmony(top_hex, "analogous")
+    tri  = adjust_harmony(top_hex, "triadic")
+    suggest = sorted([comp, ana[0], tri[0]], key=lambda h: palette_distance(h, season))
+    def jp_name(hx): return JP_COLOR.get(nearest_css_name(hx), nearest_css_name(hx))
+    suggestions = [{"hex":h, "name":jp_name(h)} for h in suggest]
+    breakdown = {"Harmony(40)": round(sc_harmony,1),"PC Fit(30)": round(sc_palette,1),
+                 "Climate(20)": round(sc_climate,1),"Purpose(10)": round(sc_purpose,1),"Body(10)": round(sc_body,1)}
+    return total, goods, bads, suggestions, breakdown
+
+# ---------- 好みモデル（保存・評価されたコーデから重みを学習） ----------
+# 候補の特徴 x = [Harmony, PC Fit, Climate, Purpose, Body]、スコア = w·x。
+# 初期値は従来の固定係数。表示したアイテムと、同じカテゴリで選ばれなかった候補の組ごとに
+# 差 x_表示 − x_候補 を学習例にし、L2（初期値への引き戻し）付きのペアワイズ・ロジスティック回帰で少しずつ更新する。
+# （特徴は非負なので、表示したものだけを正例にすると重みが一様に大きくなるだけで好みを学ばない）
+PREF_FEATURES = ["harmony","palette","climate","purpose","body"]
+PREF_PRIOR = np.array([0.6, 0.3, 0.07, 0.02, 0.01])
+PREF_LR = 0.05; PREF_L2 = 0.02; PREF_STEPS = 5
+PREF_PAIRS = 16   # カテゴリあたりの比較相手の上限（スコアの近い順。僅差で負けた候補ほど情報がある）
+
+PALETTE_RGB = {k: rgb_array(v) for k, v in SEASON_PALETTES.items()}
+
+def candidate_features(cands, top_hex, season, body_shape, want, heat, humidity, rainy) -> np.ndarray:
+    """候補アイテム（items の行）をまとめて特徴行列 (N, 5) にする"""
+    if not cands: return np.zeros((0, len(PREF_FEATURES)))
+    rgb = rgb_array([r[3] for r in cands])
+    s_h = np.clip(1.0 - np.linalg.norm(rgb - rgb_array([top_hex])[0], axis=1) / MAXD, 0.0, 1.0)
+    if season:
+        pal = PALETTE_RGB.get(season)
+        dist = (np.sqrt(((rgb[:, None, :] - pal[None, :, :])**2).sum(-1)).min(1) if pal is not None
+                else np.zeros(len(cands)))
+    else:
+        dist = np.full(len(cands), MAXD/2)
+    s_p = np.clip(1.0 - dist / MAXD, 0.0, 1.0)
+    text = np.array([(climate_bonus(r[5], heat, humidity, rainy), purpose_match(r[7], want),
+                      body_shape_bonus(r[7], body_shape, r[2])) for r in cands], float)
+    return np.column_stack([s_h, s_p, text])
+
+def _pref_model(row):
+    try:
+        v = np.asarray(json.loads(row[0]), float)
+        if v.shape == (len(PREF_FEATURES)+1,): return v[:-1], float(v[-1]), int(row[1] or 0)
+    except: pass
+    return PREF_PRIOR.copy(), 0.0, 0
+
+def load_pref_model():
+    with db() as conn:
+        return _pref_model(conn.execute("SELECT w, n FROM pref_model WHERE id=1").fetchone())
+
+def pref_update(model, X, y):
+    """ペアの差 X: (N, 5)、y: 表示側が好まれた度合い 0〜1 でミニバッチ SGD を数ステップ。
+
+    差を取るので切片は打ち消し合う（b は保存形式の互換のために持つだけで更新しない）。
+    """
+    w, b, n = model
+    X = np.asarray(X, float).reshape(-1, len(PREF_FEATURES)); y = np.asarray(y, float)
+    if not len(y): return w, b, n
+    for _ in range(PREF_STEPS):
+        g = 1.0 / (1.0 + np.exp(-(X @ w))) - y
+        w = w - PREF_LR * (X.T @ g / len(y) + PREF_L2 * (w - PREF_PRIOR))
+    return w, b, n + len(y)
+
+def update_pref_model(X, y):
+    """学習例 (X, y)（pref_examples の戻り値）で好みモデルを更新する。
+
+    重みは書き込みジョブの中で読み直して更新するので、同じユーザーの別セッションの更新を上書きしない。
+    学習例が空なら何も書かない。
+    """
+    X = np.asarray(X, float).reshape(-1, len(PREF_FEATURES)); y = np.asarray(y, float)
+    def job(conn):
+        if not len(y): return []
+        w, b, n = pref_update(_pref_model(conn.execute("SELECT w, n FROM pref_model WHERE id=1").fetchone()), X, y)
+        return [("INSERT OR REPLACE INTO pref_model(id,w,n,updated_at) VALUES(1,?,?,?)",
+                 (json.dumps([float(v) for v in w] + [float(b)]), int(n), datetime.utcnow().isoformat()))]
+    return write([(job, ())], durable=False)
+
+def pref_examples(train, label=1.0, w=None):
+    """生成時の候補記録 train から、表示したアイテム対 選ばれなかった候補 のペアを学習例にする。
+
+    label は表示したコーデが好まれた度合い（保存 = 1、評価 = ★/4、作り直し = 0）。
+    比較相手はカテゴリごとに、重み w（省略時は初期値）でのスコアが表示したものに近い順に PREF_PAIRS 件。
+    """
+    w = PREF_PRIOR if w is None else np.asarray(w, float)
+    Xs = []
+    for t in train.values():
+        X = np.asarray(t["X"], float).reshape(-1, len(PREF_FEATURES)); best = t["best"]
+        rest = np.delete(np.arange(len(X)), best)
+        if not len(rest): continue   # 候補が 1 つだけのカテゴリは比べる相手がない
+        rest = rest[np.argsort(X[best] @ w - X[rest] @ w, kind="stable")[:PREF_PAIRS]]
+        Xs.append(X[best] - X[rest])
+    X = np.vstack(Xs) if Xs else np.zeros((0, len(PREF_FEATURES)))
+    return X, np.full(len(X), float(label))
@@ -0,0 +1,736 @@
+# outfits/storage.py — ユーザー別 SQLite シャードと読み書きヘルパ（Streamlit 非依存）
+import sqlite3, os, json, glob, hashlib, threading, time, queue, pickle, atexit, uuid
+from concurrent.futures import Future
+from datetime import datetime
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+try: import fcntl
+except ImportError: fcntl = None   # Windows：スプールの持ち主は pid が生きているかで判断する
+
+LEGACY_DB_PATH = "data/app.db"
+SHARD_DIR = "data/users"
+MAX_OPEN_SHARDS = int(os.environ.get("OUTFITS_MAX_SHARDS", "64"))
+SHARD_IDLE_SEC = int(os.environ.get("OUTFITS_SHARD_IDLE_SEC", "600"))
+SPOOL_MAX_BYTES = 256 << 10   # これより大きいジョブ（画像入り）はスプールしない（WAL と合わせて 2 回書かない）
+
+def _add_column(c, table, coldef) -> bool:
+    """列を足す。既にあれば False。それ以外の失敗（database is locked など）は隠さずに投げる"""
+    try:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {coldef}"); return True
+    except sqlite3.OperationalError as e:
+        if "duplicate column name" in str(e): return False
+        raise
+
+def init_schema(conn):
+    c = conn.cursor()
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS outfits(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      d TEXT, season TEXT, top_sil TEXT, bottom_sil TEXT,
+      top_color TEXT, bottom_color TEXT, colors TEXT, img BLOB, notes TEXT
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS profile(
+      id INTEGER PRIMARY KEY CHECK(id=1),
+      season TEXT, undertone TEXT, home_lat REAL, home_lon REAL, city TEXT,
+      body_shape TEXT, height_cm REAL
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS items(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      name TEXT, category TEXT, color_hex TEXT, season_pref TEXT,
+      material TEXT, img BLOB, notes TEXT
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS coords(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      created_at TEXT,
+      top_id INTEGER, bottom_id INTEGER, shoes_id INTEGER, bag_id INTEGER,
+      ctx TEXT, score REAL, rating INTEGER
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS outfit_items(
+      outfit_id INTEGER, item_id INTEGER, region TEXT, dist REAL,
+      PRIMARY KEY(outfit_id, item_id)
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS outfit_items_item ON outfit_items(item_id)")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS item_features(
+      item_id INTEGER PRIMARY KEY, img_hash TEXT, hist BLOB
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS pref_model(
+      id INTEGER PRIMARY KEY CHECK(id=1),
+      w TEXT, n INTEGER, updated_at TEXT
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS feedback(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      created_at TEXT,
+      kind TEXT, subject TEXT, body TEXT, contact TEXT,
+      img BLOB, meta TEXT
+    )""")
+    _add_column(c, "profile", "body_shape TEXT")
+    _add_column(c, "profile", "height_cm REAL")
+    for t in ["outfits","items","feedback"]:
+        _add_column(c, t, "img_hash TEXT")
+    # color_src: 'auto'（自動認識のまま）/ 'manual'（ユーザーが変更）/ NULL（旧データ・不明）
+    # color_ver: その色を解析したアルゴリズムのバージョン（imaging.ANALYSIS_VERSION）
+    # palette: 自動抽出した主要色 [[hex, 面積比], ...]（outfits は {"upper": [...], "lower": [...]}）
+    for t in ["outfits","items"]:
+        for col in ["color_src TEXT", "color_ver INTEGER", "palette TEXT"]:
+            _add_column(c, t, col)
+    # planned=1: まとめて計画した日の予定（planned_for の日付）。confirm_coord で確定するまで着用に数えない
+    _add_column(c, "coords", "planned_for TEXT")
+    if _add_column(c, "coords", "planned INTEGER DEFAULT 0"):
+        # 以前の版でまとめて保存した予定（ctx.plan_date）も未確定の予定として扱う
+        c.execute("""UPDATE coords SET planned=1, planned_for=json_extract(ctx,'$.plan_date')
+                     WHERE json_valid(ctx) AND json_extract(ctx,'$.plan_date') IS NOT NULL""")
+    # 着用として数える coords（未確定の予定は除く）と、その着用日 worn_at
+    c.execute("""CREATE VIEW IF NOT EXISTS worn_coords AS
+                 SELECT id, COALESCE(planned_for, created_at) AS worn_at, top_id, bottom_id, shoes_id, bag_id, score, rating
+                 FROM coords WHERE planned IS NOT 1""")
+    # GitHub Issue の送信待ち（outfits.feedback）。feedback と同じトランザクションで積む
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS outbox(
+      id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT, feedback_id INTEGER,
+      title TEXT, body TEXT, status TEXT, attempts INTEGER DEFAULT 0, next_at REAL,
+      last_error TEXT, result TEXT
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox(status, next_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS outbox_fb ON outbox(feedback_id)")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS analysis_job(
+      tbl TEXT PRIMARY KEY, version INTEGER, last_id INTEGER, done INTEGER, updated_at TEXT
+    )""")
+    _add_column(c, "analysis_job", "failed INTEGER DEFAULT 0")   # 解析できなかった行数（その版で）
+    _add_column(c, "analysis_job", "last_error TEXT")
+    # 同期（outfits.sync）：端末をまたいで行を識別する uid と更新時刻（ms）、変更ログ
+    for t in SYNC_TABLES:
+        for col in ["uid TEXT", "updated_at INTEGER"]:
+            _add_column(c, t, col)
+    c.execute("CREATE TABLE IF NOT EXISTS sync_log(seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT, uid TEXT, op TEXT)")
+    c.execute("CREATE TABLE IF NOT EXISTS sync_state(k TEXT PRIMARY KEY, v TEXT)")
+    c.execute("CREATE TABLE IF NOT EXISTS sync_blobs(h TEXT PRIMARY KEY)")   # リモートにあると確認済みの画像
+    c.execute("INSERT OR IGNORE INTO sync_state(k, v) VALUES('applying', '0')")
+    for t in ["items","outfits","coords"]:
+        c.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {t}_uid ON {t}(uid)")
+        c.execute(f"CREATE INDEX IF NOT EXISTS {t}_updated ON {t}(updated_at)")   # analytics_signature（img を読まずに集計）
+        if c.execute(f"SELECT 1 FROM {t} WHERE uid IS NULL LIMIT 1").fetchone():
+            c.execute(f"UPDATE {t} SET uid={NEW_UID} WHERE uid IS NULL")
+    # トリガーは同期を有効にした DB（outfits.sync が seeded を書く）にだけ置く。それ以前の版が
+    # 無条件に作ったトリガーと、誰も送らないまま溜まった変更ログはここで片付ける
+    if c.execute("SELECT 1 FROM sqlite_master WHERE type='trigger' AND name LIKE 'sync@_%' ESCAPE '@' LIMIT 1").fetchone() \
+       and not c.execute("SELECT 1 FROM sync_state WHERE k='seeded'").fetchone():
+        for name in sync_triggers(): c.execute(f"DROP TRIGGER IF EXISTS {name}")
+        c.execute("DELETE FROM sync_log")
+    conn.commit()
+
+# ---------- 同期の変更ログ（トリガーで記録するので書き込み側は uid / updated_at を入れるだけ） ----------
+# 同期する列。img 本体は送らず img_hash で参照し、coords の *_id は相手側では items の uid に置き換える。
+# outfit_items は「outfit の uid:item の uid」を uid として region / dist を送る。
+SYNC_TABLES = {
+    "items":   ["name","category","color_hex","season_pref","material","notes","img_hash","color_src","color_ver","palette"],
+    "outfits": ["d","season","top_sil","bottom_sil","top_color","bottom_color","colors","notes","img_hash",
+                "color_src","color_ver","palette"],
+    "coords":  ["created_at","top_id","bottom_id","shoes_id","bag_id","ctx","score","rating","planned","planned_for"],
+    "profile": ["season","undertone","home_lat","home_lon","city","body_shape","height_cm"],
+}
+SYNC_REFS = {"coords": ["top_id","bottom_id","shoes_id","bag_id"]}
+SYNC_VERSION = "3"   # トリガーの版。sync_state.seeded に入れ、違えば作り直す
+# uid / updated_at は書き込む文そのものに入れる（トリガーで行を書き直すと img の BLOB まで二重に書く）
+NEW_UID = "lower(hex(randomblob(16)))"
+NOW_MS = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+# リモートの変更を取り込む間は sync_state.applying=1（同じトランザクション内）にしてログを書かない
+_SYNC_ON = "(SELECT v FROM sync_state WHERE k='applying') IS NOT '1'"
+
+def sync_triggers() -> dict:
+    """トリガー名 -> CREATE 文。ログに積むだけで、対象の行には書き込まない"""
+    out = {}
+    for t, cols in SYNC_TABLES.items():
+        out[f"sync_{t}_ins"] = f"""CREATE TRIGGER sync_{t}_ins AFTER INSERT ON {t} WHEN {_SYNC_ON} AND NEW.uid IS NOT NULL BEGIN
+                                     INSERT INTO sync_log(tbl, uid, op) VALUES('{t}', NEW.uid, 'upsert');
+                                   END"""
+        out[f"sync_{t}_upd"] = f"""CREATE TRIGGER sync_{t}_upd AFTER UPDATE OF {','.join(cols)} ON {t} WHEN {_SYNC_ON} BEGIN
+                                     INSERT INTO sync_log(tbl, uid, op) VALUES('{t}', NEW.uid, 'upsert');
+                                   END"""
+        out[f"sync_{t}_del"] = f"""CREATE TRIGGER sync_{t}_del AFTER DELETE ON {t} WHEN {_SYNC_ON} AND OLD.uid IS NOT NULL BEGIN
+                                     INSERT INTO sync_log(tbl, uid, op) VALUES('{t}', OLD.uid, 'delete');
+                                   END"""
+    # アイテムを消すとリンクも消える。リンク側のトリガーではアイテムの uid が引けないので、消す前に記録する
+    out["sync_items_links_del"] = f"""CREATE TRIGGER sync_items_links_del BEFORE DELETE ON items WHEN {_SYNC_ON} BEGIN
+                                        INSERT INTO sync_log(tbl, uid, op) SELECT 'outfit_items', o.uid || ':' || OLD.uid, 'delete'
+                                        FROM outfit_items l JOIN outfits o ON o.id=l.outfit_id WHERE l.item_id=OLD.id;
+                                      END"""
+    link = lambda r: f"SELECT 'outfit_items', o.uid || ':' || i.uid, '{'delete' if r == 'OLD' else 'upsert'}' " \
+                     f"FROM outfits o, items i WHERE o.id={r}.outfit_id AND i.id={r}.item_id"
+    for name, when, r in [("ins", "AFTER INSERT", "NEW"), ("upd", "AFTER UPDATE OF region,dist", "NEW"), ("del", "AFTER DELETE", "OLD")]:
+        out[f"sync_outfit_items_{name}"] = f"""CREATE TRIGGER sync_outfit_items_{name} {when} ON outfit_items WHEN {_SYNC_ON} BEGIN
+                                                 INSERT INTO sync_log(tbl, uid, op) {link(r)};
+                                               END"""
+    return out
+
+# ---------- 待ち時間の集計（負荷試験で参照。加算だけなので常時有効） ----------
+class WaitStats:
+    """名前ごとに 回数 / 合計 / 最大 の待ち秒を数える"""
+    def __init__(self):
+        self._lock = threading.Lock(); self._d = {}
+
+    def add(self, name, sec):
+        with self._lock:
+            s = self._d.setdefault(name, [0, 0.0, 0.0])
+            s[0] += 1; s[1] += sec; s[2] = max(s[2], sec)
+
+    def reset(self):
+        with self._lock: self._d = {}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {k: {"n": n, "total_ms": round(t*1000, 2), "max_ms": round(m*1000, 2)} for k, (n, t, m) in self._d.items()}
+
+# shard_lock: 読み出し接続のロック待ち / write_queue: 投入からコミット開始まで / sqlite_begin: BEGIN IMMEDIATE の待ち
+wait_stats = WaitStats()
+
+# ---------- 書き込みキュー（DB ごとに単一ライター） ----------
+# スプールは .spool/<db>/<pid>-<乱数>/ にプロセスごとに分け、隣の .lock を flock で持ち続ける。
+# ロックが外れている（持ち主が終了した）ディレクトリのジョブだけを次に起動したプロセスが引き取る。
+def _job_bytes(stmts):
+    return sum(len(v) for _, params in stmts for v in params if isinstance(v, (bytes, str)))
+
+def _lock_spool(d):
+    fd = os.open(d + ".lock", os.O_CREAT | os.O_RDWR)
+    if fcntl: fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    return fd
+
+def _spool_live(d) -> bool:
+    """スプール d を持つプロセスがまだ動いていれば True（その中身は触らない）"""
+    if fcntl is None:
+        try: os.kill(int(os.path.basename(d).split("-")[0]), 0); return True
+        except (OSError, ValueError): return False
+    try: fd = os.open(d + ".lock", os.O_RDWR)
+    except OSError: return False   # ロックを先に作るので、ロックのないディレクトリは片付け途中の残り
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return False
+    except OSError:
+        return True
+    finally:
+        os.close(fd)   # 取れたロックもここで手放す（引き取りは rename で 1 プロセスに決まる）
+
+class WriteQueue:
+    """DB 1 つにつき 1 本のライタースレッド。溜まった書き込みを 1 トランザクションにまとめる。
+
+    submit() は [(sql, params), ...] を受け取り Future を返す（結果は最後の文の lastrowid）。
+    sql の代わりに関数 fn(conn) -> [(sql, params), ...] を置くと、同じトランザクションの中で
+    読み直してから書ける（関数はスプールできないので、そのジョブは durable にならない）。
+    durable=True のジョブは投入前にこのプロセスのスプールへ fsync し、コミット後に消す。
+    SPOOL_MAX_BYTES を超えるジョブはスプールしない（画像の保存はコミットされるまでが失われうる範囲）。
+    終了したプロセスのスプールは次回起動時に再実行し、_write_journal で二重適用を防ぐ。
+    スレッドはアイドルが続くと終了し、次の submit で再起動する。
+    """
+    def __init__(self, path, max_batch=64, max_delay=0.005, idle_sec=SHARD_IDLE_SEC):
+        self.path = path; self.max_batch = max_batch; self.max_delay = max_delay; self.idle_sec = idle_sec
+        self.spool_root = os.path.join(os.path.dirname(path) or ".", ".spool", os.path.basename(path))
+        self.spool_dir = None; self._spool_fd = None   # このプロセスのスプール（最初の durable ジョブで作る）
+        self.q = queue.Queue(); self._lock = threading.Lock(); self._thread = None; self._seq = 0
+        self._replay_spool()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name=f"writer:{self.path}", daemon=True)
+        self._thread.start()
+
+    def _own_spool(self):
+        with self._lock:
+            if self.spool_dir is None:
+                os.makedirs(self.spool_root, exist_ok=True)
+                d = os.path.join(self.spool_root, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+                self._spool_fd = _lock_spool(d)   # ロック → ディレクトリの順に作る
+                os.makedirs(d, exist_ok=True)
+                self.spool_dir = d
+            return self.spool_dir
+
+    def _release_spool(self):
+        """空になった自分のスプールとロックを片付ける（ディレクトリ → ロックの順）"""
+        with self._lock:
+            d, fd = self.spool_dir, self._spool_fd
+            if d is None: return
+            try: os.rmdir(d)
+            except OSError: return   # 未コミットのジョブが残っている → 次回起動時に引き取られる
+            self.spool_dir = self._spool_fd = None
+        try: os.remove(d + ".lock")
+        except OSError: pass
+        os.close(fd)
+
+    def _spool(self, job_id, stmts):
+        fn = os.path.join(self._own_spool(), job_id + ".job"); tmp = fn + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(stmts, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, fn)
+        return fn
+
+    def _replay_spool(self):
+        if not os.path.isdir(self.spool_root): return
+        found, dead = [], []
+        for name in os.listdir(self.spool_root):
+            full = os.path.join(self.spool_root, name)
+            if name.endswith(".job"):
+                found.append(full)   # 以前の版の（プロセスで分けていない）スプール
+            elif os.path.isdir(full):
+                if _spool_live(full): continue   # 動いているプロセスの分
+                dead.append(full); found += [os.path.join(full, fn) for fn in os.listdir(full)]
+            elif name.endswith(".tmp") or (name.endswith(".lock") and not os.path.isdir(full[:-5])
+                                           and not _spool_live(full[:-5])):
+                try: os.remove(full)   # 投入前にクラッシュした書きかけ / 片付け途中のロック
+                except OSError: pass
+        for full in sorted(found, key=os.path.basename):   # job_id の先頭は投入時刻
+            fn = os.path.basename(full)
+            if not fn.endswith(".job"):
+                try: os.remove(full)
+                except OSError: pass
+                continue
+            own = os.path.join(self._own_spool(), fn)
+            try: os.rename(full, own)   # 引き取れるのは 1 プロセスだけ
+            except OSError: continue
+            try:
+                with open(own, "rb") as f: stmts = pickle.load(f)
+            except Exception:
+                os.remove(own); continue
+            self._put((fn[:-4], stmts, Future(), own))
+        for d in dead:
+            try: os.rmdir(d); os.remove(d + ".lock")
+            except OSError: pass
+
+    def _put(self, job):
+        with self._lock:
+            self.q.put(job)
+            if self._thread is None or not self._thread.is_alive(): self._start()
+
+    def submit(self, stmts, durable=True) -> Future:
+        stmts = [(sql, tuple(params or ())) for sql, params in stmts]
+        durable = durable and not any(callable(sql) for sql, _ in stmts) and _job_bytes(stmts) <= SPOOL_MAX_BYTES
+        with self._lock:
+            self._seq += 1
+            job_id = f"{time.time_ns():020d}-{self._seq:06d}"
+        fut = Future()
+        self._put((job_id, stmts, fut, self._spool(job_id, stmts) if durable else None))
+        return fut
+
+    def idle(self) -> bool:
+        """ライタースレッドが止まっていて、待っているジョブもない"""
+        with self._lock:
+            return (self._thread is None or not self._thread.is_alive()) and self.q.empty()
+
+    def flush(self, timeout=None):
+        """それまでに投入された書き込みがすべてコミットされるまで待つ"""
+        return self.submit([], durable=False).result(timeout)
+
+    def close(self, timeout=30):
+        with self._lock:
+            th = self._thread
+            if th is not None and th.is_alive(): self.q.put(None)
+            else: th = None
+        if th: th.join(timeout)
+        self._release_spool()
+
+    def _run(self):
+        try:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                init_schema(conn)
+                conn.execute("CREATE TABLE IF NOT EXISTS _write_journal(job TEXT PRIMARY KEY, at REAL)")
+                conn.execute("DELETE FROM _write_journal WHERE at < ?", (time.time() - 7*86400,))
+            except BaseException:
+                conn.close(); raise
+        except Exception as e:   # 開けない・移行できない：待っているジョブに伝え、次の submit でやり直す
+            with self._lock:
+                self._thread = None
+                while True:
+                    try: job = self.q.get_nowait()
+                    except queue.Empty: break
+                    if job is not None: job[2].set_exception(e)
+            return
+        try:
+            while True:
+                try:
+                    job = self.q.get(timeout=self.idle_sec)
+                except queue.Empty:
+                    with self._lock:
+                        if self.q.empty():
+                            self._thread = None; return
+                    continue
+                if job is None: return
+                batch = [job]; stop = False
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    try: nxt = self.q.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty: break
+                    if nxt is None: stop = True; break
+                    batch.append(nxt)
+                try:
+                    self._commit(conn, batch)
+                except Exception as e:   # 想定外の失敗でもスレッドは止めず、未解決の Future に伝える
+                    try: conn.execute("ROLLBACK")
+                    except sqlite3.Error: pass
+                    for _, _, fut, _ in batch:
+                        if not fut.done(): fut.set_exception(e)
+                if stop: return
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch, retries=3):
+        now = time.time_ns()
+        for job_id, _, _, _ in batch:   # job_id の先頭は投入時刻（ns）
+            wait_stats.add("write_queue", max(0, now - int(job_id[:20])) / 1e9)
+        for attempt in range(retries):
+            results = []
+            try:
+                t0 = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                wait_stats.add("sqlite_begin", time.perf_counter() - t0)
+                for job_id, stmts, fut, spool in batch:
+                    if spool and conn.execute("SELECT 1 FROM _write_journal WHERE job=?", (job_id,)).fetchone():
+                        results.append((None, None)); continue   # スプール再実行：適用済み
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        last = None
+                        for sql, params in stmts:
+                            for sql, params in (sql(conn) if callable(sql) else [(sql, params)]):
+                                last = conn.execute(sql, params).lastrowid
+                        if spool: conn.execute("INSERT INTO _write_journal(job, at) VALUES(?,?)", (job_id, time.time()))
+                        conn.execute("RELEASE job")
+                        results.append((last, None))
+                    except Exception as e:   # ジョブ単位の失敗（SQL・引数・関数の例外）は他のジョブを巻き込まない
+                        conn.execute("ROLLBACK TO job"); conn.execute("RELEASE job")
+                        results.append((None, e))
+                conn.execute("COMMIT")
+                break
+            except sqlite3.Error as e:
+                try: conn.execute("ROLLBACK")
+                except sqlite3.Error: pass
+                wait_stats.add("commit_retry", 0.0)
+                if attempt == retries - 1:
+                    # スプールは残す（次回起動時に再実行）
+                    for _, _, fut, _ in batch: fut.set_exception(e)
+                    return
+                time.sleep(0.2 * (attempt + 1))
+        for (job_id, stmts, fut, spool), (last, err) in zip(batch, results):
+            if spool:
+                try: os.remove(spool)
+                except OSError: pass
+            if err is None: fut.set_result(last)
+            else: fut.set_exception(err)
+
+class ShardPool:
+    """ユーザー別 SQLite シャードの接続キャッシュ。
+
+    シャードごとに 1 接続 + ロックを持ち、開いているシャードが上限を超えるか
+    一定時間使われなかったものから閉じる（LRU）。別ユーザー同士は別ファイルなので
+    書き込みロックを奪い合わない。初回の接続（スキーマ移行を含む）もそのシャードのロックだけで行い、
+    プール全体のロックは表の出し入れにしか使わない。ライターも上限を超えたら止まっているものから外す。
+    """
+    def __init__(self, max_open=MAX_OPEN_SHARDS, idle_sec=SHARD_IDLE_SEC):
+        self.max_open = max_open; self.idle_sec = idle_sec
+        self._lock = threading.Lock()
+        self._open = OrderedDict()   # path -> {"conn","lock","used","closed"}
+        self._writers = {}           # path -> WriteQueue（スレッドはアイドルで自動停止）
+
+    def _open_shard(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            init_schema(conn)
+        except BaseException:
+            conn.close(); raise
+        return conn
+
+    def _evict(self, keep):
+        now = time.time()
+        for path, ent in list(self._open.items()):
+            if path == keep: continue
+            over = len(self._open) > self.max_open
+            if not over and now - ent["used"] < self.idle_sec: continue
+            if not ent["lock"].acquire(blocking=False): continue   # 使用中（開いている途中を含む）は閉じない
+            try:
+                ent["closed"] = True
+                if ent["conn"]: ent["conn"].close()
+            finally:
+                ent["lock"].release()
+            del self._open[path]
+
+    @contextmanager
+    def connect(self, path):
+        while True:
+            with self._lock:
+                ent = self._open.get(path)
+                if ent is None:
+                    ent = self._open[path] = {"conn": None, "lock": threading.RLock(), "used": 0.0, "closed": False}
+                self._open.move_to_end(path); ent["used"] = time.time()
+                self._evict(keep=path)
+            t0 = time.perf_counter()
+            with ent["lock"]:
+                wait_stats.add("shard_lock", time.perf_counter() - t0)
+                if ent["closed"]: continue   # 直前に退避された → 開き直す
+                if ent["conn"] is None: ent["conn"] = self._open_shard(path)   # 失敗したら次の connect で開き直す
+                with ent["conn"] as conn:
+                    yield conn
+                return
+
+    def writer(self, path) -> WriteQueue:
+        with self._lock:
+            w = self._writers.pop(path, None)
+            if w is None:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                w = WriteQueue(path)
+            self._writers[path] = w   # 最近使った順（末尾が最新）
+            for p, old in list(self._writers.items()):
+                if len(self._writers) <= self.max_open: break
+                if p != path and old.idle():
+                    del self._writers[p]; old.close()   # スレッドは止まっているので空のスプールを片付けるだけ
+            return w
+
+    def close_all(self):
+        for w in list(self._writers.values()): w.close()   # 終了時に書き込みを流し切る
+        with self._lock:
+            for ent in self._open.values():
+                with ent["lock"]:
+                    ent["closed"] = True
+                    if ent["conn"]: ent["conn"].close()
+            self._open.clear()
+
+# ---------- プロセス共有のプール / スレッドごとの対象 DB ----------
+# プールはプロセスに 1 つ。どの DB を読み書きするかはスレッドごとに use_db() で決める
+# （Streamlit はセッションごとに別スレッドでスクリプトを実行する）。
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+def pool() -> ShardPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ShardPool()
+            atexit.register(_pool.close_all)
+        return _pool
+
+def use_db(path):
+    _local.path = path
+
+def current_db() -> str:
+    return getattr(_local, "path", None) or LEGACY_DB_PATH
+
+def user_db_path(user_key: str) -> str:
+    # 既存の単一 DB はこのユーザーキーに引き継ぐ（例: OUTFITS_LEGACY_USER=user:me@example.com）
+    if user_key == os.environ.get("OUTFITS_LEGACY_USER"): return LEGACY_DB_PATH
+    h = hashlib.sha256(user_key.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(SHARD_DIR, h[:2], f"{h}.db")
+
+def shard_paths():
+    """このホストにある全シャード（旧 DB を含む）"""
+    return sorted(glob.glob(os.path.join(SHARD_DIR, "*", "*.db"))) + \
+           ([LEGACY_DB_PATH] if os.path.exists(LEGACY_DB_PATH) else [])
+
+def db():
+    return pool().connect(current_db())
+
+def write(stmts, durable=True) -> Future:
+    return pool().writer(current_db()).submit(stmts, durable)
+
+def flush(timeout=60):
+    return pool().writer(current_db()).flush(timeout=timeout)
+
+def init_db(path=None):
+    if path: use_db(path)
+    with db():   # 初回接続時にスキーマを作成
+        pass
+
+def json_dumps(x): return json.dumps(x, ensure_ascii=False)
+def content_hash(b): return hashlib.sha256(b).hexdigest()[:32] if b else None
+
+def insert_outfit(d, season, top_sil, bottom_sil, top_color, bottom_color, colors_list, img_bytes, notes, links=(),
+                  color_src=None, color_ver=None, palette=None):
+    """links: [(item_id, region, dist), ...] 写真に写っているクローゼットのアイテム"""
+    stmts = [(f"""INSERT INTO outfits(d,season,top_sil,bottom_sil,top_color,bottom_color,colors,img,notes,img_hash,
+                                      color_src,color_ver,palette,uid,updated_at)
+                  VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,{NEW_UID},{NOW_MS})""",
+              (d, season, top_sil, bottom_sil, top_color, bottom_color, json_dumps(colors_list), img_bytes, notes,
+               content_hash(img_bytes), color_src, color_ver, json_dumps(palette) if palette else None))]
+    # 単一ライターの同一トランザクション内なので MAX(id) が今入れた行
+    stmts += [("""INSERT OR REPLACE INTO outfit_items(outfit_id,item_id,region,dist)
+                  VALUES((SELECT MAX(id) FROM outfits),?,?,?)""", (int(iid), region, float(dist)))
+              for iid, region, dist in links]
+    return write(stmts)
+
+def fetch_outfits_on(day_str):
+    with db() as conn:
+        c = conn.cursor()
+        return c.execute("""SELECT id,d,season,top_sil,bottom_sil,top_color,bottom_color,colors,img,notes
+                            FROM outfits WHERE d=? ORDER BY id DESC""", (day_str,)).fetchall()
+
+def load_profile():
+    with db() as conn:
+        c = conn.cursor()
+        row = c.execute("SELECT season,undertone,home_lat,home_lon,city,body_shape,height_cm FROM profile WHERE id=1").fetchone()
+    return {"season":row[0],"undertone":row[1],"home_lat":row[2],"home_lon":row[3],
+            "city":row[4],"body_shape":row[5],"height_cm":row[6]} if row else \
+           {"season":None,"undertone":None,"home_lat":None,"home_lon":None,"city":None,"body_shape":None,"height_cm":None}
+
+def save_profile(**kwargs):
+    cur = load_profile()
+    cur.update({k:v for k,v in kwargs.items() if v is not None})
+    return write([(f"""INSERT OR REPLACE INTO profile(id,season,undertone,home_lat,home_lon,city,body_shape,height_cm,uid,updated_at)
+                        VALUES(1,?,?,?,?,?,?,?,'profile',{NOW_MS})""",
+                    (cur["season"], cur["undertone"], cur["home_lat"], cur["home_lon"],
+                     cur["city"], cur["body_shape"], cur["height_cm"]))])
+
+def add_item(name, category, color_hex, season_pref, material, img_bytes, notes, color_src=None, color_ver=None,
+             palette=None):
+    return write([(f"""INSERT INTO items(name,category,color_hex,season_pref,material,img,notes,img_hash,color_src,color_ver,
+                                        palette,uid,updated_at)
+                        VALUES(?,?,?,?,?,?,?,?,?,?,?,{NEW_UID},{NOW_MS})""",
+                    (name,category,color_hex,season_pref,material,img_bytes,notes,content_hash(img_bytes),
+                     color_src,color_ver,json_dumps(palette) if palette else None))])
+
+def list_items(category=None, img=True):
+    """img=False なら画像本体は読まず、7 列目は画像の有無（1/0）。本体は load_item_imgs で必要な分だけ読む"""
+    q = f"SELECT id,name,category,color_hex,season_pref,material,{'img' if img else 'img IS NOT NULL'},notes FROM items"
+    params=[]
+    if category and category!="すべて":
+        q += " WHERE category=?"; params=[category]
+    q += " ORDER BY id DESC"
+    with db() as conn:
+        return conn.cursor().execute(q, params).fetchall()
+
+def item_palettes(ids) -> dict:
+    """id -> [(hex, 面積比), ...]（未抽出のアイテムは含まない）"""
+    ids = [int(i) for i in ids if i]; out = {}
+    with db() as conn:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i+500]
+            for iid, p in conn.execute(f"SELECT id, palette FROM items WHERE palette IS NOT NULL AND id IN ({','.join('?'*len(chunk))})", chunk):
+                try: out[iid] = [tuple(x) for x in json.loads(p)]
+                except (ValueError, TypeError): pass
+    return out
+
+def get_item(iid:int):
+    with db() as conn:
+        return conn.cursor().execute(
+            "SELECT id,name,category,color_hex,season_pref,material,img,notes FROM items WHERE id=?",(iid,)
+        ).fetchone()
+
+def update_item(iid:int, name, category, color_hex, season_pref, material, img_bytes_or_none, notes):
+    # 画像未指定なら既存の img を残す（読み出し→書き戻しをしない）
+    # 色を変えたら以後は手動扱い（再解析で上書きしない）。画像だけ差し替えたら再解析の対象に戻す
+    return write([(f"""UPDATE items SET name=?,category=?,color_hex=?,season_pref=?,material=?,img=COALESCE(?,img),notes=?,
+                       img_hash=COALESCE(?,img_hash),updated_at={NOW_MS},
+                       color_src=CASE WHEN color_hex IS ? THEN color_src ELSE 'manual' END,
+                       color_ver=CASE WHEN ? IS NULL THEN color_ver ELSE NULL END,
+                       palette=CASE WHEN ? IS NULL THEN palette ELSE NULL END WHERE id=?""",
+                    (name,category,color_hex,season_pref,material,img_bytes_or_none,notes,
+                     content_hash(img_bytes_or_none),color_hex,content_hash(img_bytes_or_none),
+                     content_hash(img_bytes_or_none),iid))])
+
+def delete_item(iid:int):
+    stmts = [("DELETE FROM items WHERE id=?", (iid,)), ("DELETE FROM outfit_items WHERE item_id=?", (iid,)),
+             ("DELETE FROM item_features WHERE item_id=?", (iid,))]
+    for col in ["top_id","bottom_id","shoes_id","bag_id"]:
+        stmts.append((f"UPDATE coords SET {col}=NULL,updated_at={NOW_MS} WHERE {col}=?", (iid,)))
+    return write(stmts)
+
+def save_coord(top_id, bottom_id, shoes_id, bag_id, ctx:dict, ai_score:float, rating:int|None=None):
+    # rating はユーザー評価（1〜5）。未評価は NULL
+    return write([(f"""INSERT INTO coords(created_at,top_id,bottom_id,shoes_id,bag_id,ctx,score,rating,uid,updated_at)
+                        VALUES(?,?,?,?,?,?,?,?,{NEW_UID},{NOW_MS})""",
+                    (datetime.utcnow().isoformat(), top_id, bottom_id, shoes_id, bag_id, json_dumps(ctx), float(ai_score), rating))])
+
+def rate_coord(coord_id:int, rating:int):
+    return write([(f"UPDATE coords SET rating=?,updated_at={NOW_MS} WHERE id=?", (int(rating), int(coord_id)))])
+
+def save_coords_batch(rows):
+    """[(top_id, bottom_id, shoes_id, bag_id, ctx, score), ...] を 1 トランザクションで保存。
+
+    ctx["plan_date"] のある行はその日の予定（planned=1）として保存し、確定するまで着用に数えない。
+    """
+    now = datetime.utcnow().isoformat()
+    return write([(f"""INSERT INTO coords(created_at,top_id,bottom_id,shoes_id,bag_id,ctx,score,rating,planned,planned_for,uid,updated_at)
+                        VALUES(?,?,?,?,?,?,?,NULL,?,?,{NEW_UID},{NOW_MS})""",
+                   (now, t, b, s, g, json_dumps(ctx), float(sc), int(bool(ctx.get("plan_date"))), ctx.get("plan_date")))
+                  for t, b, s, g, ctx, sc in rows])
+
+def list_planned(until:str):
+    """until（YYYY-MM-DD）までの未確定の予定 [(id, planned_for, top_id, bottom_id, shoes_id, bag_id), ...]"""
+    with db() as conn:
+        return conn.execute("""SELECT id, planned_for, top_id, bottom_id, shoes_id, bag_id FROM coords
+                               WHERE planned=1 AND planned_for<=? ORDER BY planned_for, id""", (until,)).fetchall()
+
+def confirm_coord(coord_id:int, worn=True):
+    """予定を確定する。worn=False（着なかった）なら予定ごと消す"""
+    if worn: return write([(f"UPDATE coords SET planned=0,updated_at={NOW_MS} WHERE id=?", (int(coord_id),))])
+    return write([("DELETE FROM coords WHERE id=? AND planned=1", (int(coord_id),))])
+
+def get_usage_stats():
+    # 保存コーデ（coords。未確定の予定は除く）と、記録写真に紐付けたアイテム（outfit_items）の両方を着用として数える
+    with db() as conn:
+        rows = conn.cursor().execute("SELECT worn_at, top_id, bottom_id, shoes_id, bag_id FROM worn_coords").fetchall()
+        rows += conn.cursor().execute("""SELECT o.d, l.item_id, NULL, NULL, NULL
+                                         FROM outfit_items l JOIN outfits o ON o.id = l.outfit_id""").fetchall()
+    use_count = defaultdict(int); last_used = {}
+    for created_at, t, b, s, g in rows:
+        for iid in [t,b,s,g]:
+            if iid is None: continue
+            use_count[iid] += 1
+            if (iid not in last_used) or (created_at > last_used[iid]): last_used[iid] = created_at
+    return use_count, last_used
+
+def img_hashes(table, ids) -> dict:
+    """id -> 画像の内容ハッシュ。旧データで未計算の行はここで計算して書き戻す"""
+    ids = [int(i) for i in ids]; out = {}; missing = []
+    with db() as conn:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i+500]
+            q = f"SELECT id,img_hash,img IS NOT NULL FROM {table} WHERE id IN ({','.join('?'*len(chunk))})"
+            for iid, h, has_img in conn.execute(q, chunk):
+                if h: out[iid] = h
+                elif has_img: missing.append(iid)
+        for iid in missing:
+            out[iid] = content_hash(conn.execute(f"SELECT img FROM {table} WHERE id=?", (iid,)).fetchone()[0])
+    if missing:
+        write([(f"UPDATE {table} SET img_hash=? WHERE id=? AND img_hash IS NULL", (out[i], i)) for i in missing],
+               durable=False)
+    return out
+
+# ---------- お問い合わせ ----------
+def save_feedback(kind, subject, body, contact, img_bytes, meta:dict, issue=None):
+    """issue=(title, body) なら GitHub Issue の送信待ちも同じトランザクションで outbox に積む"""
+    now = datetime.utcnow().isoformat()
+    stmts = [("""INSERT INTO feedback(created_at,kind,subject,body,contact,img,meta,img_hash)
+                 VALUES(?,?,?,?,?,?,?,?)""",
+              (now, kind, subject, body, contact, img_bytes, json.dumps(meta, ensure_ascii=False), content_hash(img_bytes)))]
+    if issue:
+        stmts.append(("""INSERT INTO outbox(created_at,feedback_id,title,body,status,attempts,next_at)
+                         VALUES(?,(SELECT MAX(id) FROM feedback),?,?,'pending',0,?)""", (now, issue[0], issue[1], time.time())))
+    return write(stmts)
+
+def list_feedback(limit=30):
+    # 添付画像の本体は読まない（有無だけ）。表示時に load_feedback_img で取り出す
+    with db() as conn:
+        c = conn.cursor()
+        return c.execute("""SELECT id,created_at,kind,subject,body,contact,img IS NOT NULL,meta
+                            FROM feedback ORDER BY id DESC LIMIT ?""", (int(limit),)).fetchall()
+
+def load_item_imgs(ids) -> dict:
+    """id -> 画像（bytes）。画像のないアイテムは含まない"""
+    ids = [int(i) for i in ids]; out = {}
+    with db() as conn:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i+500]
+            out.update(conn.execute(f"SELECT id, img FROM items WHERE img IS NOT NULL AND id IN ({','.join('?'*len(chunk))})", chunk))
+    return out
+
+def load_feedback_img(fid:int):
+    with db() as conn:
+        row = conn.execute("SELECT img FROM feedback WHERE id=?", (int(fid),)).fetchone()
+    return row[0] if row else None
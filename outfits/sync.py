@@ -0,0 +1,371 @@
+# outfits/sync.py — リモート（Postgres / Supabase）とのオフラインファースト同期
+#
+# 読み書きは常にローカルの SQLite のまま。同期を有効にしたシャードにだけ変更ログのトリガーを置き
+# （初回の Syncer.sync() が storage.sync_triggers() を作る）、items / outfits / outfit_items /
+# coords / profile の変更を sync_log に同じトランザクションで記録する。ここではそれを
+#   push … 変更ログをまとめ、行の現在値を SYNC_BATCH 件ずつ upsert（画像は内容ハッシュで未アップロード分だけ）
+#   pull … リモートの rev（行の更新ごとに増える通し番号）がカーソルより大きい行を取り込む
+# の順に流す。競合は 更新時刻（ms）→ 端末 ID の順で新しい方が勝つ（last-writer-wins）。
+# リモート側も同じ規則をトリガーで守り、負けた書き込みには勝った行を rev を進めて返す（REMOTE_SCHEMA）。
+#
+# リモートは PostgREST（/rest/v1）と Supabase Storage（/storage/v1）の最小限の API だけを使うので、
+# Supabase でも、素の Postgres + PostgREST でも、検証用のスタンドイン（outfits.syncserver）でも動く。
+#
+#   python -m outfits sync --user user:me@example.com
+#   python -m outfits sync --all-shards
+#   python -m outfits sync-server --port 54321
+#
+# 接続先は OUTFITS_SYNC_URL / OUTFITS_SYNC_KEY（app.py では secrets の SYNC_URL / SYNC_KEY も可）。
+import os, time, random, threading, uuid, hashlib, requests
+from . import storage
+from .storage import SYNC_TABLES, SYNC_REFS, SYNC_VERSION, NOW_MS, sync_triggers, content_hash
+
+SYNC_URL = os.environ.get("OUTFITS_SYNC_URL")
+SYNC_KEY = os.environ.get("OUTFITS_SYNC_KEY")
+SYNC_BUCKET = os.environ.get("OUTFITS_SYNC_BUCKET", "outfits-media")
+SYNC_TABLE = "outfits_sync"
+SYNC_BATCH = 200          # 1 リクエストで送る / 受け取る行数
+SYNC_BLOB_BATCH = 50      # 1 回の同期でダウンロードする画像の上限（残りは次回）
+SYNC_OVERLAP = 50         # pull はカーソルより少し前から読み直す（後からコミットされた rev の取りこぼし対策）
+SYNC_INTERVAL = 30.0      # 秒。変更がなくてもこの間隔で pull する
+SYNC_MIN_INTERVAL = 2.0   # 変更があった時に push するまでの最短間隔
+SYNC_MAX_BACKOFF = 600.0
+APPLY_ORDER = ["profile", "items", "outfits", "outfit_items", "coords"]   # 参照される側から取り込む
+
+REMOTE_SCHEMA = """
+create sequence if not exists outfits_sync_rev;
+create table if not exists outfits_sync(
+  owner text not null, tbl text not null, uid text not null,
+  rev bigint not null default nextval('outfits_sync_rev'),
+  updated_at bigint not null, device text not null, deleted boolean not null default false, data jsonb,
+  primary key(owner, tbl, uid));
+create index if not exists outfits_sync_pull on outfits_sync(owner, rev);
+create or replace function outfits_sync_lww() returns trigger language plpgsql as $$
+begin
+  if (new.updated_at, new.device) < (old.updated_at, old.device) then
+    new := old;   -- 古い書き込みは捨て、rev だけ進めて書いた端末に勝った行を配り直す
+  end if;
+  new.rev := nextval('outfits_sync_rev');
+  return new;
+end $$;
+drop trigger if exists outfits_sync_lww on outfits_sync;
+create trigger outfits_sync_lww before update on outfits_sync for each row execute function outfits_sync_lww();
+-- 画像は Storage の非公開バケット outfits-media に <owner>/<内容ハッシュ> で置く。
+-- キー（service_role）はサーバ側の secrets にだけ置き、ブラウザには渡さない。
+"""
+
+class RestRemote:
+    """PostgREST の upsert / 差分取得と、Storage の画像の有無確認・アップロード・ダウンロード"""
+    def __init__(self, url, key, bucket=SYNC_BUCKET, timeout=30, session=None):
+        self.url = url.rstrip("/"); self.key = key; self.bucket = bucket; self.timeout = timeout
+        self.s = session or requests.Session()
+
+    def _h(self, **extra):
+        return {"apikey": self.key, "Authorization": f"Bearer {self.key}", **extra} if self.key else extra
+
+    def _obj(self, path):
+        return f"{self.url}/storage/v1/object/{self.bucket}/{path}"
+
+    def upsert(self, rows):
+        r = self.s.post(f"{self.url}/rest/v1/{SYNC_TABLE}", params={"on_conflict": "owner,tbl,uid"}, json=rows,
+                        headers=self._h(Prefer="resolution=merge-duplicates,return=minimal"), timeout=self.timeout)
+        r.raise_for_status()
+
+    def changes(self, owner, cursor, limit=SYNC_BATCH) -> list:
+        r = self.s.get(f"{self.url}/rest/v1/{SYNC_TABLE}", headers=self._h(), timeout=self.timeout,
+                       params={"owner": f"eq.{owner}", "rev": f"gt.{cursor}", "order": "rev.asc", "limit": str(limit),
+                               "select": "tbl,uid,rev,updated_at,device,deleted,data"})
+        r.raise_for_status()
+        return r.json()
+
+    def has_blob(self, path) -> bool:
+        r = self.s.head(self._obj(path), headers=self._h(), timeout=self.timeout)
+        if r.status_code in (400, 404): return False   # Storage は未登録を 400 で返すことがある
+        r.raise_for_status()
+        return True
+
+    def put_blob(self, path, data):
+        r = self.s.post(self._obj(path), data=data, timeout=self.timeout,
+                        headers=self._h(**{"Content-Type": "application/octet-stream", "x-upsert": "true"}))
+        r.raise_for_status()
+
+    def get_blob(self, path) -> bytes|None:
+        r = self.s.get(self._obj(path), headers=self._h(), timeout=self.timeout)
+        if r.status_code in (400, 404): return None
+        r.raise_for_status()
+        return r.content
+
+def owner_of(db_path) -> str:
+    """リモートでの持ち主。シャードはファイル名（ユーザーキーのハッシュ）、旧 DB は引き継ぎ先ユーザー"""
+    if os.path.abspath(db_path) == os.path.abspath(storage.LEGACY_DB_PATH):
+        u = os.environ.get("OUTFITS_LEGACY_USER")
+        return hashlib.sha256(u.encode("utf-8")).hexdigest()[:32] if u else "legacy"   # シャードと同じ名前
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+def _in(xs):
+    return ",".join("?" * len(xs))
+
+# ---------- シャード 1 つ分の push / pull ----------
+class Syncer:
+    def __init__(self, db_path, remote, owner=None):
+        self.path = db_path; self.remote = remote; self.owner = owner or owner_of(db_path)
+        self.writer = storage.pool().writer(db_path)
+        self._missing_blobs = set()   # リモートにない画像（このプロセスでは取りに行かない）
+
+    def _read(self, sql, params=()):
+        with storage.pool().connect(self.path) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def _state(self, k):
+        row = self._read("SELECT v FROM sync_state WHERE k=?", (k,))
+        return row[0][0] if row else None
+
+    def device(self) -> str:
+        dev = self._state("device")
+        if dev is None:
+            self.writer.submit([("INSERT OR IGNORE INTO sync_state(k, v) VALUES('device', ?)", (uuid.uuid4().hex,))]).result(60)
+            dev = self._state("device")
+        return dev
+
+    def pending(self) -> int:
+        return self._read("SELECT COUNT(DISTINCT tbl || uid) FROM sync_log")[0][0]
+
+    def _seed(self):
+        """同期を有効にする：変更ログのトリガーを置き、初回はそれまでの行を全部ログに積む。
+
+        トリガーの作成とログの初期化は同じトランザクションなので、その間の書き込みも取りこぼさない。
+        """
+        seeded = self._state("seeded")
+        if seeded == SYNC_VERSION: return
+        stmts = []
+        if seeded is None:   # 画像の未計算ハッシュもここで埋める（トリガーを置く前なのでログは重複しない）
+            stmts.append(("UPDATE profile SET uid='profile' WHERE uid IS NULL", ()))
+            for t in ("items", "outfits"):
+                for iid, img in self._read(f"SELECT id, img FROM {t} WHERE img IS NOT NULL AND img_hash IS NULL"):
+                    stmts.append((f"UPDATE {t} SET img_hash=? WHERE id=?", (content_hash(img), iid)))
+        for name, sql in sync_triggers().items():   # 版が変わったトリガーは作り直す
+            stmts += [(f"DROP TRIGGER IF EXISTS {name}", ()), (sql, ())]
+        if seeded is None:
+            for t in SYNC_TABLES:
+                stmts.append((f"INSERT INTO sync_log(tbl, uid, op) SELECT '{t}', uid, 'upsert' FROM {t} WHERE uid IS NOT NULL", ()))
+            stmts.append(("""INSERT INTO sync_log(tbl, uid, op) SELECT 'outfit_items', o.uid || ':' || i.uid, 'upsert'
+                             FROM outfit_items l JOIN outfits o ON o.id=l.outfit_id JOIN items i ON i.id=l.item_id""", ()))
+        elif seeded == "2":   # v3 で coords に planned / planned_for が増えた。予定の行は新しい時刻で送り直す
+            stmts += [(f"UPDATE coords SET updated_at={NOW_MS} WHERE planned=1", ()),
+                      ("INSERT INTO sync_log(tbl, uid, op) SELECT 'coords', uid, 'upsert' FROM coords WHERE planned=1 AND uid IS NOT NULL", ())]
+        stmts.append(("INSERT OR REPLACE INTO sync_state(k, v) VALUES('seeded', ?)", (SYNC_VERSION,)))
+        self.writer.submit(stmts).result(300)
+
+    # ---- push ----
+    def _rows(self, t, uids) -> dict:
+        """uid -> 送る data（ローカルにない uid は含まない）"""
+        out = {}
+        for i in range(0, len(uids), 500):
+            chunk = uids[i:i+500]
+            if t == "outfit_items":
+                q = f"""SELECT o.uid || ':' || i.uid, l.region, l.dist FROM outfit_items l
+                        JOIN outfits o ON o.id=l.outfit_id JOIN items i ON i.id=l.item_id
+                        WHERE o.uid || ':' || i.uid IN ({_in(chunk)})"""
+                for uid, region, dist in self._read(q, chunk):
+                    out[uid] = (None, {"region": region, "dist": dist})
+                continue
+            cols = SYNC_TABLES[t]
+            sel = [f"(SELECT uid FROM items WHERE id={t}.{c})" if c in SYNC_REFS.get(t, ()) else c for c in cols]
+            for row in self._read(f"SELECT uid, updated_at, {','.join(sel)} FROM {t} WHERE uid IN ({_in(chunk)})", chunk):
+                out[row[0]] = (row[1], dict(zip(cols, row[2:])))
+        return out
+
+    def _upload_blobs(self, hashes) -> list:
+        known = {r[0] for r in self._read(f"SELECT h FROM sync_blobs WHERE h IN ({_in(hashes)})", hashes)} if hashes else set()
+        done = []
+        for h in hashes:
+            if h in known: continue
+            path = f"{self.owner}/{h}"
+            if not self.remote.has_blob(path):
+                blob = None
+                for t in ("items", "outfits"):
+                    row = self._read(f"SELECT img FROM {t} WHERE img_hash=? AND img IS NOT NULL LIMIT 1", (h,))
+                    if row: blob = row[0][0]; break
+                if blob is None: continue
+                self.remote.put_blob(path, blob)
+            done.append(h)
+        return done
+
+    def push(self) -> dict:
+        hi = self._read("SELECT MAX(seq) FROM sync_log")[0][0]
+        if hi is None: return {"pushed": 0, "blobs_up": 0}
+        log = self._read("""SELECT tbl, uid, op FROM sync_log WHERE seq IN
+                            (SELECT MAX(seq) FROM sync_log WHERE seq<=? GROUP BY tbl, uid) ORDER BY seq""", (hi,))
+        dev = self.device(); now = int(time.time() * 1000)
+        by_tbl = {}
+        for t, uid, op in log: by_tbl.setdefault(t, []).append((uid, op))
+        rows = []; hashes = []
+        for t in APPLY_ORDER:
+            ents = by_tbl.get(t, [])
+            cur = self._rows(t, [uid for uid, op in ents if op == "upsert"])
+            for uid, op in ents:
+                if op == "upsert" and uid in cur:
+                    ts, data = cur[uid]
+                    rows.append({"owner": self.owner, "tbl": t, "uid": uid, "updated_at": ts or now, "device": dev,
+                                 "deleted": False, "data": data})
+                    if data.get("img_hash"): hashes.append(data["img_hash"])
+                else:   # 削除、またはログの後で消えた行
+                    rows.append({"owner": self.owner, "tbl": t, "uid": uid, "updated_at": now, "device": dev,
+                                 "deleted": True, "data": None})
+        uploaded = self._upload_blobs(list(dict.fromkeys(hashes)))   # 行より先に画像を置く（取り込み側が参照できるように）
+        for i in range(0, len(rows), SYNC_BATCH):
+            self.remote.upsert(rows[i:i+SYNC_BATCH])
+        self.writer.submit([("DELETE FROM sync_log WHERE seq<=?", (hi,))] +
+                           [("INSERT OR IGNORE INTO sync_blobs(h) VALUES(?)", (h,)) for h in uploaded]).result(60)
+        return {"pushed": len(rows), "blobs_up": len(uploaded)}
+
+    # ---- pull ----
+    def _apply_stmts(self, r) -> list:
+        t, uid, data = r["tbl"], r["uid"], r["data"] or {}
+        if t == "outfit_items":
+            ou, iu = uid.split(":", 1)
+            if r["deleted"]:
+                return [("""DELETE FROM outfit_items WHERE outfit_id=(SELECT id FROM outfits WHERE uid=?)
+                            AND item_id=(SELECT id FROM items WHERE uid=?)""", (ou, iu))]
+            return [("""INSERT OR REPLACE INTO outfit_items(outfit_id, item_id, region, dist)
+                        SELECT o.id, i.id, ?, ? FROM outfits o, items i WHERE o.uid=? AND i.uid=?""",
+                     (data.get("region"), data.get("dist"), ou, iu))]
+        if r["deleted"]:
+            if t == "items":   # storage.delete_item と同じ後始末
+                sub = "(SELECT id FROM items WHERE uid=?)"
+                return [(f"DELETE FROM outfit_items WHERE item_id={sub}", (uid,)), (f"DELETE FROM item_features WHERE item_id={sub}", (uid,))] + \
+                       [(f"UPDATE coords SET {c}=NULL WHERE {c}={sub}", (uid,)) for c in SYNC_REFS["coords"]] + \
+                       [("DELETE FROM items WHERE uid=?", (uid,))]
+            if t == "outfits":
+                return [("DELETE FROM outfit_items WHERE outfit_id=(SELECT id FROM outfits WHERE uid=?)", (uid,)),
+                        ("DELETE FROM outfits WHERE uid=?", (uid,))]
+            return [(f"DELETE FROM {t} WHERE uid=?", (uid,))]
+        cols = SYNC_TABLES[t]
+        vals = ["(SELECT id FROM items WHERE uid=?)" if c in SYNC_REFS.get(t, ()) else "?" for c in cols]
+        sets = [f"{c}=excluded.{c}" for c in cols + ["updated_at"]]
+        if "img_hash" in cols:   # 画像が変わったら本体は後でダウンロードし直す
+            sets.append(f"img=CASE WHEN {t}.img_hash IS excluded.img_hash THEN {t}.img ELSE NULL END")
+        key, key_cols, key_vals = ("id", "id, ", "1, ") if t == "profile" else ("uid", "", "")
+        return [(f"""INSERT INTO {t}({key_cols}uid, updated_at, {','.join(cols)}) VALUES({key_vals}?, ?, {','.join(vals)})
+                     ON CONFLICT({key}) DO UPDATE SET {','.join(sets)}""",
+                 (uid, r["updated_at"], *[data.get(c) for c in cols]))]
+
+    def pull(self) -> dict:
+        cursor = int(self._state("cursor") or 0); start = max(0, cursor - SYNC_OVERLAP); got = {}
+        while True:
+            page = self.remote.changes(self.owner, start, SYNC_BATCH)
+            for r in page: got[(r["tbl"], r["uid"])] = r   # 同じ行は最後（最大 rev）だけ
+            if page: start = page[-1]["rev"]
+            if len(page) < SYNC_BATCH: break
+        head = max([cursor] + [r["rev"] for r in got.values()])
+        dev = self.device(); now = int(time.time() * 1000)
+        pending = {}   # 未送信のローカル変更 -> 更新時刻（行がない = 削除は今とみなす）
+        for t, uid, ts in self._read("""SELECT l.tbl, l.uid, MAX(CASE l.tbl WHEN 'items' THEN (SELECT updated_at FROM items WHERE uid=l.uid)
+                                               WHEN 'outfits' THEN (SELECT updated_at FROM outfits WHERE uid=l.uid)
+                                               WHEN 'coords' THEN (SELECT updated_at FROM coords WHERE uid=l.uid)
+                                               WHEN 'profile' THEN (SELECT updated_at FROM profile WHERE id=1) END)
+                                        FROM sync_log l GROUP BY l.tbl, l.uid"""):
+            pending[(t, uid)] = ts or now
+        stmts = []; applied = 0
+        for r in sorted(got.values(), key=lambda r: (APPLY_ORDER.index(r["tbl"]) if r["tbl"] in APPLY_ORDER else 99, r["rev"])):
+            if r["tbl"] not in APPLY_ORDER or r["device"] == dev and (r["tbl"], r["uid"]) not in pending:
+                continue   # 自分の書き込みが戻ってきただけ
+            k = (r["tbl"], r["uid"])
+            if k in pending:
+                if (pending[k], dev) > (r["updated_at"], r["device"]): continue   # 未送信のローカル変更が新しい
+                stmts.append(("DELETE FROM sync_log WHERE tbl=? AND uid=?", k))   # リモートが勝ったので送らない
+            stmts += self._apply_stmts(r); applied += 1
+        if stmts or head != cursor:
+            self.writer.submit([("UPDATE sync_state SET v='1' WHERE k='applying'", ())] + stmts +
+                               [("UPDATE sync_state SET v='0' WHERE k='applying'", ()),
+                                ("INSERT OR REPLACE INTO sync_state(k, v) VALUES('cursor', ?)", (str(head),))]).result(300)
+        return {"pulled": applied, "blobs_down": self._fetch_blobs()}
+
+    def _fetch_blobs(self) -> int:
+        n = 0; stmts = []
+        for t in ("items", "outfits"):
+            for iid, h in self._read(f"SELECT id, img_hash FROM {t} WHERE img IS NULL AND img_hash IS NOT NULL LIMIT ?",
+                                     (SYNC_BLOB_BATCH,)):
+                if h in self._missing_blobs: continue
+                data = self.remote.get_blob(f"{self.owner}/{h}")
+                if data is None or content_hash(data) != h:
+                    self._missing_blobs.add(h); continue
+                stmts.append((f"UPDATE {t} SET img=? WHERE id=? AND img_hash=? AND img IS NULL", (data, iid, h)))
+                stmts.append(("INSERT OR IGNORE INTO sync_blobs(h) VALUES(?)", (h,)))
+                n += 1
+        if stmts: self.writer.submit(stmts, durable=False).result(300)
+        return n
+
+    def sync(self) -> dict:
+        self._seed()
+        out = self.push()
+        out.update(self.pull())
+        return out
+
+# ---------- バックグラウンド同期（プロセスに 1 つ） ----------
+class SyncService:
+    """touch() されたシャードを、変更があれば SYNC_MIN_INTERVAL、なければ SYNC_INTERVAL ごとに同期する。
+
+    失敗したら間隔を倍にして再試行（上限 SYNC_MAX_BACKOFF）。しばらく touch されないシャードは
+    最後に 1 回同期して外す。close() は未送信の変更を送ってから止まる。
+    """
+    def __init__(self, remote, interval=SYNC_INTERVAL, idle_sec=storage.SHARD_IDLE_SEC):
+        self.remote = remote; self.interval = interval; self.idle_sec = idle_sec
+        self._lock = threading.Lock(); self._wake = threading.Event(); self._stop = False
+        self._shards = {}   # path -> {"syncer","touched","last","next","fails","error","stats","ok_at"}
+        self._thread = threading.Thread(target=self._run, name="sync", daemon=True)
+        self._thread.start()
+
+    def touch(self, db_path, now=False):
+        with self._lock:
+            ent = self._shards.get(db_path)
+            if ent is None:
+                ent = self._shards[db_path] = {"syncer": Syncer(db_path, self.remote), "last": 0.0, "next": 0.0,
+                                               "fails": 0, "error": None, "stats": None, "ok_at": None}
+            ent["touched"] = time.time()
+            if now: ent["next"] = 0.0
+        self._wake.set()
+
+    def status(self, db_path) -> dict:
+        with self._lock:
+            ent = self._shards.get(db_path)
+            if ent is None: return {}
+            out = {k: ent[k] for k in ("ok_at", "error", "stats", "fails")}
+        try: out["pending"] = ent["syncer"].pending()
+        except Exception: out["pending"] = None
+        return out
+
+    def close(self, timeout=30):
+        self._stop = True; self._wake.set(); self._thread.join(timeout)
+
+    def _due(self, ent, now):
+        if now < ent["next"]: return False
+        if now - ent["last"] >= self.interval: return True
+        return now - ent["last"] >= SYNC_MIN_INTERVAL and ent["syncer"].pending() > 0
+
+    def _sync(self, path, ent):
+        ent["last"] = time.time()
+        try:
+            ent["stats"] = ent["syncer"].sync()
+            ent["fails"] = 0; ent["error"] = None; ent["ok_at"] = time.time(); ent["next"] = 0.0
+        except Exception as e:
+            ent["fails"] += 1; ent["error"] = f"{type(e).__name__}: {e}"
+            ent["next"] = time.time() + min(self.interval * 2**ent["fails"], SYNC_MAX_BACKOFF) * random.uniform(0.8, 1.2)
+
+    def _run(self):
+        while not self._stop:
+            self._wake.clear()   # 確認の前に下ろす（確認中の touch() は次の wait で拾う）
+            now = time.time()
+            with self._lock: shards = list(self._shards.items())
+            for path, ent in shards:
+                if self._stop: break
+                idle = now - ent["touched"] > self.idle_sec
+                if idle or self._due(ent, now): self._sync(path, ent)
+                if idle:
+                    with self._lock: self._shards.pop(path, None)
+            self._wake.wait(SYNC_MIN_INTERVAL)
+        for path, ent in list(self._shards.items()):   # 終了時に未送信分を送る
+            try:
+                if ent["syncer"].pending(): ent["syncer"].push()
+            except Exception:
+                pass
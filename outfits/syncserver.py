@@ -0,0 +1,133 @@
+# outfits/syncserver.py — 同期の検証用スタンドイン（PostgREST + Storage の必要な部分だけ）
+#
+# outfits.sync が使う 5 つの呼び出しを、本番と同じ規則（rev の採番、last-writer-wins、
+# 負けた書き込みには rev を進めて勝った行を返す）で SQLite 1 ファイルに実装する。
+# Supabase を用意しなくても、複数端末の同期・競合・画像の重複排除を手元で試せる。
+#
+#   python -m outfits sync-server --port 54321 --key dev
+#   OUTFITS_SYNC_URL=http://127.0.0.1:54321 OUTFITS_SYNC_KEY=dev python -m outfits sync --user user:a@example.com
+import json, os, sqlite3, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+SERVER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outfits_sync(
+  owner TEXT, tbl TEXT, uid TEXT, rev INTEGER, updated_at INTEGER, device TEXT, deleted INTEGER, data TEXT,
+  PRIMARY KEY(owner, tbl, uid));
+CREATE INDEX IF NOT EXISTS outfits_sync_pull ON outfits_sync(owner, rev);
+CREATE TABLE IF NOT EXISTS blobs(path TEXT PRIMARY KEY, data BLOB);
+"""
+
+class StandInServer:
+    """ThreadingHTTPServer を別スレッドで動かす。url 属性を OUTFITS_SYNC_URL に渡す"""
+    def __init__(self, host="127.0.0.1", port=0, path=":memory:", key=None):
+        self.key = key; self._lock = threading.Lock()
+        if path != ":memory:": os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.executescript(SERVER_SCHEMA)
+        self.httpd = ThreadingHTTPServer((host, port), _handler(self))
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="sync-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown(); self.httpd.server_close()
+        if self._thread: self._thread.join(5)
+
+    # ---- PostgREST 相当 ----
+    def upsert(self, rows):
+        with self._lock:
+            c = self.conn
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                for r in rows:
+                    key = (r["owner"], r["tbl"], r["uid"])
+                    rev = (c.execute("SELECT MAX(rev) FROM outfits_sync").fetchone()[0] or 0) + 1
+                    old = c.execute("SELECT updated_at, device FROM outfits_sync WHERE owner=? AND tbl=? AND uid=?", key).fetchone()
+                    if old and (r["updated_at"], r["device"]) < tuple(old):
+                        c.execute("UPDATE outfits_sync SET rev=? WHERE owner=? AND tbl=? AND uid=?", (rev, *key))
+                        continue
+                    c.execute("INSERT OR REPLACE INTO outfits_sync VALUES(?,?,?,?,?,?,?,?)",
+                              (*key, rev, r["updated_at"], r["device"], int(bool(r.get("deleted"))),
+                               None if r.get("data") is None else json.dumps(r["data"], ensure_ascii=False)))
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK"); raise
+
+    def changes(self, owner, cursor, limit):
+        with self._lock:
+            rows = self.conn.execute("""SELECT tbl, uid, rev, updated_at, device, deleted, data FROM outfits_sync
+                                        WHERE owner=? AND rev>? ORDER BY rev LIMIT ?""", (owner, cursor, limit)).fetchall()
+        return [{"tbl": t, "uid": u, "rev": rv, "updated_at": ts, "device": dv, "deleted": bool(dl),
+                 "data": None if d is None else json.loads(d)} for t, u, rv, ts, dv, dl, d in rows]
+
+    # ---- Storage 相当 ----
+    def get_blob(self, path):
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM blobs WHERE path=?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def put_blob(self, path, data):
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO blobs(path, data) VALUES(?,?)", (path, data))
+
+def _handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args): pass
+
+        def _send(self, code, body=b"", ctype="application/json", head=False):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype); self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if not head: self.wfile.write(body)
+
+        def _route(self):
+            if server.key and self.headers.get("apikey") != server.key:
+                self._send(401, b'{"message":"invalid api key"}'); return None
+            u = urlsplit(self.path)
+            if u.path == "/rest/v1/outfits_sync": return ("rest", parse_qs(u.query))
+            pre = "/storage/v1/object/"
+            if u.path.startswith(pre):
+                bucket, _, path = unquote(u.path[len(pre):]).partition("/")
+                return ("blob", f"{bucket}/{path}")
+            self._send(404, b'{"message":"not found"}'); return None
+
+        def do_GET(self, head=False):
+            r = self._route()
+            if r is None: return
+            if r[0] == "blob":
+                data = server.get_blob(r[1])
+                if data is None: self._send(404, b'{"message":"Object not found"}', head=head)
+                else: self._send(200, data, "application/octet-stream", head=head)
+                return
+            q = {k: v[0] for k, v in r[1].items()}
+            owner = q.get("owner", "eq.")[3:]; cursor = int(q.get("rev", "gt.0")[3:]); limit = int(q.get("limit", "1000"))
+            self._send(200, json.dumps(server.changes(owner, cursor, limit), ensure_ascii=False).encode("utf-8"))
+
+        def do_HEAD(self):
+            self.do_GET(head=True)
+
+        def do_POST(self):
+            r = self._route()
+            if r is None: return
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if r[0] == "blob":
+                server.put_blob(r[1], body); self._send(200, b'{"Key":"ok"}'); return
+            rows = json.loads(body or b"[]")
+            server.upsert(rows if isinstance(rows, list) else [rows])
+            self._send(201)
+    return Handler
+
+def serve(host="127.0.0.1", port=54321, path=":memory:", key=None):
+    srv = StandInServer(host, port, path, key)
+    print(f"sync stand-in: {srv.url}", flush=True)
+    try:
+        srv.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.httpd.server_close()
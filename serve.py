@@ -0,0 +1,7 @@
+# serve.py — 起動用。app.py に画像配信ルート（/m/<name>、長期キャッシュ・署名付き）を足して動かす
+#
+#   streamlit run serve.py          # または uvicorn serve:app --port 8501
+import streamlit as st
+from outfits.media import media_routes
+
+app = st.App("app.py", routes=media_routes())
@@ -0,0 +1,51 @@
+# tests/test_backup.py — アーカイブの取り込み（アップロードされた中身を実行しない）
+import json, zipfile
+import pytest
+from outfits import storage, backup
+
+@pytest.fixture
+def src(tmp_path):
+    path = str(tmp_path / "src.db")
+    storage.init_db(path); storage.use_db(path)
+    iid = storage.add_item("白シャツ", "トップス", "#ffffff", None, "綿", b"\xff\xd8\xffimg", "").result(30)
+    storage.save_coord(iid, None, None, None, {}, 50).result(30)
+    yield path
+    storage.pool().close_all()
+
+def q(path, sql, params=()):
+    with storage.pool().connect(path) as conn:
+        return conn.execute(sql, params).fetchall()
+
+def tamper(path, out):
+    """manifest に SQL・列名・テーブルを仕込み、行にも余計なキーを足したアーカイブ"""
+    with zipfile.ZipFile(path) as zin, zipfile.ZipFile(out, "w") as zout:
+        for info in zin.infolist():
+            data = zin.read(info)
+            if info.filename == "manifest.json":
+                m = json.loads(data)
+                m["tables"]["items"]["sql"] = "CREATE TABLE items(x); DROP TABLE coords"
+                m["tables"]["items"]["columns"].append("evil TEXT); DROP TABLE coords; --")
+                m["tables"]["evil"] = {"rows": 0, "columns": [], "sql": "CREATE TABLE evil(x)"}
+                data = json.dumps(m).encode()
+            elif info.filename == "rows/items.jsonl":
+                data = b"".join(json.dumps({**json.loads(l), "evil": 1, "img_sha256": "../x"}).encode() + b"\n"
+                                for l in data.splitlines())
+            zout.writestr(info, data)
+
+def test_import_ignores_archive_schema(src, tmp_path):
+    arc, bad, dst = str(tmp_path / "a.zip"), str(tmp_path / "bad.zip"), str(tmp_path / "dst.db")
+    backup.export_archive(src, arc); tamper(arc, bad)
+    stats = backup.import_archive(bad, dst)
+    assert stats["items"]["inserted"] == 1 and stats["coords"]["inserted"] == 1
+    names = {r[0] for r in q(dst, "SELECT name FROM sqlite_master WHERE type='table'")}
+    assert "coords" in names and "evil" not in names
+    assert "evil" not in [r[1] for r in q(dst, "PRAGMA table_info(items)")]
+    assert q(dst, "SELECT img IS NULL FROM items") == [(1,)]   # 不正なハッシュの画像は読まない
+
+def test_reimport_dedupes(src, tmp_path):
+    arc, dst = str(tmp_path / "a.zip"), str(tmp_path / "dst.db")
+    backup.export_archive(src, arc)
+    backup.import_archive(arc, dst)
+    stats = backup.import_archive(arc, dst)
+    assert stats["items"] == {"inserted": 0, "deduped": 0, "skipped": 1}
+    assert q(dst, "SELECT COUNT(*) FROM items") == [(1,)] and q(dst, "SELECT COUNT(*) FROM coords") == [(1,)]
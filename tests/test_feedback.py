@@ -0,0 +1,149 @@
+# tests/test_feedback.py — GitHub Issue の outbox 配送をスタブ HTTP サーバーで確かめる
+import json, threading, time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from outfits import storage, feedback
+
+class Stub:
+    """POST /repos/<repo>/issues に、用意した応答 (status, headers, delay) を順に返す"""
+    def __init__(self):
+        self.script = []; self.hits = 0
+        stub = self
+        class H(BaseHTTPRequestHandler):
+            def log_message(self, *a): pass
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                code, headers, delay = stub.script.pop(0) if stub.script else (201, {}, 0)
+                stub.hits += 1
+                if delay: time.sleep(delay)
+                body = json.dumps({"html_url": f"https://github.test/issues/{stub.hits}"} if code == 201
+                                  else {"message": "API rate limit exceeded" if code in (403, 429) else "error"}).encode()
+                try:
+                    self.send_response(code)
+                    for k, v in headers.items(): self.send_header(k, v)
+                    self.send_header("Content-Length", str(len(body))); self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass   # タイムアウトでクライアントが切った
+        self.srv = ThreadingHTTPServer(("127.0.0.1", 0), H)
+        self.url = f"http://127.0.0.1:{self.srv.server_address[1]}"
+        threading.Thread(target=self.srv.serve_forever, daemon=True).start()
+    def stop(self):
+        self.srv.shutdown(); self.srv.server_close()
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(feedback, "OUTBOX_MIN_INTERVAL", 0)
+    monkeypatch.setattr(feedback, "OUTBOX_BASE_DELAY", 0)
+    s = Stub()
+    yield s
+    s.stop()
+
+@pytest.fixture
+def shard(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "SHARD_DIR", str(tmp_path / "users"))
+    monkeypatch.setattr(storage, "LEGACY_DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setattr(feedback, "LEGACY_OUTBOX_PATH", str(tmp_path / "outbox.db"))
+    path = str(tmp_path / "users" / "ab" / "ab.db")
+    storage.init_db(path); storage.use_db(path)
+    yield path
+    storage.pool().close_all()
+
+def submit(n=1):
+    for i in range(n):
+        storage.save_feedback("不具合", f"件名{i}", "本文", "", None, {}, issue=(f"title{i}", "body")).result(30)
+
+def rows(path):
+    with storage.pool().connect(path) as conn:
+        return conn.execute("SELECT status, attempts, result, last_error FROM outbox ORDER BY id").fetchall()
+
+def outbox(stub, **kw):
+    return feedback.FeedbackOutbox("o/r", "t", api=stub.url, start=False, **kw)
+
+def test_feedback_and_outbox_commit_together(shard):
+    submit()
+    with storage.pool().connect(shard) as conn:
+        fid = conn.execute("SELECT id FROM feedback").fetchone()[0]
+        assert conn.execute("SELECT feedback_id, status FROM outbox").fetchall() == [(fid, "pending")]
+
+def test_created(shard, stub):
+    submit(2)
+    ob = outbox(stub)
+    ob.watch(shard)
+    assert ob._step() == 0.0
+    assert [r[:3] for r in rows(shard)] == [("sent", 1, "https://github.test/issues/1"), ("sent", 1, "https://github.test/issues/2")]
+    assert ob._step() is None   # 送るものがなくなれば watch() まで眠る
+    with storage.pool().connect(shard) as conn:
+        fid = conn.execute("SELECT MIN(id) FROM feedback").fetchone()[0]
+    assert ob.status(shard, [fid])[fid]["status"] == "sent"
+
+@pytest.mark.parametrize("code", [403, 429])
+@pytest.mark.parametrize("retry_after", ["30", "date"])
+def test_rate_limited(shard, stub, code, retry_after):
+    submit(2)
+    v = formatdate(time.time() + 30, usegmt=True) if retry_after == "date" else retry_after
+    stub.script = [(code, {"Retry-After": v}, 0)]
+    ob = outbox(stub)
+    ob.watch(shard)
+    ob._step()
+    # 試行回数は数えず、残りの行も送らずに待つ
+    assert stub.hits == 1
+    assert [r[:2] for r in rows(shard)] == [("pending", 0), ("pending", 0)]
+    assert 20 < ob._step() <= 31
+
+def test_retry_after_unparseable():
+    assert feedback._retry_after("soon") is None
+    assert feedback._retry_after("0") == 0.0
+    assert feedback._retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0   # 過去の日時
+
+def test_unparseable_retry_after_backs_off(shard, stub):
+    submit()
+    stub.script = [(503, {"Retry-After": "soon"}, 0)]
+    ob = outbox(stub)
+    ob.watch(shard); ob._step()
+    assert rows(shard)[0][:2] == ("pending", 1)
+
+def test_server_error_backs_off_then_fails(shard, stub, monkeypatch):
+    monkeypatch.setattr(feedback, "OUTBOX_MAX_ATTEMPTS", 3)
+    submit()
+    stub.script = [(502, {}, 0)] * 3
+    ob = outbox(stub)
+    ob.watch(shard)
+    for n in (1, 2):
+        ob._step()
+        assert rows(shard)[0][:2] == ("pending", n)
+        assert rows(shard)[0][3] == "HTTP 502"
+    ob._step()
+    assert rows(shard)[0][:2] == ("failed", 3)
+    assert ob._step() is None
+
+def test_slow_api_times_out(shard, stub):
+    submit(2)
+    stub.script = [(201, {}, 2)]
+    ob = outbox(stub, timeout=0.3)
+    ob.watch(shard)
+    t0 = time.monotonic(); ob._step()
+    assert time.monotonic() - t0 < 1.5   # 遅い応答を待ち続けず、次の行に進む
+    (s1, a1, _, err), (s2, a2, url, _) = rows(shard)
+    assert (s1, a1) == ("pending", 1) and "timed out" in err.lower()
+    assert (s2, a2) == ("sent", 1) and url
+
+def test_worker_delivers_after_watch(shard, stub):
+    ob = feedback.FeedbackOutbox("o/r", "t", api=stub.url)
+    try:
+        time.sleep(0.2)   # 起動時の走査を終えて眠っている
+        submit(); ob.watch(shard)
+        for _ in range(50):
+            if rows(shard)[0][0] == "sent": break
+            time.sleep(0.1)
+        assert rows(shard)[0][0] == "sent"
+    finally:
+        ob.close()
+
+def test_scan_resumes_interrupted(shard, stub):
+    submit()
+    storage.write([("UPDATE outbox SET status='sending'", ())]).result(30)
+    ob = outbox(stub)
+    ob._step()   # watch() なしでも起動時の走査で見つける
+    assert rows(shard)[0][0] == "sent"
@@ -0,0 +1,73 @@
+# tests/test_storage.py — 書き込みキュー（ライタースレッド 1 本）の失敗の扱い
+import pytest
+from outfits import storage
+
+@pytest.fixture
+def shard(tmp_path):
+    path = str(tmp_path / "a.db")
+    storage.init_db(path)
+    yield path
+    storage.pool().close_all()
+
+def q(path, sql, params=()):
+    with storage.pool().connect(path) as conn:
+        return conn.execute(sql, params).fetchall()
+
+def test_raising_job_does_not_stop_writer(shard):
+    w = storage.pool().writer(shard)
+    def boom(conn):
+        conn.execute("INSERT INTO feedback(created_at,kind,subject,body) VALUES('x','c','rolled back','')")
+        raise ValueError("boom")
+    bad = w.submit([(boom, ())])
+    ok = w.submit([("INSERT INTO feedback(created_at,kind,subject,body) VALUES('x','c','kept','')", ())])
+    with pytest.raises(ValueError): bad.result(30)
+    assert ok.result(30)
+    assert q(shard, "SELECT subject FROM feedback") == [("kept",)]   # 失敗したジョブの途中の書き込みは残らない
+    assert w._thread is not None and w._thread.is_alive()
+
+def test_malformed_job_fails_only_itself(shard):
+    w = storage.pool().writer(shard)
+    bad = w.submit([(lambda conn: [("INSERT INTO feedback(kind) VALUES(?)",)], ())])   # 引数の欠けた文 → TypeError
+    ok = w.submit([("INSERT INTO feedback(created_at,kind,subject,body) VALUES('x','c','kept','')", ())], durable=False)
+    with pytest.raises(Exception): bad.result(30)
+    assert ok.result(30)
+    assert q(shard, "SELECT subject FROM feedback") == [("kept",)]
+
+def test_add_column_only_ignores_duplicates(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "b.db")
+    a = sqlite3.connect(path, timeout=0.1); a.execute("CREATE TABLE t(x)"); a.commit()
+    assert storage._add_column(a.cursor(), "t", "y TEXT") is True
+    assert storage._add_column(a.cursor(), "t", "y TEXT") is False
+    b = sqlite3.connect(path, timeout=5, isolation_level=None); b.execute("BEGIN EXCLUSIVE")
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="locked"):   # 列が欠けたまま進まない
+            storage._add_column(a.cursor(), "t", "z TEXT")
+    finally:
+        b.execute("ROLLBACK"); b.close(); a.close()
+
+def test_slow_open_does_not_block_other_shards(tmp_path, monkeypatch):
+    import threading, time
+    slow, fast = str(tmp_path / "slow.db"), str(tmp_path / "fast.db")
+    storage.init_db(fast)
+    init = storage.init_schema; started = threading.Event()
+    def slow_init(conn):
+        if conn.execute("PRAGMA database_list").fetchone()[2].endswith("slow.db"):
+            started.set(); time.sleep(1.0)
+        init(conn)
+    monkeypatch.setattr(storage, "init_schema", slow_init)
+    pool = storage.ShardPool()
+    def open_slow():
+        with pool.connect(slow): pass
+    th = threading.Thread(target=open_slow); th.start(); started.wait(5)
+    t0 = time.monotonic()
+    with pool.connect(fast) as conn: conn.execute("SELECT 1")
+    assert time.monotonic() - t0 < 0.5   # 別ユーザーのスキーマ移行を待たない
+    th.join(); pool.close_all()
+
+def test_idle_writers_are_evicted(tmp_path):
+    pool = storage.ShardPool(max_open=2)
+    paths = [str(tmp_path / f"{i}.db") for i in range(5)]
+    for p in paths: pool.writer(p)
+    assert len(pool._writers) == 2 and list(pool._writers) == paths[-2:]
+    pool.close_all()
@@ -0,0 +1,116 @@
+# tests/test_sync.py — 2 つのシャードをスタンドイン（outfits.syncserver）経由で同期する
+import time
+import pytest, requests
+from outfits import storage, sync, syncserver
+
+@pytest.fixture
+def remote():
+    srv = syncserver.StandInServer().start()
+    yield sync.RestRemote(srv.url, None)
+    srv.stop()
+
+@pytest.fixture
+def shards(tmp_path):
+    paths = [str(tmp_path / "a.db"), str(tmp_path / "b.db")]
+    for p in paths: storage.init_db(p)
+    yield paths
+    storage.pool().close_all()
+
+def q(path, sql, params=()):
+    with storage.pool().connect(path) as conn:
+        return conn.execute(sql, params).fetchall()
+
+def on(path, fn, *args, **kw):
+    storage.use_db(path)
+    return fn(*args, **kw).result(30)
+
+class Flaky:
+    """最初の n 回の upsert だけ通信エラーにする"""
+    def __init__(self, remote, n=1):
+        self.remote = remote; self.n = n
+    def __getattr__(self, k):
+        return getattr(self.remote, k)
+    def upsert(self, rows):
+        if self.n:
+            self.n -= 1; raise requests.ConnectionError("offline")
+        self.remote.upsert(rows)
+
+def test_no_log_until_enabled(shards):
+    a, _ = shards
+    on(a, storage.add_item, "白シャツ", "トップス", "#ffffff", None, "綿", b"img-1", "")
+    assert q(a, "SELECT COUNT(*) FROM sync_log") == [(0,)]
+    assert q(a, "SELECT COUNT(*) FROM sqlite_master WHERE type='trigger'") == [(0,)]
+    assert q(a, "SELECT uid IS NOT NULL, updated_at > 0 FROM items") == [(1, 1)]
+
+def test_round_trip(shards, remote):
+    a, b = shards
+    iid = on(a, storage.add_item, "白シャツ", "トップス", "#ffffff", None, "綿", b"img-1", "")
+    on(a, storage.insert_outfit, "2024-05-01", None, "-", "-", "#ffffff", "#000000", [], b"img-2", "", links=[(iid, "upper", 3.0)])
+    on(a, storage.save_coord, iid, None, None, None, {}, 80.0)
+    on(a, storage.save_profile, season="summer")
+    sa, sb = sync.Syncer(a, remote, "u1"), sync.Syncer(b, remote, "u1")
+    assert sa.sync()["blobs_up"] == 2
+    out = sb.sync()
+    assert out["blobs_down"] == 2
+    assert q(b, "SELECT name, img FROM items") == [("白シャツ", b"img-1")]
+    assert q(b, "SELECT img FROM outfits") == [(b"img-2",)]
+    assert q(b, "SELECT season FROM profile") == [("summer",)]
+    assert q(b, """SELECT i.name, l.region FROM outfit_items l JOIN items i ON i.id=l.item_id""") == [("白シャツ", "upper")]
+    assert q(b, "SELECT i.name FROM coords c JOIN items i ON i.id=c.top_id") == [("白シャツ",)]
+
+def test_no_echo(shards, remote):
+    a, b = shards
+    on(a, storage.add_item, "靴", "シューズ", "#000000", None, "革", None, "")
+    sa, sb = sync.Syncer(a, remote, "u1"), sync.Syncer(b, remote, "u1")
+    sa.sync(); sb.sync()
+    # 取り込んだ行は applying=1 の間に書くのでログに載らず、送り返さない
+    assert sb.pending() == 0
+    assert sb.sync()["pushed"] == 0
+    assert sa.sync()["pushed"] == 0
+
+def test_last_writer_wins(shards, remote):
+    a, b = shards
+    on(a, storage.add_item, "シャツ", "トップス", "#ffffff", None, "綿", None, "")
+    sa, sb = sync.Syncer(a, remote, "u1"), sync.Syncer(b, remote, "u1")
+    sa.sync(); sb.sync()
+    ia, ib = q(a, "SELECT id FROM items")[0][0], q(b, "SELECT id FROM items")[0][0]
+    on(a, storage.update_item, ia, "A の名前", "トップス", "#ffffff", None, "綿", None, "")
+    time.sleep(0.01)
+    on(b, storage.update_item, ib, "B の名前", "トップス", "#ffffff", None, "綿", None, "")
+    sb.sync(); sa.sync(); sb.sync()   # 古い A の変更は後から送っても負ける
+    assert q(a, "SELECT name FROM items") == q(b, "SELECT name FROM items") == [("B の名前",)]
+
+def test_tie_breaks_on_device(remote):
+    row = lambda dev, name: {"owner": "u1", "tbl": "items", "uid": "x", "updated_at": 1000, "device": dev,
+                             "deleted": False, "data": {"name": name}}
+    remote.upsert([row("b", "B")]); remote.upsert([row("a", "A")])
+    got = remote.changes("u1", 0)
+    assert [(r["device"], r["data"]["name"]) for r in got] == [("b", "B")]
+
+def test_delete_propagates(shards, remote):
+    a, b = shards
+    iid = on(a, storage.add_item, "白シャツ", "トップス", "#ffffff", None, "綿", None, "")
+    on(a, storage.insert_outfit, "2024-05-01", None, "-", "-", "#ffffff", "#000000", [], None, "", links=[(iid, "upper", 3.0)])
+    on(a, storage.save_coord, iid, None, None, None, {}, 80.0)
+    sa, sb = sync.Syncer(a, remote, "u1"), sync.Syncer(b, remote, "u1")
+    sa.sync(); sb.sync()
+    on(a, storage.delete_item, iid)
+    # リンクの削除もアイテムが消える前に記録されている
+    assert ("outfit_items", "delete") in q(a, "SELECT tbl, op FROM sync_log")
+    sa.sync(); sb.sync()
+    assert q(b, "SELECT COUNT(*) FROM items") == [(0,)]
+    assert q(b, "SELECT COUNT(*) FROM outfit_items") == [(0,)]
+    assert q(b, "SELECT top_id FROM coords") == [(None,)]
+    assert q(b, "SELECT COUNT(*) FROM outfits") == [(1,)]
+
+def test_resume_after_failed_push(shards, remote):
+    a, b = shards
+    on(a, storage.add_item, "靴", "シューズ", "#000000", None, "革", b"img-1", "")
+    sa = sync.Syncer(a, Flaky(remote), "u1")
+    with pytest.raises(requests.ConnectionError):
+        sa.sync()
+    assert sa.pending() == 1   # 送れなかったログは残る
+    assert sa.sync()["pushed"] == 1
+    assert sa.pending() == 0
+    sync.Syncer(b, remote, "u1").sync()
+    assert q(b, "SELECT name, img FROM items") == [("靴", b"img-1")]